@@ -0,0 +1,92 @@
+"""
+Measure how JMRI imports scale with parse workers and whether the API stays
+responsive while a large import runs.
+
+Usage:
+    python benchmarks/bench_jmri_import.py [files]
+
+Without a server it parses `files` (default 200) synthetic LokSound 5 files
+with a process pool of 1, 2, 4... up to the CPU count and prints throughput.
+With REACT_APP_BACKEND_URL set it also posts them to /api/import/jmri while
+another thread polls /api/backup/settings, and prints the import time and
+the poll latencies.
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from jmri import parse_jmri_xml  # noqa: E402
+from bench_jmri_parser import synthetic_loksound_xml  # noqa: E402
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+POLL_INTERVAL = 0.05
+
+
+def make_files(count: int) -> list:
+    xml = synthetic_loksound_xml()
+    # Distinct brands so every file is a separate locomotive and a cache miss
+    return [xml.replace('mfg="Roco"', f'mfg="BENCH_{i}"', 1) for i in range(count)]
+
+
+def pool_scaling(files: list):
+    print(f"{'workers':>7} {'seconds':>8} {'files/s':>8}")
+    workers = 1
+    while True:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(parse_jmri_xml, files[:workers]))  # start the workers
+            started = time.perf_counter()
+            list(executor.map(parse_jmri_xml, files, chunksize=1))
+            elapsed = time.perf_counter() - started
+        print(f"{workers:>7} {elapsed:>8.2f} {len(files) / elapsed:>8.1f}")
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count() or 1)
+
+
+def api_responsiveness(files: list):
+    import requests
+
+    latencies = []
+    done = threading.Event()
+
+    def poll():
+        while not done.is_set():
+            started = time.perf_counter()
+            requests.get(f"{BASE_URL}/api/backup/settings")
+            latencies.append(time.perf_counter() - started)
+            time.sleep(POLL_INTERVAL)
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    started = time.perf_counter()
+    response = requests.post(f"{BASE_URL}/api/import/jmri", json=files)
+    elapsed = time.perf_counter() - started
+    done.set()
+    poller.join()
+    response.raise_for_status()
+
+    result = response.json()
+    print(f"import: {len(files)} files in {elapsed:.2f}s "
+          f"({result['inserted_count']} inserted, {result['updated_count']} updated)")
+    print(f"polls during import: {len(latencies)}, "
+          f"median {statistics.median(latencies) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms")
+
+
+def main(args):
+    count = int(args[0]) if args else 200
+    files = make_files(count)
+    print(f"{count} synthetic LokSound 5 files, {os.cpu_count()} CPUs")
+    pool_scaling(files)
+    if BASE_URL:
+        api_responsiveness(files)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
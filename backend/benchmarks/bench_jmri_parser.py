@@ -0,0 +1,252 @@
+"""
+Benchmark the streaming JMRI parser against the previous DOM-based parser.
+
+Usage:
+    python benchmarks/bench_jmri_parser.py [roster_file.xml ...]
+
+Pass real roster files (e.g. LokSound 5 exports from JMRI's roster folder).
+Without arguments a synthetic LokSound 5 file with a full CV dump is used.
+Both parsers must return the same data for every field the DOM parser produced.
+"""
+import random
+import sys
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jmri import parse_jmri_xml  # noqa: E402
+
+NUMBER = 10
+REPEAT = 7
+
+
+def parse_jmri_xml_dom(xml_content: str) -> dict:
+    """Previous ElementTree DOM parser, kept for comparison"""
+    try:
+        root = ET.fromstring(xml_content)
+        loco_elem = root.find('locomotive')
+        
+        if loco_elem is None:
+            return None
+        
+        # Extract basic info from locomotive attributes
+        # CORRECTED MAPPING:
+        # - XML 'model' attribute (e.g., "HN2351") -> app 'reference' field
+        # - XML 'roadName' attribute (e.g., "Ferrobus.591.500") -> app 'model' field
+        mfg = loco_elem.get('mfg', '')
+        xml_model = loco_elem.get('model', '')  # This is the reference (e.g., HN2351)
+        road_name = loco_elem.get('roadName', '')  # This is the model name (e.g., Ferrobus.591.500)
+        road_number = loco_elem.get('roadNumber', '')
+        dcc_address = loco_elem.get('dccAddress', '3')
+        comment = loco_elem.get('comment', '')
+        
+        # Extract decoder info
+        decoder_elem = loco_elem.find('decoder')
+        decoder_brand = ''
+        decoder_model = ''
+        decoder_family = ''
+        if decoder_elem is not None:
+            decoder_family = decoder_elem.get('family', '')
+            decoder_model = decoder_elem.get('model', '')
+            # Extract brand from family (e.g., "ESU LokSound 5 DCC" -> "ESU")
+            if decoder_family:
+                parts = decoder_family.split(' ')
+                if parts:
+                    decoder_brand = parts[0]
+        
+        # Extract Project Loco Name from varValue items
+        # Look in decoderDef section for varValue items
+        project_name = ''
+        project_type = ''
+        decoder_def = loco_elem.find('.//decoderDef')
+        if decoder_def is not None:
+            for var in decoder_def.findall('varValue'):
+                item = var.get('item', '')
+                value = var.get('value', '')
+                if item == 'Project Loco Name':
+                    project_name = value
+                elif item == 'Project Loco Type':
+                    project_type = value
+        
+        # Also check in values section (after decoderDef closes)
+        # The Project Loco Name might be stored as ASCII values in CVs 1.0.261-1.0.288
+        values_elem = loco_elem.find('values')
+        if values_elem is not None and not project_name:
+            # Try to extract project name from CV values (1.0.261-1.0.288 are ASCII chars)
+            project_chars = []
+            for cv_elem in values_elem.findall('CVvalue'):
+                cv_name = cv_elem.get('name', '')
+                cv_value = cv_elem.get('value', '')
+                if cv_name.startswith('1.0.') and cv_value.isdigit():
+                    cv_index = cv_name.split('.')[-1]
+                    if cv_index.isdigit():
+                        idx = int(cv_index)
+                        if 261 <= idx <= 288:
+                            char_val = int(cv_value)
+                            if char_val > 0:
+                                project_chars.append((idx, chr(char_val)))
+            if project_chars:
+                project_chars.sort(key=lambda x: x[0])
+                project_name = ''.join([c[1] for c in project_chars]).strip()
+        
+        # Extract function labels from functionlabels element
+        functions = []
+        func_labels = loco_elem.find('functionlabels')
+        if func_labels is not None:
+            for func_label in func_labels.findall('functionlabel'):
+                num = func_label.get('num', '')
+                lockable = func_label.get('lockable', 'false')
+                label_text = func_label.text or ''
+                if num and label_text:
+                    functions.append({
+                        'function_number': f'F{num}',
+                        'description': label_text,
+                        'is_sound': False  # Will be updated based on soundlabel
+                    })
+        
+        # Extract sound labels from soundlabels element
+        sound_labels = loco_elem.find('soundlabels')
+        if sound_labels is not None:
+            for sound_label in sound_labels.findall('soundlabel'):
+                num = sound_label.get('num', '')
+                label_text = sound_label.text or ''
+                if num and label_text:
+                    # Mark corresponding function as sound
+                    for func in functions:
+                        if func['function_number'] == f'F{num}':
+                            func['is_sound'] = True
+                            break
+                    else:
+                        # Add as new function if not found
+                        functions.append({
+                            'function_number': f'F{num}',
+                            'description': label_text,
+                            'is_sound': True
+                        })
+        
+        # Extract CV values
+        cv_modifications = []
+        if values_elem is not None:
+            # Get important CVs only (not all the ESU function mapping)
+            important_cvs = {
+                '1': 'Dirección corta',
+                '2': 'Vstart',
+                '3': 'Aceleración',
+                '4': 'Deceleración',
+                '5': 'Vmax',
+                '6': 'Vmedia',
+                '29': 'Configuración',
+                '17': 'Dirección larga (alta)',
+                '18': 'Dirección larga (baja)',
+            }
+            for cv_elem in values_elem.findall('CVvalue'):
+                cv_name = cv_elem.get('name', '')
+                cv_value = cv_elem.get('value', '')
+                # Only include simple CVs (not indexed ones like 16.2.xxx)
+                if cv_name and '.' not in cv_name and cv_name in important_cvs:
+                    try:
+                        cv_modifications.append({
+                            'cv_number': int(cv_name),
+                            'value': int(cv_value),
+                            'description': important_cvs.get(cv_name, f'CV{cv_name}')
+                        })
+                    except ValueError:
+                        pass
+        
+        # Determine locomotive type based on project name or road name
+        loco_type = 'diesel'  # default
+        name_lower = (road_name + ' ' + project_name).lower()
+        if any(x in name_lower for x in ['electric', 'eléctric', '252', '269', '251', 'ave', 'alta velocidad']):
+            loco_type = 'electrica'
+        elif any(x in name_lower for x in ['vapor', 'steam', '141', '240', '030']):
+            loco_type = 'vapor'
+        elif any(x in name_lower for x in ['automotor', 'dmu', 'emu', '592', '594', '596', 'ferrobus']):
+            loco_type = 'automotor'
+        elif any(x in name_lower for x in ['ave', 's-100', 's-102', 's-103', 'talgo', 'alta velocidad']):
+            loco_type = 'alta_velocidad'
+        
+        # Build sound project name from decoder info and project name
+        sound_project = ''
+        if decoder_brand and project_name:
+            sound_project = f"{decoder_brand} - {project_name}"
+        elif project_name:
+            sound_project = project_name
+        elif decoder_family:
+            sound_project = decoder_family
+        
+        return {
+            'brand': mfg,
+            'model': road_name or project_name,  # roadName goes to model
+            'reference': xml_model,  # XML model attribute goes to reference
+            'locomotive_type': loco_type,
+            'paint_scheme': '',
+            'registration_number': road_number,
+            'prototype_type': project_name or project_type,
+            'dcc_address': str(dcc_address) if dcc_address else "3",  # Convert to string
+            'decoder_brand': decoder_brand,
+            'decoder_model': decoder_model,
+            'sound_project': sound_project,
+            'notes': comment,
+            'cv_modifications': cv_modifications,
+            'condition': 'nuevo',
+            'functions': functions,
+        }
+    except ET.ParseError as e:
+        raise ValueError(f"Error parsing XML: {str(e)}")
+
+
+def synthetic_loksound_xml(indexed_cvs: int = 6000) -> str:
+    """A LokSound 5 roster entry with the CV volume of a full decoder read"""
+    rnd = random.Random(5)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<locomotive-config>',
+        '<locomotive id="252_017" fileName="252_017.xml" roadNumber="252-017-3" roadName="Serie 252" '
+        'mfg="Roco" model="73692" dccAddress="52" comment="Benchmark">',
+        '<decoder model="LokSound 5 micro DCC Next18" family="ESU LokSound 5 DCC" comment=""/>',
+        '<functionlabels>',
+    ]
+    parts += [f'<functionlabel num="{i}" lockable="false">Funcion {i}</functionlabel>' for i in range(32)]
+    parts += ['</functionlabels>', '<soundlabels>']
+    parts += [f'<soundlabel num="{i}">Sonido {i}</soundlabel>' for i in range(1, 32, 2)]
+    parts += ['</soundlabels>', '<values>', '<decoderDef><varValue item="Speed Table" value="1"/></decoderDef>']
+    parts += [f'<CVvalue name="{cv}" value="{rnd.randint(0, 255)}"/>' for cv in range(1, 1025)]
+    parts += [f'<CVvalue name="1.0.{261 + i}" value="{ord(c)}"/>' for i, c in enumerate("Renfe 252 Electric")]
+    parts += [f'<CVvalue name="16.{i // 256}.{257 + i % 256}" value="{rnd.randint(0, 255)}"/>'
+              for i in range(indexed_cvs)]
+    parts += ['</values>', '</locomotive>', '</locomotive-config>']
+    return '\n'.join(parts)
+
+
+def bench(parser, content) -> tuple:
+    """Best-of-REPEAT time per parse in ms and peak traced memory in KB"""
+    best = min(timeit.repeat(lambda: parser(content), number=NUMBER, repeat=REPEAT)) / NUMBER
+    tracemalloc.start()
+    parser(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best * 1000, peak / 1024
+
+
+def main(paths):
+    if paths:
+        files = [(path, Path(path).read_bytes()) for path in paths]
+    else:
+        files = [("synthetic LokSound 5", synthetic_loksound_xml().encode('utf-8'))]
+
+    print(f"{'file':32} {'size':>9} {'dom ms':>8} {'stream ms':>10} {'dom KB':>8} {'stream KB':>10}")
+    for name, content in files:
+        expected = parse_jmri_xml_dom(content)
+        parsed = parse_jmri_xml(content)
+        assert {k: parsed[k] for k in expected} == expected, f"{name}: parsers disagree"
+        dom_ms, dom_kb = bench(parse_jmri_xml_dom, content)
+        stream_ms, stream_kb = bench(parse_jmri_xml, content)
+        print(f"{str(name)[-32:]:32} {len(content):>9} {dom_ms:>8.2f} {stream_ms:>10.2f} "
+              f"{dom_kb:>8.0f} {stream_kb:>10.0f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,148 @@
+"""
+Benchmark the shared PDF engine against building styles on every request.
+
+Usage:
+    python benchmarks/bench_pdf_engine.py [rows ...]
+
+Measures the per-request setup the reports used to repeat (sample style sheet,
+ParagraphStyles and TableStyles) and renders the locomotive list with the
+previous per-request renderer and with pdf_reports, for each row count
+(default: 1, 50 and 1000 locomotives).
+"""
+import random
+import sys
+import timeit
+from io import BytesIO
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from reportlab.lib import colors  # noqa: E402
+from reportlab.lib.pagesizes import A4  # noqa: E402
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle  # noqa: E402
+from reportlab.lib.units import cm  # noqa: E402
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer  # noqa: E402
+
+from pdf_reports import render_locomotives  # noqa: E402
+
+NUMBER = 20
+REPEAT = 5
+
+
+def per_request_setup():
+    """What every report built before drawing anything"""
+    styles = getSampleStyleSheet()
+    ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, spaceAfter=20, alignment=1)
+    ParagraphStyle('Subtitle', parent=styles['Heading2'], fontSize=14, spaceAfter=10)
+    TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+    ])
+    return styles
+
+
+def render_locomotives_per_request(data: dict) -> bytes:
+    """Previous locomotive list renderer, kept for comparison"""
+    locomotives = data['locomotives']
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=1*cm, leftMargin=1*cm, topMargin=1*cm, bottomMargin=1*cm)
+    elements = []
+    styles = getSampleStyleSheet()
+
+    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, spaceAfter=20, alignment=1)
+    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Heading2'], fontSize=14, spaceAfter=10)
+
+    elements.append(Paragraph("Catálogo de Locomotoras", title_style))
+    elements.append(Paragraph(f"Generado: {data['generated']}", styles['Normal']))
+    elements.append(Paragraph(f"Ordenado por: {data['sort_field']} ({data['sort_order']})", styles['Normal']))
+    elements.append(Spacer(1, 20))
+
+    if locomotives:
+        elements.append(Paragraph(f"Locomotoras ({len(locomotives)})", subtitle_style))
+        table_data = [['Marca', 'Modelo', 'Referencia', 'DCC', 'Tipo', 'Era', 'Precio']]
+        for loco in locomotives:
+            table_data.append([
+                (loco.get('brand') or '')[:15],
+                (loco.get('model') or '')[:20],
+                (loco.get('reference') or '')[:12],
+                str(loco.get('dcc_address') or '')[:8],
+                (loco.get('locomotive_type') or '')[:12],
+                (loco.get('era') or '')[:5],
+                f"{loco.get('price', 0) or 0:.2f}€"
+            ])
+
+        table = Table(table_data, colWidths=[2.5*cm, 4*cm, 2.5*cm, 2*cm, 2.5*cm, 1.5*cm, 2*cm])
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 9),
+            ('FONTSIZE', (0, 1), (-1, -1), 8),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+        ]))
+        elements.append(table)
+
+        total_value = sum(loco.get('price', 0) or 0 for loco in locomotives)
+        elements.append(Spacer(1, 20))
+        elements.append(Paragraph(f"Total: {len(locomotives)} locomotoras - Valor: {total_value:.2f}€", styles['Normal']))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def render_locomotives_engine(data: dict) -> bytes:
+    buffer = BytesIO()
+    render_locomotives(data, buffer)
+    return buffer.getvalue()
+
+
+def synthetic_report(rows: int) -> dict:
+    rnd = random.Random(7)
+    brands = ["Roco", "Arnold", "Electrotren", "Mabar", "Fleischmann", "Piko"]
+    return {
+        "generated": "01/01/2025 10:00",
+        "filter_info": [],
+        "sort_field": "brand",
+        "sort_order": "asc",
+        "locomotives": [{
+            "brand": rnd.choice(brands),
+            "model": f"Serie {rnd.randint(200, 599)}",
+            "reference": f"R{i:05}",
+            "dcc_address": str(rnd.randint(1, 9999)),
+            "locomotive_type": rnd.choice(["electrica", "diesel", "vapor"]),
+            "era": rnd.choice(["III", "IV", "V", "VI"]),
+            "price": round(rnd.uniform(80, 450), 2),
+        } for i in range(rows)],
+    }
+
+
+def best_ms(func, *args, number=NUMBER) -> float:
+    return min(timeit.repeat(lambda: func(*args), number=number, repeat=REPEAT)) / number * 1000
+
+
+def main(args):
+    row_counts = [int(arg) for arg in args] or [1, 50, 1000]
+
+    print(f"per-request style setup: {best_ms(per_request_setup, number=200):.3f} ms (now 0, built at import)")
+    print()
+    print(f"{'rows':>6} {'per-request ms':>15} {'engine ms':>10} {'saved':>7}")
+    for rows in row_counts:
+        data = synthetic_report(rows)
+        number = max(1, NUMBER * 50 // max(rows, 50))
+        before = best_ms(render_locomotives_per_request, data, number=number)
+        after = best_ms(render_locomotives_engine, data, number=number)
+        print(f"{rows:>6} {before:>15.2f} {after:>10.2f} {(before - after) / before:>7.1%}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
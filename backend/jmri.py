@@ -0,0 +1,490 @@
+"""
+JMRI roster file parsing.
+
+Kept apart from server.py so the parser can run in worker processes without
+importing the app and its database client.
+"""
+import base64
+import xml.etree.ElementTree as ET
+
+# CVs copied into cv_modifications (not all the ESU function mapping)
+IMPORTANT_CVS = {
+    '1': 'Dirección corta',
+    '2': 'Vstart',
+    '3': 'Aceleración',
+    '4': 'Deceleración',
+    '5': 'Vmax',
+    '6': 'Vmedia',
+    '29': 'Configuración',
+    '17': 'Dirección larga (alta)',
+    '18': 'Dirección larga (baja)',
+}
+
+# LokSound decoders store the Project Loco Name as ASCII in CVs 1.0.261-1.0.288
+PROJECT_NAME_CV_PREFIX = '1.0.'
+PROJECT_NAME_CV_RANGE = range(261, 289)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Full CV sheet: CVs 1-1024 packed one byte each with a bitmask of the CVs set,
+# indexed CVs (e.g. 16.2.257) as one page per prefix covering the CVs present.
+# Indexed CVs live in 257-512 on real decoders; the limits bound what a
+# malformed file can make the parser allocate.
+CV_SHEET_SIZE = 1024
+MAX_INDEXED_CV = 1024
+MAX_INDEXED_PAGES = 256
+
+
+def _iter_chunks(source):
+    """Yield str/bytes chunks from a string, bytes or a readable file object"""
+    if isinstance(source, (str, bytes, bytearray, memoryview)):
+        for start in range(0, len(source), READ_CHUNK_SIZE):
+            yield source[start:start + READ_CHUNK_SIZE]
+        return
+    while True:
+        chunk = source.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bit_is_set(mask: bytes, position: int) -> bool:
+    return bool(mask[position >> 3] & (1 << (position & 7)))
+
+
+def _as_bytes(value) -> bytes:
+    # Backups store binary fields as base64 strings
+    if isinstance(value, str):
+        return base64.b64decode(value)
+    return bytes(value)
+
+
+class _CVSheetBuilder:
+    """Accumulates CV values straight into byte arrays while the file is parsed"""
+
+    def __init__(self):
+        self.values = bytearray(CV_SHEET_SIZE)
+        self.mask = bytearray(CV_SHEET_SIZE // 8)
+        self.pages = {}  # prefix -> (values, mask) indexed by CV number
+        self.count = 0
+        # Indexed CVs come grouped by prefix, so remember the last page used
+        self.last_prefix = None
+        self.last_page = None
+
+    def add(self, name: str, value: str):
+        if not value.isdigit():
+            return
+        value = int(value)
+        if value > 255:
+            return
+        dot = name.rfind('.')
+        if dot < 0:
+            if name.isdigit():
+                cv = int(name) - 1
+                if 0 <= cv < CV_SHEET_SIZE:
+                    self.values[cv] = value
+                    bit = 1 << (cv & 7)
+                    if not self.mask[cv >> 3] & bit:
+                        self.mask[cv >> 3] |= bit
+                        self.count += 1
+            return
+        index = name[dot + 1:]
+        if dot == 0 or not index.isdigit():
+            return
+        cv = int(index)
+        if cv > MAX_INDEXED_CV:
+            return
+        prefix = name[:dot]
+        if prefix == self.last_prefix:
+            page = self.last_page
+        else:
+            page = self.pages.get(prefix)
+            if page is None:
+                if len(self.pages) >= MAX_INDEXED_PAGES:
+                    return
+                page = self.pages[prefix] = (bytearray(MAX_INDEXED_CV + 1), bytearray(MAX_INDEXED_CV // 8 + 1))
+            self.last_prefix = prefix
+            self.last_page = page
+        page_values, page_mask = page
+        page_values[cv] = value
+        bit = 1 << (cv & 7)
+        if not page_mask[cv >> 3] & bit:
+            page_mask[cv >> 3] |= bit
+            self.count += 1
+
+    def pack(self) -> dict:
+        """The cv_sheet document, None if no CVs were added"""
+        if not self.count:
+            return None
+        indexed = []
+        for prefix in sorted(self.pages):
+            page_values, page_mask = self.pages[prefix]
+            bits = int.from_bytes(page_mask, 'little')
+            start = (bits & -bits).bit_length() - 1
+            end = bits.bit_length() - 1
+            length = end - start + 1
+            indexed.append({
+                'prefix': prefix,
+                'start': start,
+                'values': bytes(page_values[start:end + 1]),
+                # Re-based so bit 0 is the first CV of the page
+                'mask': (bits >> start).to_bytes((length + 7) // 8, 'little'),
+            })
+        return {
+            'count': self.count,
+            'values': bytes(self.values),
+            'mask': bytes(self.mask),
+            'indexed': indexed,
+        }
+
+
+def pack_cv_sheet(cv_values) -> dict:
+    """Pack (name, value) CV pairs into a cv_sheet document, None if there are none"""
+    builder = _CVSheetBuilder()
+    for name, value in cv_values:
+        builder.add(name, value)
+    return builder.pack()
+
+
+def unpack_cv_sheet(sheet: dict) -> dict:
+    """Decode a cv_sheet into {cv name: value}, plain CVs first"""
+    cvs = {}
+    if not sheet:
+        return cvs
+    values = _as_bytes(sheet['values'])
+    mask = _as_bytes(sheet['mask'])
+    for position in range(len(values)):
+        if _bit_is_set(mask, position):
+            cvs[str(position + 1)] = values[position]
+    for page in sheet.get('indexed') or []:
+        page_values = _as_bytes(page['values'])
+        page_mask = _as_bytes(page['mask'])
+        for position in range(len(page_values)):
+            if _bit_is_set(page_mask, position):
+                cvs[f"{page['prefix']}.{page['start'] + position}"] = page_values[position]
+    return cvs
+
+
+class _RosterTarget:
+    """
+    Parser target collecting everything parse_jmri_xml needs in one pass.
+
+    The parser calls start/end/data as it reads, so no element tree is built
+    and memory does not grow with the number of CVs.
+    """
+
+    def __init__(self):
+        self.depth = -1  # depth of the current element; the root element is 0
+        self.loco_attrib = None
+        self.loco_done = False
+        self.decoder_attrib = None
+        self.decoder_def_depth = None  # depth of the first decoderDef, -1 once it is closed
+        self.seen = set()  # direct children of locomotive already handled (first one wins)
+        self.active_child = None  # direct child of locomotive currently being read
+        self.in_values = False
+        self.label_text = None  # text of the function/sound label being read
+        self.label_attrib = None
+        self.label_collecting = False  # False once a child element starts inside the label
+
+        self.var_values = {}
+        self.cv_sheet = _CVSheetBuilder()  # every CV, for the full CV sheet
+        self.project_chars = []
+        self.cv_modifications = []
+        self.functions = []
+        self.sound_labels = []
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        depth = self.depth
+        if self.in_values and depth == 3 and tag == 'CVvalue':
+            # Hot path: LokSound files carry thousands of CVvalue elements
+            cv_name = attrib.get('name', '')
+            self.cv_sheet.add(cv_name, attrib.get('value', ''))
+            description = IMPORTANT_CVS.get(cv_name)
+            if description is not None:
+                try:
+                    self.cv_modifications.append({
+                        'cv_number': int(cv_name),
+                        'value': int(attrib.get('value', '')),
+                        'description': description
+                    })
+                except ValueError:
+                    pass
+            elif cv_name.startswith(PROJECT_NAME_CV_PREFIX):
+                cv_value = attrib.get('value', '')
+                cv_index = cv_name.rsplit('.', 1)[-1]
+                if cv_value.isdigit() and cv_index.isdigit() and int(cv_index) in PROJECT_NAME_CV_RANGE:
+                    char_val = int(cv_value)
+                    if char_val > 0:
+                        self.project_chars.append((int(cv_index), chr(char_val)))
+            return
+
+        # Like ElementTree's .text, a label's text stops at its first child element
+        self.label_collecting = False
+        if self.loco_done:
+            return
+        if depth == 1:
+            if tag == 'locomotive':
+                self.loco_attrib = attrib
+            return
+        if self.loco_attrib is None or depth < 2:
+            return
+
+        if depth == 2:
+            self.active_child = None if tag in self.seen else tag
+            self.seen.add(tag)
+            if self.active_child == 'decoder':
+                self.decoder_attrib = attrib
+            self.in_values = self.active_child == 'values'
+        elif depth == 3 and (
+                (self.active_child == 'functionlabels' and tag == 'functionlabel')
+                or (self.active_child == 'soundlabels' and tag == 'soundlabel')):
+            self.label_text = []
+            self.label_attrib = attrib
+            self.label_collecting = True
+
+        if tag == 'decoderDef' and self.decoder_def_depth is None:
+            self.decoder_def_depth = depth
+        elif tag == 'varValue' and self.decoder_def_depth is not None and depth == self.decoder_def_depth + 1:
+            self.var_values[attrib.get('item', '')] = attrib.get('value', '')
+
+    def data(self, text):
+        if self.label_collecting:
+            self.label_text.append(text)
+
+    def end(self, tag):
+        depth = self.depth
+        self.depth -= 1
+        if self.loco_done or self.loco_attrib is None:
+            return
+        if depth == 1:
+            self.loco_done = True
+        elif depth == 2:
+            self.in_values = False
+        elif depth == 3 and self.label_text is not None:
+            num = self.label_attrib.get('num', '')
+            label_text = ''.join(self.label_text)
+            self.label_text = None
+            self.label_collecting = False
+            if tag == 'functionlabel':
+                if num and label_text:
+                    self.functions.append({
+                        'function_number': f'F{num}',
+                        'description': label_text,
+                        'is_sound': False  # Will be updated based on soundlabel
+                    })
+            else:
+                self.sound_labels.append((num, label_text))
+        if depth == self.decoder_def_depth and tag == 'decoderDef':
+            self.decoder_def_depth = -1
+
+    def close(self):
+        return self
+
+
+def parse_roster_index(source) -> list:
+    """Return the locomotive file names listed in a JMRI roster.xml index"""
+    file_names = []
+    try:
+        for _, elem in ET.iterparse(source):
+            if elem.tag == 'locomotive':
+                file_name = elem.get('fileName')
+                if file_name:
+                    file_names.append(file_name)
+                elem.clear()
+    except ET.ParseError as e:
+        raise ValueError(f"Error parsing roster.xml: {str(e)}")
+    return file_names
+
+
+def parse_jmri_xml(xml_content) -> dict:
+    """
+    Parse JMRI locomotive XML and extract relevant data.
+
+    Single streaming pass over the document: accepts str, bytes or a binary
+    file object.
+    """
+    parser = ET.XMLParser(target=_RosterTarget())
+    try:
+        for chunk in _iter_chunks(xml_content):
+            parser.feed(chunk)
+        roster = parser.close()
+    except ET.ParseError as e:
+        raise ValueError(f"Error parsing XML: {str(e)}")
+
+    loco_attrib = roster.loco_attrib
+    if loco_attrib is None:
+        return None
+    decoder_attrib = roster.decoder_attrib
+    var_values = roster.var_values
+    project_chars = roster.project_chars
+    cv_modifications = roster.cv_modifications
+    functions = roster.functions
+    sound_labels = roster.sound_labels
+
+    # Extract basic info from locomotive attributes
+    # CORRECTED MAPPING:
+    # - XML 'model' attribute (e.g., "HN2351") -> app 'reference' field
+    # - XML 'roadName' attribute (e.g., "Ferrobus.591.500") -> app 'model' field
+    mfg = loco_attrib.get('mfg', '')
+    xml_model = loco_attrib.get('model', '')  # This is the reference (e.g., HN2351)
+    road_name = loco_attrib.get('roadName', '')  # This is the model name (e.g., Ferrobus.591.500)
+    road_number = loco_attrib.get('roadNumber', '')
+    dcc_address = loco_attrib.get('dccAddress', '3')
+    comment = loco_attrib.get('comment', '')
+
+    # Extract decoder info
+    decoder_brand = ''
+    decoder_model = ''
+    decoder_family = ''
+    if decoder_attrib is not None:
+        decoder_family = decoder_attrib.get('family', '')
+        decoder_model = decoder_attrib.get('model', '')
+        # Extract brand from family (e.g., "ESU LokSound 5 DCC" -> "ESU")
+        if decoder_family:
+            decoder_brand = decoder_family.split(' ')[0]
+
+    # Project Loco Name from decoderDef, falling back to the ASCII CVs
+    project_name = var_values.get('Project Loco Name', '')
+    project_type = var_values.get('Project Loco Type', '')
+    if not project_name and project_chars:
+        project_chars.sort(key=lambda x: x[0])
+        project_name = ''.join(c[1] for c in project_chars).strip()
+
+    # Mark functions that have a sound label, adding the ones not found
+    function_index = {}
+    for index, func in enumerate(functions):
+        function_index.setdefault(func['function_number'], index)
+    for num, label_text in sound_labels:
+        if num and label_text:
+            function_number = f'F{num}'
+            if function_number in function_index:
+                functions[function_index[function_number]]['is_sound'] = True
+            else:
+                function_index[function_number] = len(functions)
+                functions.append({
+                    'function_number': function_number,
+                    'description': label_text,
+                    'is_sound': True
+                })
+
+    # Determine locomotive type based on project name or road name
+    loco_type = 'diesel'  # default
+    name_lower = (road_name + ' ' + project_name).lower()
+    if any(x in name_lower for x in ['electric', 'eléctric', '252', '269', '251', 'ave', 'alta velocidad']):
+        loco_type = 'electrica'
+    elif any(x in name_lower for x in ['vapor', 'steam', '141', '240', '030']):
+        loco_type = 'vapor'
+    elif any(x in name_lower for x in ['automotor', 'dmu', 'emu', '592', '594', '596', 'ferrobus']):
+        loco_type = 'automotor'
+    elif any(x in name_lower for x in ['ave', 's-100', 's-102', 's-103', 'talgo', 'alta velocidad']):
+        loco_type = 'alta_velocidad'
+
+    # Build sound project name from decoder info and project name
+    sound_project = ''
+    if decoder_brand and project_name:
+        sound_project = f"{decoder_brand} - {project_name}"
+    elif project_name:
+        sound_project = project_name
+    elif decoder_family:
+        sound_project = decoder_family
+
+    return {
+        'jmri_id': loco_attrib.get('id', ''),  # JMRI roster entry id
+        'brand': mfg,
+        'model': road_name or project_name,  # roadName goes to model
+        'reference': xml_model,  # XML model attribute goes to reference
+        'locomotive_type': loco_type,
+        'paint_scheme': '',
+        'registration_number': road_number,
+        'prototype_type': project_name or project_type,
+        'dcc_address': str(dcc_address) if dcc_address else "3",  # Convert to string
+        'decoder_brand': decoder_brand,
+        'decoder_model': decoder_model,
+        'sound_project': sound_project,
+        'notes': comment,
+        'cv_modifications': cv_modifications,
+        'condition': 'nuevo',
+        'functions': functions,
+        'cv_sheet': roster.cv_sheet.pack(),
+    }
+
+
+# ============== EXPORT ==============
+
+LOCOMOTIVE_SCHEMA = 'http://jmri.org/xml/schema/locomotive-config.xsd'
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+
+
+def _roster_attributes(loco: dict, roster_id: str, file_name: str) -> dict:
+    """Locomotive attributes in the form parse_jmri_xml reads them back"""
+    return {
+        'id': roster_id,
+        'fileName': file_name,
+        'roadNumber': loco.get('registration_number') or '',
+        'roadName': loco.get('model') or '',
+        'mfg': loco.get('brand') or '',
+        'model': loco.get('reference') or '',
+        'dccAddress': str(loco.get('dcc_address') or ''),
+        'comment': loco.get('notes') or '',
+    }
+
+
+def build_jmri_xml(loco: dict, roster_id: str, file_name: str) -> bytes:
+    """Build a JMRI locomotive file for a locomotive, the inverse of parse_jmri_xml"""
+    root = ET.Element('locomotive-config', {
+        'xmlns:xsi': XSI_NAMESPACE,
+        'xsi:noNamespaceSchemaLocation': LOCOMOTIVE_SCHEMA,
+    })
+    locomotive = ET.SubElement(root, 'locomotive', _roster_attributes(loco, roster_id, file_name))
+
+    decoder_brand = loco.get('decoder_brand') or ''
+    decoder_model = loco.get('decoder_model') or ''
+    if decoder_brand or decoder_model:
+        # The parser takes the brand from the first word of the family
+        family = f"{decoder_brand} {decoder_model}".strip()
+        ET.SubElement(locomotive, 'decoder', {'family': family, 'model': decoder_model})
+
+    functions = loco.get('functions') or []
+    if functions:
+        function_labels = ET.SubElement(locomotive, 'functionlabels')
+        sound_labels = None
+        for func in functions:
+            num = str(func.get('function_number', '')).upper().lstrip('F')
+            description = func.get('description') or ''
+            if not num or not description:
+                continue
+            label = ET.SubElement(function_labels, 'functionlabel', {'num': num, 'lockable': 'false'})
+            label.text = description
+            if func.get('is_sound'):
+                if sound_labels is None:
+                    sound_labels = ET.SubElement(locomotive, 'soundlabels')
+                sound_label = ET.SubElement(sound_labels, 'soundlabel', {'num': num})
+                sound_label.text = description
+
+    project_name = loco.get('prototype_type') or ''
+    # The full sheet when there is one, with the CVs edited in the app on top
+    cvs = {name: str(value) for name, value in unpack_cv_sheet(loco.get('cv_sheet')).items()}
+    for cv in loco.get('cv_modifications') or []:
+        cvs[str(cv.get('cv_number', ''))] = str(cv.get('value', ''))
+    if project_name or cvs:
+        values = ET.SubElement(locomotive, 'values')
+        if project_name:
+            decoder_def = ET.SubElement(values, 'decoderDef')
+            ET.SubElement(decoder_def, 'varValue', {'item': 'Project Loco Name', 'value': project_name})
+        for name, value in cvs.items():
+            ET.SubElement(values, 'CVvalue', {'name': name, 'value': value})
+
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+def build_roster_index(entries: list) -> bytes:
+    """Build roster.xml from (loco, roster_id, file_name) entries"""
+    root = ET.Element('roster-config', {
+        'xmlns:xsi': XSI_NAMESPACE,
+        'xsi:noNamespaceSchemaLocation': 'http://jmri.org/xml/schema/roster-2-9-6.xsd',
+    })
+    roster = ET.SubElement(root, 'roster')
+    for loco, roster_id, file_name in entries:
+        ET.SubElement(roster, 'locomotive', _roster_attributes(loco, roster_id, file_name))
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
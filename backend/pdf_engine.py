@@ -0,0 +1,128 @@
+"""
+Shared building blocks for the PDF reports.
+
+Paragraph styles and table styles are built once when the module is imported
+(once per worker process) instead of on every request, and each report
+describes its tables as column specs. Only the built-in Helvetica fonts are
+used, so there are no fonts to register.
+"""
+from typing import Callable, List, NamedTuple, Optional
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+
+# ============== PARAGRAPH STYLES ==============
+
+_SAMPLE = getSampleStyleSheet()
+
+NORMAL = _SAMPLE['Normal']
+TITLE = ParagraphStyle('Title', parent=_SAMPLE['Heading1'], fontSize=18, spaceAfter=20, alignment=1)
+SUBTITLE = ParagraphStyle('Subtitle', parent=_SAMPLE['Heading2'], fontSize=14, spaceAfter=10)
+COMPOSITION_TITLE = ParagraphStyle('CompTitle', parent=_SAMPLE['Heading3'], fontSize=12, spaceBefore=15,
+                                   spaceAfter=5, textColor=colors.darkblue)
+SHEET_TITLE = ParagraphStyle('SheetTitle', parent=_SAMPLE['Heading1'], fontSize=16, spaceAfter=10, alignment=1)
+LOCOMOTIVE_SECTION = ParagraphStyle('Section', parent=_SAMPLE['Heading2'], fontSize=12, spaceBefore=15,
+                                    spaceAfter=8, textColor=colors.darkblue)
+ROLLING_STOCK_SECTION = ParagraphStyle('StockSection', parent=LOCOMOTIVE_SECTION, textColor=colors.darkgreen)
+
+# ============== TABLE STYLES ==============
+
+def _list_table_style(header_color, body_background=None) -> TableStyle:
+    commands = [
+        ('BACKGROUND', (0, 0), (-1, 0), header_color),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ]
+    if body_background is not None:
+        commands.append(('BACKGROUND', (0, 1), (-1, -1), body_background))
+    commands += [
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+    ]
+    return TableStyle(commands)
+
+def _detail_table_style(align) -> TableStyle:
+    """Functions and CVs on a data sheet; `align` centers some columns"""
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        align,
+    ])
+
+LOCOMOTIVE_LIST = _list_table_style(colors.darkblue)
+CATALOG_LOCOMOTIVE_LIST = _list_table_style(colors.darkblue, body_background=colors.beige)
+ROLLING_STOCK_LIST = _list_table_style(colors.darkgreen)
+
+SUMMARY = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.lightblue),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+])
+
+COMPOSITION_INFO = TableStyle([
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('TEXTCOLOR', (0, 0), (0, -1), colors.grey),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
+])
+
+# Label/value pairs, two per row
+SHEET_INFO = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+])
+
+SHEET_DCC = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+])
+
+SHEET_FUNCTIONS = _detail_table_style(('ALIGN', (2, 0), (2, -1), 'CENTER'))
+SHEET_CVS = _detail_table_style(('ALIGN', (0, 0), (1, -1), 'CENTER'))
+
+# ============== COLUMN SPECS ==============
+
+class Column(NamedTuple):
+    header: str
+    width: float
+    value: Callable[[dict], str]
+
+def text(field: str, limit: Optional[int] = None) -> Callable[[dict], str]:
+    """The field as text, cut to `limit` characters"""
+    def value(doc: dict) -> str:
+        return str(doc.get(field) or '')[:limit]
+    return value
+
+def price(field: str = 'price') -> Callable[[dict], str]:
+    def value(doc: dict) -> str:
+        return euros(doc.get(field, 0) or 0)
+    return value
+
+def euros(amount: float) -> str:
+    return f"{amount:.2f}€"
+
+def table(columns: List[Column], rows: List[dict], style: TableStyle) -> Table:
+    """A list table: the column headers, then one row per document"""
+    data = [[column.header for column in columns]]
+    data += [[column.value(row) for column in columns] for row in rows]
+    return Table(data, colWidths=[column.width for column in columns], style=style)
+
+def document(buffer, margin: float = 1*cm) -> SimpleDocTemplate:
+    return SimpleDocTemplate(buffer, pagesize=A4, rightMargin=margin, leftMargin=margin,
+                             topMargin=margin, bottomMargin=margin)
@@ -0,0 +1,302 @@
+"""
+PDF report rendering.
+
+Kept apart from server.py so reports can be built in worker processes without
+importing the app and its database client. Each renderer takes plain data
+(documents already fetched by the endpoint) and writes the PDF to a binary
+file object. Styles, table templates and column helpers come from pdf_engine.
+"""
+import os
+
+from reportlab.lib.units import cm
+from reportlab.platypus import Table, Paragraph, Spacer, PageBreak
+
+from pdf_engine import (
+    Column, text, price, euros, table, document,
+    NORMAL, TITLE, SUBTITLE, COMPOSITION_TITLE, SHEET_TITLE, LOCOMOTIVE_SECTION, ROLLING_STOCK_SECTION,
+    LOCOMOTIVE_LIST, CATALOG_LOCOMOTIVE_LIST, ROLLING_STOCK_LIST, SUMMARY, COMPOSITION_INFO,
+    SHEET_INFO, SHEET_DCC, SHEET_FUNCTIONS, SHEET_CVS,
+)
+
+# ============== COLUMN SPECS ==============
+
+def _decoder(loco: dict) -> str:
+    return f"{loco.get('decoder_brand') or ''} {loco.get('decoder_model') or ''}"[:15]
+
+CATALOG_LOCOMOTIVE_COLUMNS = [
+    Column('Marca', 2.5*cm, text('brand', 15)),
+    Column('Modelo', 4*cm, text('model', 20)),
+    Column('Ref.', 2.5*cm, text('reference', 12)),
+    Column('Tipo', 2*cm, text('locomotive_type', 10)),
+    Column('DCC', 1.2*cm, text('dcc_address')),
+    Column('Decoder', 3*cm, _decoder),
+    Column('Precio', 2*cm, price()),
+]
+
+CATALOG_ROLLING_STOCK_COLUMNS = [
+    Column('Marca', 2.5*cm, text('brand', 15)),
+    Column('Modelo', 4*cm, text('model', 20)),
+    Column('Referencia', 2.5*cm, text('reference', 12)),
+    Column('Matrícula', 2.5*cm, text('registration_number', 12)),
+    Column('Tipo', 2.5*cm, text('stock_type', 12)),
+    Column('Era', 1.5*cm, text('era', 8)),
+    Column('Precio', 2*cm, price()),
+]
+
+LOCOMOTIVE_COLUMNS = [
+    Column('Marca', 2.5*cm, text('brand', 15)),
+    Column('Modelo', 4*cm, text('model', 20)),
+    Column('Referencia', 2.5*cm, text('reference', 12)),
+    Column('DCC', 2*cm, text('dcc_address', 8)),
+    Column('Tipo', 2.5*cm, text('locomotive_type', 12)),
+    Column('Era', 1.5*cm, text('era', 5)),
+    Column('Precio', 2*cm, price()),
+]
+
+ROLLING_STOCK_COLUMNS = [
+    Column('Marca', 2.5*cm, text('brand', 15)),
+    Column('Modelo', 3.5*cm, text('model', 18)),
+    Column('Referencia', 2.5*cm, text('reference', 12)),
+    Column('Matrícula', 2.5*cm, text('registration_number', 12)),
+    Column('Tipo', 2.5*cm, text('stock_type', 12)),
+    Column('Era', 1.5*cm, text('era', 5)),
+    Column('Precio', 2*cm, price()),
+]
+
+FUNCTION_COLUMNS = [
+    Column('Función', 2.5*cm, text('function_number')),
+    Column('Descripción', 10*cm, text('description')),
+    Column('Sonido', 2*cm, lambda func: 'Sí' if func.get('is_sound') else 'No'),
+]
+
+CV_COLUMNS = [
+    Column('CV', 2*cm, text('cv_number')),
+    Column('Valor', 2*cm, text('value')),
+    Column('Descripción', 10*cm, text('description')),
+]
+
+# ============== REPORTS ==============
+
+def _total(items: list) -> float:
+    return sum(item.get('price', 0) or 0 for item in items)
+
+def _list_header(elements: list, title: str, data: dict):
+    elements.append(Paragraph(title, TITLE))
+    elements.append(Paragraph(f"Generado: {data['generated']}", NORMAL))
+    if data['filter_info']:
+        elements.append(Paragraph(f"Filtros: {', '.join(data['filter_info'])}", NORMAL))
+    elements.append(Paragraph(f"Ordenado por: {data['sort_field']} ({data['sort_order']})", NORMAL))
+    elements.append(Spacer(1, 20))
+
+def _build(elements: list, output, margin: float = 1*cm):
+    document(output, margin).build(elements)
+
+
+def render_catalog(data: dict, output):
+    """Locomotives and rolling stock tables plus a value summary"""
+    locomotives = data['locomotives']
+    rolling_stock = data['rolling_stock']
+    elements = [
+        Paragraph("Catálogo de Colección Ferroviaria", TITLE),
+        Paragraph(f"Generado: {data['generated']}", NORMAL),
+        Spacer(1, 20),
+    ]
+
+    if locomotives:
+        elements.append(Paragraph(f"Locomotoras ({len(locomotives)})", SUBTITLE))
+        elements.append(table(CATALOG_LOCOMOTIVE_COLUMNS, locomotives, CATALOG_LOCOMOTIVE_LIST))
+        elements.append(Spacer(1, 20))
+
+    if rolling_stock:
+        elements.append(Paragraph(f"Material Rodante ({len(rolling_stock)})", SUBTITLE))
+        elements.append(table(CATALOG_ROLLING_STOCK_COLUMNS, rolling_stock, ROLLING_STOCK_LIST))
+        elements.append(Spacer(1, 20))
+
+    # Summary
+    total_locos = _total(locomotives)
+    total_stock = _total(rolling_stock)
+    elements.append(Paragraph("Resumen", SUBTITLE))
+    summary_data = [
+        ['Concepto', 'Cantidad', 'Valor'],
+        ['Locomotoras', str(len(locomotives)), euros(total_locos)],
+        ['Material Rodante', str(len(rolling_stock)), euros(total_stock)],
+        ['TOTAL', str(len(locomotives) + len(rolling_stock)), euros(total_locos + total_stock)],
+    ]
+    elements.append(Table(summary_data, colWidths=[6*cm, 3*cm, 3*cm], style=SUMMARY))
+    _build(elements, output)
+
+
+def render_locomotives(data: dict, output):
+    """Filtered, sorted locomotive list"""
+    locomotives = data['locomotives']
+    elements = []
+    _list_header(elements, "Catálogo de Locomotoras", data)
+
+    if locomotives:
+        elements.append(Paragraph(f"Locomotoras ({len(locomotives)})", SUBTITLE))
+        elements.append(table(LOCOMOTIVE_COLUMNS, locomotives, LOCOMOTIVE_LIST))
+        elements.append(Spacer(1, 20))
+        elements.append(Paragraph(
+            f"Total: {len(locomotives)} locomotoras - Valor: {euros(_total(locomotives))}", NORMAL))
+    _build(elements, output)
+
+
+def render_rolling_stock(data: dict, output):
+    """Filtered, sorted rolling stock list"""
+    rolling_stock = data['rolling_stock']
+    elements = []
+    _list_header(elements, "Catálogo de Vagones y Coches", data)
+
+    if rolling_stock:
+        elements.append(Paragraph(f"Vagones y Coches ({len(rolling_stock)})", SUBTITLE))
+        elements.append(table(ROLLING_STOCK_COLUMNS, rolling_stock, ROLLING_STOCK_LIST))
+        elements.append(Spacer(1, 20))
+        elements.append(Paragraph(
+            f"Total: {len(rolling_stock)} unidades - Valor: {euros(_total(rolling_stock))}", NORMAL))
+    _build(elements, output)
+
+
+def render_compositions(data: dict, output):
+    """
+    Compositions with their locomotive and wagons. The endpoint resolves them:
+    each composition carries 'locomotive_label' and 'wagon_labels'.
+    """
+    compositions = data['compositions']
+    elements = [
+        Paragraph("Catálogo de Composiciones", TITLE),
+        Paragraph(f"Generado: {data['generated']}", NORMAL),
+        Spacer(1, 20),
+    ]
+
+    if not compositions:
+        elements.append(Paragraph("No hay composiciones registradas", NORMAL))
+        _build(elements, output)
+        return
+
+    elements.append(Paragraph(f"Composiciones ({len(compositions)})", SUBTITLE))
+    for comp in compositions:
+        elements.append(Paragraph(f"{comp.get('name', 'Sin nombre')}", COMPOSITION_TITLE))
+
+        info_data = [
+            ['Tipo de Servicio', comp.get('service_type') or '-'],
+            ['Época', comp.get('era') or '-'],
+        ]
+        if comp.get('locomotive_label'):
+            info_data.append(['Locomotora', comp['locomotive_label']])
+        info_data.append(['Vagones/Coches', str(comp['wagon_count'])])
+        elements.append(Table(info_data, colWidths=[4*cm, 10*cm], style=COMPOSITION_INFO))
+
+        if comp['wagon_labels']:
+            elements.append(Paragraph("Material rodante:", NORMAL))
+            for label in comp['wagon_labels']:
+                elements.append(Paragraph(f"• {label}", NORMAL))
+        elements.append(Spacer(1, 10))
+
+    elements.append(Spacer(1, 10))
+    elements.append(Paragraph(f"Total: {len(compositions)} composiciones", NORMAL))
+    _build(elements, output)
+
+
+def _sheet_header(elements: list, title: str, item: dict, section_style):
+    elements.append(Paragraph(title, SHEET_TITLE))
+    elements.append(Paragraph(f"{item.get('brand', '')} - {item.get('model', '')}", SHEET_TITLE))
+    elements.append(Spacer(1, 15))
+    elements.append(Paragraph("Información General", section_style))
+
+def _sheet_notes(elements: list, item: dict, section_style):
+    if item.get('notes'):
+        elements.append(Paragraph("Notas", section_style))
+        elements.append(Paragraph(item.get('notes', ''), NORMAL))
+
+
+def locomotive_sheet_elements(loco: dict) -> list:
+    """Flowables of a locomotive data sheet: general info, DCC, functions, CVs and notes"""
+    elements = []
+    _sheet_header(elements, "Ficha de Locomotora", loco, LOCOMOTIVE_SECTION)
+    info_data = [
+        ['Marca:', loco.get('brand', '-'), 'Modelo:', loco.get('model', '-')],
+        ['Referencia:', loco.get('reference', '-'), 'Tipo:', loco.get('locomotive_type', '-')],
+        ['Matrícula:', loco.get('registration_number', '-'), 'Era:', loco.get('era', '-')],
+        ['Compañía:', loco.get('railway_company', '-'), 'Estado:', loco.get('condition', '-')],
+        ['Fecha Compra:', loco.get('purchase_date', '-'), 'Precio:', euros(loco.get('price', 0) or 0)],
+    ]
+    elements.append(Table(info_data, colWidths=[3*cm, 5*cm, 3*cm, 5*cm], style=SHEET_INFO))
+
+    elements.append(Paragraph("Configuración Digital (DCC)", LOCOMOTIVE_SECTION))
+    dcc_data = [
+        ['Dirección DCC:', str(loco.get('dcc_address', 3))],
+        ['Decoder:', f"{loco.get('decoder_brand', '-')} {loco.get('decoder_model', '-')}"],
+        ['Proyecto Sonido:', loco.get('sound_project', '-')],
+    ]
+    elements.append(Table(dcc_data, colWidths=[4*cm, 12*cm], style=SHEET_DCC))
+
+    functions = loco.get('functions', [])
+    if functions:
+        elements.append(Paragraph("Funciones Programadas", LOCOMOTIVE_SECTION))
+        elements.append(table(FUNCTION_COLUMNS, functions, SHEET_FUNCTIONS))
+
+    cvs = loco.get('cv_modifications', [])
+    if cvs:
+        elements.append(Paragraph("CVs Modificados", LOCOMOTIVE_SECTION))
+        elements.append(table(CV_COLUMNS, cvs, SHEET_CVS))
+
+    _sheet_notes(elements, loco, LOCOMOTIVE_SECTION)
+    return elements
+
+
+def rolling_stock_sheet_elements(stock: dict) -> list:
+    """Flowables of a wagon or coach data sheet"""
+    elements = []
+    _sheet_header(elements, "Ficha de Material Rodante", stock, ROLLING_STOCK_SECTION)
+    info_data = [
+        ['Marca:', stock.get('brand', '-'), 'Modelo:', stock.get('model', '-')],
+        ['Referencia:', stock.get('reference', '-'), 'Tipo:', stock.get('stock_type', '-')],
+        ['Era:', stock.get('era', '-'), 'Compañía:', stock.get('railway_company', '-')],
+        ['Estado:', stock.get('condition', '-'), 'Fecha Compra:', stock.get('purchase_date', '-')],
+        ['Precio:', euros(stock.get('price', 0) or 0), '', ''],
+    ]
+    elements.append(Table(info_data, colWidths=[3*cm, 5*cm, 3*cm, 5*cm], style=SHEET_INFO))
+    _sheet_notes(elements, stock, ROLLING_STOCK_SECTION)
+    return elements
+
+
+def render_locomotive_sheet(data: dict, output):
+    _build(locomotive_sheet_elements(data['locomotive']), output, margin=2*cm)
+
+
+def render_rolling_stock_sheet(data: dict, output):
+    _build(rolling_stock_sheet_elements(data['rolling_stock']), output, margin=2*cm)
+
+
+def render_sheets(data: dict, output):
+    """Locomotive then rolling stock data sheets in one document, each on its own pages"""
+    sheets = [locomotive_sheet_elements(loco) for loco in data['locomotives']]
+    sheets += [rolling_stock_sheet_elements(stock) for stock in data['rolling_stock']]
+    elements = []
+    for sheet in sheets:
+        if elements:
+            elements.append(PageBreak())
+        elements += sheet
+    _build(elements, output, margin=2*cm)
+
+
+REPORTS = {
+    "catalog": render_catalog,
+    "locomotives": render_locomotives,
+    "rolling_stock": render_rolling_stock,
+    "compositions": render_compositions,
+    "locomotive_sheet": render_locomotive_sheet,
+    "rolling_stock_sheet": render_rolling_stock_sheet,
+    "sheets": render_sheets,
+}
+
+
+def render_pdf(report: str, data: dict, path: str) -> int:
+    """
+    Pool entry point: render the named report from its data into the file at
+    `path` and return its size. Only the path crosses back to the app, never
+    the document itself.
+    """
+    with open(path, 'wb') as output:
+        REPORTS[report](data, output)
+    return os.path.getsize(path)
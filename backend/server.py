@@ -1,15 +1,30 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Request, Response
 from dotenv import load_dotenv
+from fastapi.responses import FileResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import uuid
-from datetime import datetime, timezone
+import asyncio
+import time
+from datetime import datetime, timezone, timedelta
 import base64
+import codecs
+import gzip
+import hashlib
+import itertools
+import json
+import io
+import shutil
+import re
+import zipfile
+import zlib
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -60,6 +75,7 @@ class LocomotiveBase(BaseModel):
     photo: Optional[str] = None  # base64 encoded
     functions: List[FunctionMapping] = []
     cv_modifications: List[CVModification] = []
+    jmri_id: Optional[str] = None  # Id de la entrada del roster JMRI
 
 # ============== ROLLING STOCK (VAGONES/COCHES) MODELS ==============
 
@@ -196,16 +212,41 @@ class Composition(CompositionBase):
 
 class CSVImportResult(BaseModel):
     success: bool
-    imported_count: int
+    imported_count: int  # created + updated + unchanged
     skipped_count: int
     errors: List[str]
     imported_items: List[dict]
+    created_count: int = 0
+    updated_count: int = 0
+    unchanged_count: int = 0  # mode=upsert rows that matched an identical document
+
+# ============== COLLECTION VERSIONS ==============
+
+# Every write bumps a per-collection counter so caches derived from a
+# collection can tell whether they are still valid.
+
+async def bump_collection_version(name: str):
+    await db.collection_versions.update_one({"collection": name}, {"$inc": {"version": 1}}, upsert=True)
+
+async def get_collection_version(name: str) -> int:
+    doc = await db.collection_versions.find_one({"collection": name}, {"_id": 0, "version": 1})
+    return doc['version'] if doc else 0
+
+async def get_collection_version_tags(names: List[str]) -> Dict[str, str]:
+    """
+    Versions for caches that outlive the process: the counter plus the id of
+    its document, since a recreated database counts from zero again.
+    """
+    tags = {name: "0" for name in names}
+    async for doc in db.collection_versions.find({"collection": {"$in": names}}):
+        tags[doc['collection']] = f"{doc['_id']}:{doc['version']}"
+    return tags
 
 # ============== LOCOMOTIVE ENDPOINTS ==============
 
 @api_router.get("/locomotives", response_model=List[Locomotive])
 async def get_locomotives():
-    locomotives = await db.locomotives.find({}, {"_id": 0}).to_list(1000)
+    locomotives = await db.locomotives.find({}, {"_id": 0, "cv_sheet": 0}).to_list(1000)
     for loco in locomotives:
         if isinstance(loco.get('created_at'), str):
             loco['created_at'] = datetime.fromisoformat(loco['created_at'])
@@ -218,7 +259,7 @@ async def get_locomotives():
 
 @api_router.get("/locomotives/{locomotive_id}", response_model=Locomotive)
 async def get_locomotive(locomotive_id: str):
-    locomotive = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0})
+    locomotive = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0, "cv_sheet": 0})
     if not locomotive:
         raise HTTPException(status_code=404, detail="Locomotora no encontrada")
     if isinstance(locomotive.get('created_at'), str):
@@ -238,11 +279,12 @@ async def create_locomotive(locomotive: LocomotiveCreate):
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     await db.locomotives.insert_one(doc)
+    await bump_collection_version("locomotives")
     return loco_obj
 
 @api_router.put("/locomotives/{locomotive_id}", response_model=Locomotive)
 async def update_locomotive(locomotive_id: str, locomotive: LocomotiveCreate):
-    existing = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0})
+    existing = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0, "cv_sheet": 0})
     if not existing:
         raise HTTPException(status_code=404, detail="Locomotora no encontrada")
     
@@ -252,8 +294,9 @@ async def update_locomotive(locomotive_id: str, locomotive: LocomotiveCreate):
     update_data['created_at'] = existing.get('created_at', datetime.now(timezone.utc).isoformat())
     
     await db.locomotives.update_one({"id": locomotive_id}, {"$set": update_data})
+    await bump_collection_version("locomotives")
     
-    updated = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0})
+    updated = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0, "cv_sheet": 0})
     if isinstance(updated.get('created_at'), str):
         updated['created_at'] = datetime.fromisoformat(updated['created_at'])
     if isinstance(updated.get('updated_at'), str):
@@ -268,6 +311,7 @@ async def delete_locomotive(locomotive_id: str):
     result = await db.locomotives.delete_one({"id": locomotive_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Locomotora no encontrada")
+    await bump_collection_version("locomotives")
     return {"message": "Locomotora eliminada"}
 
 # ============== DECODER ENDPOINTS ==============
@@ -296,6 +340,7 @@ async def create_decoder(decoder: DecoderCreate):
     doc = dec_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.decoders.insert_one(doc)
+    await bump_collection_version("decoders")
     return dec_obj
 
 @api_router.put("/decoders/{decoder_id}", response_model=Decoder)
@@ -307,8 +352,10 @@ async def update_decoder(decoder_id: str, decoder: DecoderCreate):
     update_data = decoder.model_dump()
     update_data['id'] = decoder_id
     update_data['created_at'] = existing.get('created_at', datetime.now(timezone.utc).isoformat())
+    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
     await db.decoders.update_one({"id": decoder_id}, {"$set": update_data})
+    await bump_collection_version("decoders")
     
     updated = await db.decoders.find_one({"id": decoder_id}, {"_id": 0})
     if isinstance(updated.get('created_at'), str):
@@ -320,6 +367,7 @@ async def delete_decoder(decoder_id: str):
     result = await db.decoders.delete_one({"id": decoder_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Decodificador no encontrado")
+    await bump_collection_version("decoders")
     return {"message": "Decodificador eliminado"}
 
 # ============== SOUND PROJECT ENDPOINTS ==============
@@ -348,6 +396,7 @@ async def create_sound_project(project: SoundProjectCreate):
     doc = proj_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.sound_projects.insert_one(doc)
+    await bump_collection_version("sound_projects")
     return proj_obj
 
 @api_router.put("/sound-projects/{project_id}", response_model=SoundProject)
@@ -359,8 +408,10 @@ async def update_sound_project(project_id: str, project: SoundProjectCreate):
     update_data = project.model_dump()
     update_data['id'] = project_id
     update_data['created_at'] = existing.get('created_at', datetime.now(timezone.utc).isoformat())
+    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
     await db.sound_projects.update_one({"id": project_id}, {"$set": update_data})
+    await bump_collection_version("sound_projects")
     
     updated = await db.sound_projects.find_one({"id": project_id}, {"_id": 0})
     if isinstance(updated.get('created_at'), str):
@@ -372,6 +423,7 @@ async def delete_sound_project(project_id: str):
     result = await db.sound_projects.delete_one({"id": project_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Proyecto de sonido no encontrado")
+    await bump_collection_version("sound_projects")
     return {"message": "Proyecto de sonido eliminado"}
 
 # ============== ROLLING STOCK ENDPOINTS ==============
@@ -405,6 +457,7 @@ async def create_rolling_stock(stock: RollingStockCreate):
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     await db.rolling_stock.insert_one(doc)
+    await bump_collection_version("rolling_stock")
     return stock_obj
 
 @api_router.put("/rolling-stock/{stock_id}", response_model=RollingStock)
@@ -419,6 +472,7 @@ async def update_rolling_stock(stock_id: str, stock: RollingStockCreate):
     update_data['created_at'] = existing.get('created_at', datetime.now(timezone.utc).isoformat())
     
     await db.rolling_stock.update_one({"id": stock_id}, {"$set": update_data})
+    await bump_collection_version("rolling_stock")
     
     updated = await db.rolling_stock.find_one({"id": stock_id}, {"_id": 0})
     if isinstance(updated.get('created_at'), str):
@@ -432,13 +486,14 @@ async def delete_rolling_stock(stock_id: str):
     result = await db.rolling_stock.delete_one({"id": stock_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Material rodante no encontrado")
+    await bump_collection_version("rolling_stock")
     return {"message": "Material rodante eliminado"}
 
 # ============== STATISTICS ENDPOINT ==============
 
 @api_router.get("/stats", response_model=StatsResponse)
 async def get_stats():
-    locomotives = await db.locomotives.find({}, {"_id": 0}).to_list(1000)
+    locomotives = await db.locomotives.find({}, {"_id": 0, "cv_sheet": 0}).to_list(1000)
     rolling_stock = await db.rolling_stock.find({}, {"_id": 0}).to_list(1000)
     decoders = await db.decoders.find({}, {"_id": 0}).to_list(1000)
     sound_projects = await db.sound_projects.find({}, {"_id": 0}).to_list(1000)
@@ -508,61 +563,427 @@ async def root():
 class BackupData(BaseModel):
     version: str = "1.0"
     created_at: str
-    locomotives: List[dict]
-    rolling_stock: List[dict]
-    decoders: List[dict]
-    sound_projects: List[dict]
+    # Collections may be left out of partial backups used with mode=merge
+    locomotives: Optional[List[dict]] = None
+    rolling_stock: Optional[List[dict]] = None
+    decoders: Optional[List[dict]] = None
+    sound_projects: Optional[List[dict]] = None
+    manifest: Optional[dict] = None
 
 class BackupHistoryEntry(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    type: str = "manual"  # manual, restore
+    type: str = "manual"  # manual, automatic, restore, jmri_import
     locomotives_count: int = 0
     rolling_stock_count: int = 0
     decoders_count: int = 0
     sound_projects_count: int = 0
+    filename: Optional[str] = None  # automatic backups only
+    size_bytes: Optional[int] = None
+    duration_ms: Optional[float] = None
 
 class BackupSettings(BaseModel):
     reminder_enabled: bool = False
     reminder_frequency: str = "weekly"  # daily, weekly, monthly
     last_reminder_shown: Optional[str] = None
+    # Automatic backups to BACKUP_DIR, run on reminder_frequency
+    auto_backup_enabled: bool = False
+    keep_daily: int = Field(default=7, ge=1)
+    keep_weekly: int = Field(default=4, ge=1)
+    keep_monthly: int = Field(default=6, ge=1)
+
+# Restores are loaded into "<name>__restore_staging" collections and swapped in
+# with renameCollection, so the API keeps serving the old data until the swap.
+# The previous data is kept as "<name>__restore_rollback" for a while.
+RESTORE_COLLECTIONS = ["locomotives", "rolling_stock", "decoders", "sound_projects"]
+RESTORE_BATCH_SIZE = 1000
+RESTORE_ROLLBACK_HOURS = float(os.environ.get('RESTORE_ROLLBACK_HOURS', '24'))
+RESTORE_MERGE_POLICIES = ["newer", "keep_existing", "overwrite"]
+
+_restore_lock = asyncio.Lock()
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    return str(value)
+
+def _canonical_value(value):
+    # Integral floats are written as ints so 45.0 and a JSON.stringify'd 45 hash the same
+    if isinstance(value, dict):
+        return {k: _canonical_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_canonical_value(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def document_hash(doc: dict) -> str:
+    """SHA-256 of the canonical JSON form of a document (sorted keys, no _id)"""
+    canonical = json.dumps(
+        {k: _canonical_value(v) for k, v in doc.items() if k != '_id'},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=_json_default
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def build_backup_manifest(backup: dict) -> dict:
+    """Per-collection document count and checksum over the sorted document hashes"""
+    collections = {}
+    for name in RESTORE_COLLECTIONS:
+        docs = backup.get(name) or []
+        digest = hashlib.sha256()
+        for doc_hash in sorted(document_hash(doc) for doc in docs):
+            digest.update(doc_hash.encode('ascii'))
+        collections[name] = {"count": len(docs), "sha256": digest.hexdigest()}
+    return {"algorithm": "sha256", "collections": collections}
+
+def _load_backup_file(fileobj) -> dict:
+    """Load a backup from a .json or gzip-compressed .json.gz file object"""
+    magic = fileobj.read(2)
+    fileobj.seek(0)
+    if magic == b'\x1f\x8b':
+        fileobj = gzip.GzipFile(fileobj=fileobj)
+    return json.load(fileobj)
+
+async def _read_backup_upload(file: UploadFile) -> dict:
+    try:
+        backup = await asyncio.to_thread(_load_backup_file, file.file)
+    except (OSError, ValueError, EOFError, zlib.error) as e:
+        # EOFError and zlib.error come from truncated or corrupt gzip files
+        raise HTTPException(status_code=400, detail=f"Archivo de backup no válido: {str(e) or type(e).__name__}")
+    if not isinstance(backup, dict):
+        raise HTTPException(status_code=400, detail="Archivo de backup no válido")
+    return backup
+
+# Live document hashes per collection: name -> (collection version, {id: hash})
+_live_hash_cache: Dict[str, tuple] = {}
+
+async def _live_document_hashes(name: str) -> Dict[str, str]:
+    version = await get_collection_version(name)
+    cached = _live_hash_cache.get(name)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    def hash_batch(docs):
+        return {doc['id']: document_hash(doc) for doc in docs if doc.get('id')}
+
+    hashes = {}
+    cursor = db[name].find({}, {"_id": 0})
+    while True:
+        batch = await cursor.to_list(RESTORE_BATCH_SIZE)
+        if not batch:
+            break
+        hashes.update(await asyncio.to_thread(hash_batch, batch))
+    _live_hash_cache[name] = (version, hashes)
+    return hashes
+
+# History entries expire through a TTL index on expires_at
+BACKUP_HISTORY_RETENTION_DAYS = float(os.environ.get('BACKUP_HISTORY_RETENTION_DAYS', '365'))
+BACKUP_HISTORY_RETENTION = timedelta(days=BACKUP_HISTORY_RETENTION_DAYS)
+BACKUP_HISTORY_MAX_PAGE = 200
+
+async def record_backup_history(entry: BackupHistoryEntry):
+    doc = entry.model_dump()
+    doc['expires_at'] = doc['created_at'] + BACKUP_HISTORY_RETENTION
+    doc['created_at'] = doc['created_at'].isoformat()
+    await db.backup_history.insert_one(doc)
+
+async def build_backup_document() -> dict:
+    """Read all backed-up collections into a backup document with its manifest"""
+    backup = {
+        "version": "1.0",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    for name in RESTORE_COLLECTIONS:
+        backup[name] = await db[name].find({}, {"_id": 0}).to_list(None)
+    backup["manifest"] = await asyncio.to_thread(build_backup_manifest, backup)
+    return backup
 
 @api_router.get("/backup")
 async def create_backup():
     """Export all data as a backup and record in history"""
-    locomotives = await db.locomotives.find({}, {"_id": 0}).to_list(10000)
-    rolling_stock = await db.rolling_stock.find({}, {"_id": 0}).to_list(10000)
-    decoders = await db.decoders.find({}, {"_id": 0}).to_list(10000)
-    sound_projects = await db.sound_projects.find({}, {"_id": 0}).to_list(10000)
+    started = time.perf_counter()
+    backup = await build_backup_document()
+    content = await asyncio.to_thread(
+        lambda: json.dumps(backup, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+    )
     
     # Record backup in history
-    history_entry = BackupHistoryEntry(
+    await record_backup_history(BackupHistoryEntry(
         type="manual",
-        locomotives_count=len(locomotives),
-        rolling_stock_count=len(rolling_stock),
-        decoders_count=len(decoders),
-        sound_projects_count=len(sound_projects)
-    )
-    history_doc = history_entry.model_dump()
-    history_doc['created_at'] = history_doc['created_at'].isoformat()
-    await db.backup_history.insert_one(history_doc)
-    
-    backup = {
-        "version": "1.0",
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "locomotives": locomotives,
-        "rolling_stock": rolling_stock,
-        "decoders": decoders,
-        "sound_projects": sound_projects
-    }
+        locomotives_count=len(backup['locomotives']),
+        rolling_stock_count=len(backup['rolling_stock']),
+        decoders_count=len(backup['decoders']),
+        sound_projects_count=len(backup['sound_projects']),
+        size_bytes=len(content),
+        duration_ms=round((time.perf_counter() - started) * 1000, 1)
+    ))
     
-    return backup
+    return Response(content=content, media_type="application/json")
+
+# ============== AUTOMATIC BACKUPS ==============
+
+BACKUP_DIR = Path(os.environ.get('BACKUP_DIR', ROOT_DIR / 'backups'))
+BACKUP_SCHEDULER_INTERVAL_SECONDS = int(os.environ.get('BACKUP_SCHEDULER_INTERVAL_SECONDS', '900'))
+BACKUP_FREQUENCIES = {
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+    "monthly": timedelta(days=30),
+}
+BACKUP_FILENAME_FORMAT = "backup_%Y%m%d_%H%M%S.json.gz"
+# Backups written in the same second get a _2, _3... suffix
+BACKUP_FILENAME_RE = re.compile(r'backup_(\d{8}_\d{6})(?:_(\d+))?\.json\.gz')
+
+_auto_backup_lock = asyncio.Lock()
+
+def _write_backup_file(path: Path, backup: dict) -> int:
+    """Write a gzip-compressed backup atomically and return its size"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(backup, f, ensure_ascii=False, default=_json_default)
+    os.replace(tmp_path, path)
+    return path.stat().st_size
+
+def _backup_file_key(path: Path) -> Optional[Tuple[datetime, int]]:
+    """Sort key (timestamp, sequence) of an automatic backup file name"""
+    match = BACKUP_FILENAME_RE.fullmatch(path.name)
+    if match is None:
+        return None
+    try:
+        ts = datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return ts, int(match.group(2) or 1)
+
+def _backup_file_timestamp(path: Path) -> Optional[datetime]:
+    key = _backup_file_key(path)
+    return key[0] if key else None
+
+def _new_backup_path(directory: Path) -> Path:
+    """Path for a new backup that does not overwrite one from the same second"""
+    filename = datetime.now(timezone.utc).strftime(BACKUP_FILENAME_FORMAT)
+    # Continue after the highest sequence on disk, so a new file always sorts
+    # after the older ones even when rotation removed some of them
+    sequences = [key[1] for path in directory.glob(filename.replace('.json.gz', '*.json.gz'))
+                 if (key := _backup_file_key(path)) is not None]
+    if not sequences:
+        return directory / filename
+    return directory / filename.replace('.json.gz', f'_{max(sequences) + 1}.json.gz')
+
+def _rotate_backup_files(directory: Path, keep_daily: int, keep_weekly: int, keep_monthly: int) -> List[str]:
+    """
+    Keep the newest backup of each of the last `keep_daily` days, `keep_weekly`
+    ISO weeks and `keep_monthly` months; delete the rest. Returns deleted names.
+    """
+    backups = [(key, path) for path in directory.glob('backup_*.json.gz')
+               if (key := _backup_file_key(path)) is not None]
+    backups.sort(reverse=True)
+
+    # The newest backup is always kept, whatever the retention settings
+    keep = {backups[0][1]} if backups else set()
+    periods = [
+        (keep_daily, lambda ts: ts.date(), set()),
+        (keep_weekly, lambda ts: ts.isocalendar()[:2], set()),
+        (keep_monthly, lambda ts: (ts.year, ts.month), set()),
+    ]
+    for (ts, _), path in backups:
+        for limit, period_of, seen in periods:
+            period = period_of(ts)
+            if period not in seen and len(seen) < limit:
+                seen.add(period)
+                keep.add(path)
+
+    deleted = []
+    for _, path in backups:
+        if path not in keep:
+            path.unlink(missing_ok=True)
+            deleted.append(path.name)
+    return deleted
+
+async def _automatic_backup_due(frequency: str) -> bool:
+    last = await db.backup_history.find_one(
+        {"type": "automatic"}, {"_id": 0, "created_at": 1}, sort=[("created_at", -1)]
+    )
+    last_at = _parse_timestamp(last.get('created_at')) if last else None
+    if last_at is None:
+        return True
+    interval = BACKUP_FREQUENCIES.get(frequency, BACKUP_FREQUENCIES["weekly"])
+    return datetime.now(timezone.utc) - last_at >= interval
+
+async def run_automatic_backup(settings: BackupSettings) -> dict:
+    """Write a compressed backup to BACKUP_DIR, rotate old files and record it"""
+    async with _auto_backup_lock:
+        started = time.perf_counter()
+        backup = await build_backup_document()
+        BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+        path = _new_backup_path(BACKUP_DIR)
+        filename = path.name
+        size = await asyncio.to_thread(_write_backup_file, path, backup)
+        deleted = await asyncio.to_thread(
+            _rotate_backup_files, BACKUP_DIR,
+            settings.keep_daily, settings.keep_weekly, settings.keep_monthly
+        )
+
+        await record_backup_history(BackupHistoryEntry(
+            type="automatic",
+            locomotives_count=len(backup['locomotives']),
+            rolling_stock_count=len(backup['rolling_stock']),
+            decoders_count=len(backup['decoders']),
+            sound_projects_count=len(backup['sound_projects']),
+            filename=filename,
+            size_bytes=size,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1)
+        ))
+
+    return {"filename": filename, "size": size, "deleted": deleted}
+
+async def backup_scheduler():
+    """Background loop that runs automatic backups when they are due and drops expired restore rollbacks"""
+    while True:
+        try:
+            stored = await db.backup_settings.find_one({}, {"_id": 0})
+            settings = BackupSettings(**(stored or {}))
+            if (settings.auto_backup_enabled and not _auto_backup_lock.locked()
+                    and await _automatic_backup_due(settings.reminder_frequency)):
+                result = await run_automatic_backup(settings)
+                logger.info("Backup automático creado: %s", result['filename'])
+            if not _restore_lock.locked():
+                async with _restore_lock:
+                    await _drop_expired_rollbacks()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error en el backup automático")
+        await asyncio.sleep(BACKUP_SCHEDULER_INTERVAL_SECONDS)
+
+@api_router.post("/backup/run")
+async def run_backup_now():
+    """Write an automatic backup to disk right away"""
+    if _auto_backup_lock.locked():
+        raise HTTPException(status_code=409, detail="Ya hay un backup en curso")
+    stored = await db.backup_settings.find_one({}, {"_id": 0})
+    return await run_automatic_backup(BackupSettings(**(stored or {})))
+
+@api_router.get("/backup/files")
+async def list_backup_files():
+    """List the automatic backups stored on disk, newest first"""
+    def scan():
+        if not BACKUP_DIR.is_dir():
+            return []
+        files = []
+        for path in BACKUP_DIR.glob('backup_*.json.gz'):
+            key = _backup_file_key(path)
+            if key is not None:
+                files.append((key, {"filename": path.name, "size": path.stat().st_size, "created_at": key[0]}))
+        return [entry for _, entry in sorted(files, key=lambda f: f[0], reverse=True)]
+
+    return await asyncio.to_thread(scan)
+
+@api_router.get("/backup/files/{filename}")
+async def download_backup_file(filename: str):
+    """Download an automatic backup file"""
+    path = BACKUP_DIR / filename
+    if Path(filename).name != filename or _backup_file_timestamp(path) is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Backup no encontrado")
+    return FileResponse(path, media_type="application/gzip", filename=filename)
+
+@api_router.post("/backup/diff")
+async def diff_backup(file: UploadFile = File(...)):
+    """Compare a backup file against the live data without restoring it"""
+    backup = await _read_backup_upload(file)
+
+    def hash_documents(docs):
+        return {doc['id']: document_hash(doc) for doc in docs if isinstance(doc, dict) and doc.get('id')}
+
+    collections = {}
+    for name in RESTORE_COLLECTIONS:
+        docs = backup.get(name)
+        if docs is None:
+            continue
+        incoming = await asyncio.to_thread(hash_documents, docs)
+        live = await _live_document_hashes(name)
+        added = [doc_id for doc_id in incoming if doc_id not in live]
+        removed = [doc_id for doc_id in live if doc_id not in incoming]
+        changed = [doc_id for doc_id, doc_hash in incoming.items() if doc_id in live and live[doc_id] != doc_hash]
+        collections[name] = {
+            "added": added,
+            "removed": removed,
+            "changed": changed,
+            "unchanged_count": len(incoming) - len(added) - len(changed)
+        }
+    return {"collections": collections}
+
+@api_router.post("/backup/verify")
+async def verify_backup(file: UploadFile = File(...)):
+    """Check a backup file against its checksum manifest"""
+    backup = await _read_backup_upload(file)
+    manifest = backup.get('manifest')
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('collections'), dict):
+        return {"valid": False, "errors": ["El backup no contiene manifiesto de verificación"], "collections": {}}
+
+    actual = await asyncio.to_thread(build_backup_manifest, backup)
+    errors = []
+    collections = {}
+    if not manifest['collections']:
+        errors.append("El manifiesto no incluye ninguna colección")
+    # Every collection in the backup must be covered by the manifest
+    for name in RESTORE_COLLECTIONS:
+        if name in backup and name not in manifest['collections']:
+            errors.append(f"{name}: la colección no figura en el manifiesto")
+            collections[name] = {
+                "count": actual['collections'][name]['count'],
+                "expected_count": None,
+                "checksum_ok": False
+            }
+    for name, expected in manifest['collections'].items():
+        found = actual['collections'].get(name)
+        if found is None:
+            errors.append(f"{name}: colección desconocida en el manifiesto")
+            continue
+        count_ok = found['count'] == expected.get('count')
+        checksum_ok = found['sha256'] == expected.get('sha256')
+        if not count_ok:
+            errors.append(f"{name}: se esperaban {expected.get('count')} documentos y hay {found['count']}")
+        elif not checksum_ok:
+            errors.append(f"{name}: la suma de verificación no coincide")
+        collections[name] = {
+            "count": found['count'],
+            "expected_count": expected.get('count'),
+            "checksum_ok": checksum_ok
+        }
+    return {"valid": not errors, "errors": errors, "collections": collections}
+
+def _encode_history_cursor(entry: dict) -> str:
+    return base64.urlsafe_b64encode(f"{entry['created_at']}|{entry['id']}".encode('utf-8')).decode('ascii')
+
+def _decode_history_cursor(cursor: str) -> tuple:
+    try:
+        created_at, entry_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de historial no válido")
+    return created_at, entry_id
 
 @api_router.get("/backup/history")
-async def get_backup_history():
-    """Get backup history"""
-    history = await db.backup_history.find({}, {"_id": 0}).sort("created_at", -1).to_list(50)
+async def get_backup_history(response: Response, limit: int = 50, before: Optional[str] = None):
+    """
+    Get backup history, newest first.
+    Pass the X-Next-Cursor header of a page as `before` to get the next page.
+    """
+    limit = max(1, min(limit, BACKUP_HISTORY_MAX_PAGE))
+    query = {}
+    if before:
+        created_at, entry_id = _decode_history_cursor(before)
+        query = {"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": entry_id}},
+        ]}
+    history = await db.backup_history.find(query, {"_id": 0, "expires_at": 0}) \
+        .sort([("created_at", -1), ("id", -1)]).to_list(limit + 1)
+    if len(history) > limit:
+        history = history[:limit]
+        response.headers["X-Next-Cursor"] = _encode_history_cursor(history[-1])
     for entry in history:
         if isinstance(entry.get('created_at'), str):
             entry['created_at'] = datetime.fromisoformat(entry['created_at'])
@@ -593,42 +1014,235 @@ async def save_backup_settings(settings: BackupSettings):
     saved_settings = await db.backup_settings.find_one({}, {"_id": 0})
     return saved_settings
 
+def _staging_name(name: str) -> str:
+    return f"{name}__restore_staging"
+
+def _rollback_name(name: str) -> str:
+    return f"{name}__restore_rollback"
+
+async def _copy_indexes(source: str, target: str):
+    """Create on `target` the secondary indexes defined on `source`"""
+    indexes = await db[source].index_information()
+    for index_name, info in indexes.items():
+        if index_name == '_id_':
+            continue
+        keys = info.pop('key')
+        info.pop('v', None)
+        info.pop('ns', None)
+        await db[target].create_index(keys, name=index_name, **info)
+
+async def _load_staging_collection(name: str, docs: List[dict]):
+    """Load docs into the staging collection for `name`, index it and verify the count"""
+    staging = _staging_name(name)
+    await db.drop_collection(staging)
+    await db.create_collection(staging)
+    for start in range(0, len(docs), RESTORE_BATCH_SIZE):
+        await db[staging].insert_many(docs[start:start + RESTORE_BATCH_SIZE], ordered=False)
+    await _copy_indexes(name, staging)
+    count = await db[staging].count_documents({})
+    if count != len(docs):
+        raise RuntimeError(f"{name}: se esperaban {len(docs)} documentos y se cargaron {count}")
+
+async def _drop_expired_rollbacks():
+    """Drop rollback copies whose retention period has passed"""
+    now = datetime.now(timezone.utc).isoformat()
+    async for entry in db.restore_rollbacks.find({"expires_at": {"$lte": now}}, {"_id": 0}):
+        await db.drop_collection(entry['rollback_collection'])
+        await db.restore_rollbacks.delete_one({"collection": entry['collection']})
+
+async def _undo_swap(swapped: List[str], copied: List[str], existing: set):
+    """
+    Undo a replace restore that failed half way: put the rollback copies of
+    the swapped collections back in place and drop the copies of the rest.
+    """
+    for name in copied:
+        rollback = _rollback_name(name)
+        if name in swapped:
+            if name in existing:
+                await _copy_indexes(name, rollback)
+                await db[rollback].rename(name, dropTarget=True)
+            else:
+                await db.drop_collection(name)
+            await bump_collection_version(name)
+        else:
+            await db.drop_collection(rollback)
+        await db.restore_rollbacks.delete_one({"collection": name})
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    """Parse a stored created_at/updated_at value into an aware datetime"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def _last_modified(doc: dict) -> Optional[datetime]:
+    """updated_at, or created_at for documents that were never edited"""
+    return _parse_timestamp(doc.get('updated_at')) or _parse_timestamp(doc.get('created_at'))
+
+async def _merge_collection(name: str, docs: List[dict], policy: str) -> dict:
+    """Upsert docs into `name` by id following the conflict policy"""
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    for start in range(0, len(docs), RESTORE_BATCH_SIZE):
+        batch = docs[start:start + RESTORE_BATCH_SIZE]
+        ids = [doc['id'] for doc in batch if doc.get('id')]
+        existing = {}
+        async for doc in db[name].find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "created_at": 1, "updated_at": 1}):
+            existing[doc['id']] = doc
+
+        requests = []
+        for doc in batch:
+            doc_id = doc.get('id')
+            if not doc_id:
+                counts["skipped"] += 1
+                continue
+            current = existing.get(doc_id)
+            if current is not None:
+                if policy == "keep_existing":
+                    counts["skipped"] += 1
+                    continue
+                if policy == "newer":
+                    incoming_ts = _last_modified(doc)
+                    current_ts = _last_modified(current)
+                    if incoming_ts is None or (current_ts is not None and current_ts >= incoming_ts):
+                        counts["skipped"] += 1
+                        continue
+            replacement = {k: v for k, v in doc.items() if k != '_id'}
+            requests.append(ReplaceOne({"id": doc_id}, replacement, upsert=True))
+
+        if requests:
+            result = await db[name].bulk_write(requests, ordered=False)
+            counts["inserted"] += result.upserted_count
+            counts["updated"] += result.matched_count
+    return counts
+
 @api_router.post("/restore")
-async def restore_backup(backup: BackupData):
-    """Restore data from a backup (replaces all existing data)"""
-    try:
-        # Clear existing collections
-        await db.locomotives.delete_many({})
-        await db.rolling_stock.delete_many({})
-        await db.decoders.delete_many({})
-        await db.sound_projects.delete_many({})
-        
-        # Restore data
-        if backup.locomotives:
-            await db.locomotives.insert_many(backup.locomotives)
-        if backup.rolling_stock:
-            await db.rolling_stock.insert_many(backup.rolling_stock)
-        if backup.decoders:
-            await db.decoders.insert_many(backup.decoders)
-        if backup.sound_projects:
-            await db.sound_projects.insert_many(backup.sound_projects)
-        
+async def restore_backup(backup: BackupData, mode: str = "replace", policy: str = "newer"):
+    """
+    Restore data from a backup.
+    mode=replace replaces all existing data; mode=merge upserts by id using
+    policy newer (keep the most recent updated_at, falling back to created_at),
+    keep_existing or overwrite.
+
+    A replace restore copies and swaps each collection in turn, and CRUD writes
+    are not blocked meanwhile: a write made to a collection after its copy is
+    taken is lost, both from the restored data and from the rollback copy.
+    If a swap fails, the collections already swapped are put back.
+    """
+    if mode not in ("replace", "merge"):
+        raise HTTPException(status_code=400, detail=f"Modo de restauración no válido: {mode}")
+    if mode == "merge" and policy not in RESTORE_MERGE_POLICIES:
+        raise HTTPException(status_code=400, detail=f"Política de combinación no válida: {policy}")
+    if _restore_lock.locked():
+        raise HTTPException(status_code=409, detail="Ya hay una restauración en curso")
+
+    if mode == "merge":
+        async with _restore_lock:
+            merged = {}
+            try:
+                for name in RESTORE_COLLECTIONS:
+                    docs = getattr(backup, name)
+                    if docs is not None:
+                        merged[name] = await _merge_collection(name, docs, policy)
+                        await bump_collection_version(name)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error al combinar backup: {str(e)}")
         return {
-            "message": "Backup restaurado correctamente",
-            "restored": {
-                "locomotives": len(backup.locomotives),
-                "rolling_stock": len(backup.rolling_stock),
-                "decoders": len(backup.decoders),
-                "sound_projects": len(backup.sound_projects)
-            }
+            "message": "Backup combinado correctamente",
+            "mode": mode,
+            "policy": policy,
+            "merged": merged
         }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al restaurar backup: {str(e)}")
+
+    missing = [name for name in RESTORE_COLLECTIONS if getattr(backup, name) is None]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"El backup no contiene: {', '.join(missing)}")
+
+    async with _restore_lock:
+        data = {name: getattr(backup, name) for name in RESTORE_COLLECTIONS}
+        try:
+            # Load and verify every collection before touching live data
+            for name, docs in data.items():
+                await _load_staging_collection(name, docs)
+        except Exception as e:
+            for name in RESTORE_COLLECTIONS:
+                await db.drop_collection(_staging_name(name))
+            raise HTTPException(status_code=500, detail=f"Error al restaurar backup: {str(e)}")
+
+        existing = set(await db.list_collection_names())
+        copied, swapped = [], []
+        try:
+            created_at = datetime.now(timezone.utc)
+            expires_at = created_at + timedelta(hours=RESTORE_ROLLBACK_HOURS)
+            for name in RESTORE_COLLECTIONS:
+                if name in existing:
+                    # Server-side copy of the current data; reads still hit `name`
+                    await db[name].aggregate([{"$match": {}}, {"$out": _rollback_name(name)}]).to_list(None)
+                    await db.restore_rollbacks.update_one(
+                        {"collection": name},
+                        {"$set": {
+                            "collection": name,
+                            "rollback_collection": _rollback_name(name),
+                            "created_at": created_at.isoformat(),
+                            "expires_at": expires_at.isoformat()
+                        }},
+                        upsert=True
+                    )
+                copied.append(name)
+                await db[_staging_name(name)].rename(name, dropTarget=True)
+                swapped.append(name)
+                await bump_collection_version(name)
+        except Exception as e:
+            logger.exception("Error al restaurar backup, deshaciendo cambios")
+            try:
+                await _undo_swap(swapped, copied, existing)
+            finally:
+                for name in RESTORE_COLLECTIONS:
+                    await db.drop_collection(_staging_name(name))
+            raise HTTPException(status_code=500, detail=f"Error al restaurar backup: {str(e)}")
+
+        await _drop_expired_rollbacks()
+
+    return {
+        "message": "Backup restaurado correctamente",
+        "restored": {name: len(docs) for name, docs in data.items()},
+        "rollback_expires_at": expires_at.isoformat()
+    }
+
+@api_router.post("/restore/rollback")
+async def rollback_restore():
+    """Put back the data that was replaced by the last restore"""
+    if _restore_lock.locked():
+        raise HTTPException(status_code=409, detail="Ya hay una restauración en curso")
+
+    async with _restore_lock:
+        await _drop_expired_rollbacks()
+        entries = await db.restore_rollbacks.find({}, {"_id": 0}).to_list(len(RESTORE_COLLECTIONS))
+        if not entries:
+            raise HTTPException(status_code=404, detail="No hay copia de seguridad previa disponible")
+
+        restored = {}
+        for entry in entries:
+            name = entry['collection']
+            await _copy_indexes(name, entry['rollback_collection'])
+            await db[entry['rollback_collection']].rename(name, dropTarget=True)
+            await db.restore_rollbacks.delete_one({"collection": name})
+            await bump_collection_version(name)
+            restored[name] = await db[name].count_documents({})
+
+    return {"message": "Datos anteriores recuperados", "restored": restored}
 
 # ============== JMRI IMPORT ENDPOINT ==============
 
-import xml.etree.ElementTree as ET
-import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from jmri import parse_jmri_xml, parse_roster_index, build_jmri_xml, build_roster_index, unpack_cv_sheet
+from collections import OrderedDict, deque
 
 class JMRIImportResult(BaseModel):
     success: bool
@@ -636,300 +1250,1047 @@ class JMRIImportResult(BaseModel):
     skipped_count: int
     errors: List[str]
     locomotives: List[dict]
+    inserted_count: int = 0
+    updated_count: int = 0
 
-def parse_jmri_xml(xml_content: str) -> dict:
-    """Parse JMRI locomotive XML and extract relevant data"""
-    try:
-        root = ET.fromstring(xml_content)
-        loco_elem = root.find('locomotive')
-        
-        if loco_elem is None:
-            return None
-        
-        # Extract basic info from locomotive attributes
-        # CORRECTED MAPPING:
-        # - XML 'model' attribute (e.g., "HN2351") -> app 'reference' field
-        # - XML 'roadName' attribute (e.g., "Ferrobus.591.500") -> app 'model' field
-        mfg = loco_elem.get('mfg', '')
-        xml_model = loco_elem.get('model', '')  # This is the reference (e.g., HN2351)
-        road_name = loco_elem.get('roadName', '')  # This is the model name (e.g., Ferrobus.591.500)
-        road_number = loco_elem.get('roadNumber', '')
-        dcc_address = loco_elem.get('dccAddress', '3')
-        comment = loco_elem.get('comment', '')
-        
-        # Extract decoder info
-        decoder_elem = loco_elem.find('decoder')
-        decoder_brand = ''
-        decoder_model = ''
-        decoder_family = ''
-        if decoder_elem is not None:
-            decoder_family = decoder_elem.get('family', '')
-            decoder_model = decoder_elem.get('model', '')
-            # Extract brand from family (e.g., "ESU LokSound 5 DCC" -> "ESU")
-            if decoder_family:
-                parts = decoder_family.split(' ')
-                if parts:
-                    decoder_brand = parts[0]
-        
-        # Extract Project Loco Name from varValue items
-        # Look in decoderDef section for varValue items
-        project_name = ''
-        project_type = ''
-        decoder_def = loco_elem.find('.//decoderDef')
-        if decoder_def is not None:
-            for var in decoder_def.findall('varValue'):
-                item = var.get('item', '')
-                value = var.get('value', '')
-                if item == 'Project Loco Name':
-                    project_name = value
-                elif item == 'Project Loco Type':
-                    project_type = value
-        
-        # Also check in values section (after decoderDef closes)
-        # The Project Loco Name might be stored as ASCII values in CVs 1.0.261-1.0.288
-        values_elem = loco_elem.find('values')
-        if values_elem is not None and not project_name:
-            # Try to extract project name from CV values (1.0.261-1.0.288 are ASCII chars)
-            project_chars = []
-            for cv_elem in values_elem.findall('CVvalue'):
-                cv_name = cv_elem.get('name', '')
-                cv_value = cv_elem.get('value', '')
-                if cv_name.startswith('1.0.') and cv_value.isdigit():
-                    cv_index = cv_name.split('.')[-1]
-                    if cv_index.isdigit():
-                        idx = int(cv_index)
-                        if 261 <= idx <= 288:
-                            char_val = int(cv_value)
-                            if char_val > 0:
-                                project_chars.append((idx, chr(char_val)))
-            if project_chars:
-                project_chars.sort(key=lambda x: x[0])
-                project_name = ''.join([c[1] for c in project_chars]).strip()
-        
-        # Extract function labels from functionlabels element
-        functions = []
-        func_labels = loco_elem.find('functionlabels')
-        if func_labels is not None:
-            for func_label in func_labels.findall('functionlabel'):
-                num = func_label.get('num', '')
-                lockable = func_label.get('lockable', 'false')
-                label_text = func_label.text or ''
-                if num and label_text:
-                    functions.append({
-                        'function_number': f'F{num}',
-                        'description': label_text,
-                        'is_sound': False  # Will be updated based on soundlabel
-                    })
-        
-        # Extract sound labels from soundlabels element
-        sound_labels = loco_elem.find('soundlabels')
-        if sound_labels is not None:
-            for sound_label in sound_labels.findall('soundlabel'):
-                num = sound_label.get('num', '')
-                label_text = sound_label.text or ''
-                if num and label_text:
-                    # Mark corresponding function as sound
-                    for func in functions:
-                        if func['function_number'] == f'F{num}':
-                            func['is_sound'] = True
-                            break
-                    else:
-                        # Add as new function if not found
-                        functions.append({
-                            'function_number': f'F{num}',
-                            'description': label_text,
-                            'is_sound': True
-                        })
-        
-        # Extract CV values
-        cv_modifications = []
-        if values_elem is not None:
-            # Get important CVs only (not all the ESU function mapping)
-            important_cvs = {
-                '1': 'Dirección corta',
-                '2': 'Vstart',
-                '3': 'Aceleración',
-                '4': 'Deceleración',
-                '5': 'Vmax',
-                '6': 'Vmedia',
-                '29': 'Configuración',
-                '17': 'Dirección larga (alta)',
-                '18': 'Dirección larga (baja)',
-            }
-            for cv_elem in values_elem.findall('CVvalue'):
-                cv_name = cv_elem.get('name', '')
-                cv_value = cv_elem.get('value', '')
-                # Only include simple CVs (not indexed ones like 16.2.xxx)
-                if cv_name and '.' not in cv_name and cv_name in important_cvs:
-                    try:
-                        cv_modifications.append({
-                            'cv_number': int(cv_name),
-                            'value': int(cv_value),
-                            'description': important_cvs.get(cv_name, f'CV{cv_name}')
-                        })
-                    except ValueError:
-                        pass
-        
-        # Determine locomotive type based on project name or road name
-        loco_type = 'diesel'  # default
-        name_lower = (road_name + ' ' + project_name).lower()
-        if any(x in name_lower for x in ['electric', 'eléctric', '252', '269', '251', 'ave', 'alta velocidad']):
-            loco_type = 'electrica'
-        elif any(x in name_lower for x in ['vapor', 'steam', '141', '240', '030']):
-            loco_type = 'vapor'
-        elif any(x in name_lower for x in ['automotor', 'dmu', 'emu', '592', '594', '596', 'ferrobus']):
-            loco_type = 'automotor'
-        elif any(x in name_lower for x in ['ave', 's-100', 's-102', 's-103', 'talgo', 'alta velocidad']):
-            loco_type = 'alta_velocidad'
-        
-        # Build sound project name from decoder info and project name
-        sound_project = ''
-        if decoder_brand and project_name:
-            sound_project = f"{decoder_brand} - {project_name}"
-        elif project_name:
-            sound_project = project_name
-        elif decoder_family:
-            sound_project = decoder_family
-        
-        return {
-            'brand': mfg,
-            'model': road_name or project_name,  # roadName goes to model
-            'reference': xml_model,  # XML model attribute goes to reference
-            'locomotive_type': loco_type,
-            'paint_scheme': '',
-            'registration_number': road_number,
-            'prototype_type': project_name or project_type,
-            'dcc_address': str(dcc_address) if dcc_address else "3",  # Convert to string
-            'decoder_brand': decoder_brand,
-            'decoder_model': decoder_model,
-            'sound_project': sound_project,
-            'notes': comment,
-            'cv_modifications': cv_modifications,
-            'condition': 'nuevo',
-            'functions': functions,
+# XML parsing is CPU-bound, so it runs in a process pool instead of the event loop
+JMRI_PARSE_WORKERS = int(os.environ.get('JMRI_PARSE_WORKERS', '0')) or os.cpu_count() or 1
+
+_jmri_executor: Optional[ProcessPoolExecutor] = None
+
+def get_jmri_executor() -> ProcessPoolExecutor:
+    global _jmri_executor
+    if _jmri_executor is None:
+        _jmri_executor = ProcessPoolExecutor(max_workers=JMRI_PARSE_WORKERS)
+    return _jmri_executor
+
+def shutdown_jmri_executor(executor: Optional[ProcessPoolExecutor] = None):
+    """Shut down the pool; with `executor`, only if it is still the current one"""
+    global _jmri_executor
+    if executor is not None and executor is not _jmri_executor:
+        # Another request already replaced the broken pool; leave the new one alone
+        return
+    if _jmri_executor is not None:
+        _jmri_executor.shutdown(wait=False, cancel_futures=True)
+        _jmri_executor = None
+
+# Parse results keyed by the SHA-256 of the file, so a preview followed by a
+# commit (or an unchanged file imported again) is only parsed once
+JMRI_PARSE_CACHE_SIZE = int(os.environ.get('JMRI_PARSE_CACHE_SIZE', '512'))
+
+_jmri_parse_cache: "OrderedDict[str, dict]" = OrderedDict()
+
+def _jmri_content_hash(xml_content) -> str:
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode('utf-8')
+    return hashlib.sha256(xml_content).hexdigest()
+
+def get_cached_jmri_parse(sha256: str) -> Optional[dict]:
+    loco_data = _jmri_parse_cache.get(sha256)
+    if loco_data is not None:
+        _jmri_parse_cache.move_to_end(sha256)
+    return loco_data
+
+def _cache_jmri_parse(sha256: str, loco_data: dict):
+    _jmri_parse_cache[sha256] = loco_data
+    _jmri_parse_cache.move_to_end(sha256)
+    while len(_jmri_parse_cache) > JMRI_PARSE_CACHE_SIZE:
+        _jmri_parse_cache.popitem(last=False)
+
+async def parse_jmri_sources(count: int, load):
+    """
+    Parse JMRI files in the process pool, yielding (index, sha256, loco_data, error)
+    as each file finishes. `load(index)` returns the file content and is only
+    awaited once a slot is free, so at most twice the worker count is in memory.
+    Files already in the parse cache are not parsed again.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(JMRI_PARSE_WORKERS * 2)
+
+    async def parse_one(index: int):
+        async with semaphore:
+            sha256 = None
+            executor = None
+            try:
+                xml_content = await load(index)
+                sha256 = _jmri_content_hash(xml_content)
+                loco_data = get_cached_jmri_parse(sha256)
+                if loco_data is None:
+                    executor = get_jmri_executor()
+                    loco_data = await loop.run_in_executor(executor, parse_jmri_xml, xml_content)
+                    if loco_data:
+                        _cache_jmri_parse(sha256, loco_data)
+                return index, sha256, loco_data, None
+            except BrokenProcessPool as e:
+                # A worker died; drop that pool so the next files start a fresh one
+                shutdown_jmri_executor(executor)
+                return index, sha256, None, e
+            except Exception as e:
+                return index, sha256, None, e
+
+    for next_done in asyncio.as_completed([parse_one(i) for i in range(count)]):
+        yield await next_done
+
+async def parse_jmri_files(files_content: List[str]):
+    """Parse in-memory JMRI files, yielding (index, sha256, loco_data, error) as each finishes"""
+    async def load(index: int):
+        return files_content[index]
+
+    async for outcome in parse_jmri_sources(len(files_content), load):
+        yield outcome
+
+# Fields that identify an imported locomotive when the roster is re-synced:
+# reference = brand + reference + DCC address, roster_id = JMRI roster id
+# (falling back to the reference fields when the file has no id)
+JMRI_IDENTITIES = {
+    "reference": ["brand", "reference", "dcc_address"],
+    "roster_id": ["jmri_id"],
+}
+JMRI_IDENTITY = os.environ.get('JMRI_IDENTITY', 'reference')
+
+# Parsed fields that are only defaults or guesses, so re-syncing must not overwrite user edits
+JMRI_INSERT_ONLY_FIELDS = {"condition", "paint_scheme", "locomotive_type"}
+
+def _jmri_identity_filter(loco_data: dict, identity: str) -> dict:
+    """Build the query matching an existing locomotive for a parsed roster entry"""
+    if identity == "roster_id" and loco_data.get('jmri_id'):
+        return {"jmri_id": loco_data['jmri_id']}
+    return {field: loco_data.get(field, '') for field in JMRI_IDENTITIES["reference"]}
+
+def _jmri_identity_key(query: dict) -> str:
+    return json.dumps(query, sort_keys=True, default=str)
+
+async def upsert_jmri_locomotives(locos: List[dict], identity: str = JMRI_IDENTITY) -> dict:
+    """
+    Upsert parsed JMRI locomotives in one unordered bulk write.
+    Returns inserted/updated counts, the write error for each failed input index
+    and, for entries sharing an identity with a later one, the index that was written.
+    """
+    result = {"inserted": 0, "updated": 0, "errors": {}, "duplicates": {}}
+    # Entries sharing an identity collapse into one write (the last one wins)
+    operations = {}
+    for index, loco_data in enumerate(locos):
+        query = _jmri_identity_filter(loco_data, identity)
+        key = _jmri_identity_key(query)
+        if key in operations:
+            result["duplicates"][operations[key][0]] = index
+        operations[key] = (index, query, loco_data)
+    for index, kept in list(result["duplicates"].items()):
+        # Follow chains of three or more entries to the one that was written
+        while kept in result["duplicates"]:
+            kept = result["duplicates"][kept]
+        result["duplicates"][index] = kept
+    if not operations:
+        return result
+
+    requests = []
+    request_indexes = []
+    now = datetime.now(timezone.utc).isoformat()
+    for index, query, loco_data in operations.values():
+        doc = Locomotive(**loco_data).model_dump()
+        doc['created_at'] = now
+        doc['updated_at'] = now
+        # Only values the roster actually has are synced, so empty JMRI fields
+        # (e.g. no comment) do not wipe what the user entered in the app.
+        # Fields outside the model (the packed cv_sheet) are stored as parsed.
+        synced = {
+            k: doc.get(k, loco_data[k]) for k in loco_data
+            if k not in JMRI_INSERT_ONLY_FIELDS and loco_data[k] not in ('', None, [])
         }
-    except ET.ParseError as e:
-        raise ValueError(f"Error parsing XML: {str(e)}")
+        synced['updated_at'] = now
+        on_insert = {k: v for k, v in doc.items() if k not in synced and k not in query}
+        requests.append(UpdateOne(query, {"$set": synced, "$setOnInsert": on_insert}, upsert=True))
+        request_indexes.append(index)
 
-@api_router.post("/import/jmri", response_model=JMRIImportResult)
-async def import_jmri(files_content: List[str]):
-    """Import locomotives from JMRI XML files"""
-    imported = []
-    skipped = 0
-    errors = []
-    
-    for i, xml_content in enumerate(files_content):
+    try:
+        write_result = await db.locomotives.bulk_write(requests, ordered=False)
+        result["inserted"] = write_result.upserted_count
+        result["updated"] = write_result.matched_count
+    except BulkWriteError as e:
+        details = e.details
+        result["inserted"] = details.get('nUpserted', 0)
+        result["updated"] = details.get('nMatched', 0)
+        for write_error in details.get('writeErrors', []):
+            result["errors"][request_indexes[write_error['index']]] = write_error.get('errmsg', 'Error de escritura')
+    return result
+
+def _check_jmri_identity(identity: Optional[str]) -> str:
+    identity = identity or JMRI_IDENTITY
+    if identity not in JMRI_IDENTITIES:
+        raise HTTPException(status_code=400, detail=f"Identidad no válida: {identity}")
+    return identity
+
+async def _parse_jmri_request(files_content: List[str]):
+    """Parse request files, returning (parsed, hashes, errors) keyed by file index"""
+    parsed = {}
+    hashes = {}
+    errors_by_file = {}
+    async for i, sha256, loco_data, error in parse_jmri_files(files_content):
+        hashes[i] = sha256
         try:
-            loco_data = parse_jmri_xml(xml_content)
+            if error is not None:
+                raise error
             if loco_data:
-                # Create locomotive
-                loco_obj = Locomotive(**loco_data)
-                doc = loco_obj.model_dump()
-                doc['created_at'] = doc['created_at'].isoformat()
-                doc['updated_at'] = doc['updated_at'].isoformat()
-                await db.locomotives.insert_one(doc)
-                imported.append({
-                    'brand': loco_data['brand'],
-                    'model': loco_data['model'],
-                    'dcc_address': loco_data['dcc_address']
-                })
+                Locomotive(**loco_data)  # Validate before writing
+                parsed[i] = loco_data
             else:
-                skipped += 1
-                errors.append(f"Archivo {i+1}: No se encontró elemento locomotive")
+                errors_by_file[i] = f"Archivo {i+1}: No se encontró elemento locomotive"
         except Exception as e:
-            skipped += 1
-            errors.append(f"Archivo {i+1}: {str(e)}")
+            errors_by_file[i] = f"Archivo {i+1}: {str(e)}"
+    return parsed, hashes, errors_by_file
+
+async def _write_jmri_import(parsed: Dict[int, dict], errors_by_file: Dict[int, str], identity: str,
+                             size_bytes: Optional[int], started: float) -> JMRIImportResult:
+    """Upsert parsed locomotives and build the import result in file order"""
+    file_order = sorted(parsed)
+    write = await upsert_jmri_locomotives([parsed[i] for i in file_order], identity)
+    for position, message in write["errors"].items():
+        i = file_order[position]
+        errors_by_file[i] = f"Archivo {i+1}: {message}"
+        del parsed[i]
+    for position, kept in write["duplicates"].items():
+        i = file_order[position]
+        errors_by_file[i] = f"Archivo {i+1}: Es la misma locomotora que el archivo {file_order[kept]+1}, se omite"
+        del parsed[i]
+    
+    # Report in file order regardless of completion order
+    imported = [{
+        'brand': parsed[i]['brand'],
+        'model': parsed[i]['model'],
+        'dcc_address': parsed[i]['dcc_address']
+    } for i in sorted(parsed)]
+    errors = [errors_by_file[i] for i in sorted(errors_by_file)]
     
     # Record in backup history
     if imported:
-        history_entry = BackupHistoryEntry(
+        await bump_collection_version("locomotives")
+        await record_backup_history(BackupHistoryEntry(
             type="jmri_import",
             locomotives_count=len(imported),
             rolling_stock_count=0,
             decoders_count=0,
-            sound_projects_count=0
-        )
-        history_doc = history_entry.model_dump()
-        history_doc['created_at'] = history_doc['created_at'].isoformat()
-        await db.backup_history.insert_one(history_doc)
+            sound_projects_count=0,
+            size_bytes=size_bytes,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1)
+        ))
     
     return JMRIImportResult(
         success=len(imported) > 0,
         imported_count=len(imported),
-        skipped_count=skipped,
+        skipped_count=len(errors),
         errors=errors,
-        locomotives=imported
+        locomotives=imported,
+        inserted_count=write["inserted"],
+        updated_count=write["updated"]
     )
 
-# ============== WISHLIST ENDPOINTS ==============
+@api_router.post("/import/jmri", response_model=JMRIImportResult)
+async def import_jmri(files_content: List[str], identity: Optional[str] = None):
+    """
+    Import locomotives from JMRI XML files.
+    Existing locomotives matching the identity (reference or roster_id) are updated.
+    """
+    identity = _check_jmri_identity(identity)
+    started = time.perf_counter()
+    parsed, _, errors_by_file = await _parse_jmri_request(files_content)
+    size_bytes = sum(len(xml_content.encode('utf-8')) for xml_content in files_content)
+    return await _write_jmri_import(parsed, errors_by_file, identity, size_bytes, started)
 
-@api_router.get("/wishlist", response_model=List[WishlistItem])
-async def get_wishlist():
-    items = await db.wishlist.find({}, {"_id": 0}).to_list(1000)
-    for item in items:
-        if isinstance(item.get('created_at'), str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        if isinstance(item.get('updated_at'), str):
-            item['updated_at'] = datetime.fromisoformat(item['updated_at'])
-    return items
+class JMRIPreviewResult(BaseModel):
+    files: List[dict]
+    would_insert_count: int
+    would_update_count: int
+    errors: List[str]
+    conflicts: List[dict]
 
-@api_router.get("/wishlist/{item_id}", response_model=WishlistItem)
-async def get_wishlist_item(item_id: str):
-    item = await db.wishlist.find_one({"id": item_id}, {"_id": 0})
-    if not item:
-        raise HTTPException(status_code=404, detail="Item no encontrado")
-    if isinstance(item.get('created_at'), str):
-        item['created_at'] = datetime.fromisoformat(item['created_at'])
-    if isinstance(item.get('updated_at'), str):
-        item['updated_at'] = datetime.fromisoformat(item['updated_at'])
-    return item
+class JMRICommitRequest(BaseModel):
+    hashes: List[str]
+    identity: Optional[str] = None
 
-@api_router.post("/wishlist", response_model=WishlistItem)
-async def create_wishlist_item(item: WishlistItemCreate):
-    item_dict = item.model_dump()
-    item_obj = WishlistItem(**item_dict)
-    doc = item_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.wishlist.insert_one(doc)
-    return item_obj
+@api_router.post("/import/jmri/preview", response_model=JMRIPreviewResult)
+async def preview_jmri_import(files_content: List[str], identity: Optional[str] = None):
+    """
+    Parse JMRI files without writing and report what an import would do.
+    Parse results stay cached by SHA-256 for /import/jmri/commit.
+    """
+    identity = _check_jmri_identity(identity)
+    parsed, hashes, errors_by_file = await _parse_jmri_request(files_content)
 
-@api_router.put("/wishlist/{item_id}", response_model=WishlistItem)
-async def update_wishlist_item(item_id: str, item: WishlistItemCreate):
-    existing = await db.wishlist.find_one({"id": item_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Item no encontrado")
-    
-    update_data = item.model_dump()
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-    update_data['id'] = item_id
-    update_data['created_at'] = existing.get('created_at', datetime.now(timezone.utc).isoformat())
-    
-    await db.wishlist.update_one({"id": item_id}, {"$set": update_data})
-    
-    updated = await db.wishlist.find_one({"id": item_id}, {"_id": 0})
-    if isinstance(updated.get('created_at'), str):
-        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
-    if isinstance(updated.get('updated_at'), str):
-        updated['updated_at'] = datetime.fromisoformat(updated['updated_at'])
-    return updated
+    queries = {i: _jmri_identity_filter(loco_data, identity) for i, loco_data in parsed.items()}
+    unique_queries = {_jmri_identity_key(query): query for query in queries.values()}
+    existing = {}
+    query_list = list(unique_queries.values())
+    projection = {"_id": 0, "id": 1, "brand": 1, "model": 1, "reference": 1, "dcc_address": 1, "jmri_id": 1}
+    for start in range(0, len(query_list), JMRI_IMPORT_BATCH_SIZE):
+        chunk = query_list[start:start + JMRI_IMPORT_BATCH_SIZE]
+        async for doc in db.locomotives.find({"$or": chunk}, projection):
+            # A document can match a query by roster id or by reference fields
+            keys = {_jmri_identity_key({field: doc.get(field, '') for field in JMRI_IDENTITIES["reference"]})}
+            if doc.get('jmri_id'):
+                keys.add(_jmri_identity_key({"jmri_id": doc['jmri_id']}))
+            for key in keys:
+                if key in unique_queries:
+                    existing.setdefault(key, []).append(doc)
 
-@api_router.delete("/wishlist/{item_id}")
-async def delete_wishlist_item(item_id: str):
-    result = await db.wishlist.delete_one({"id": item_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Item no encontrado")
-    return {"message": "Item eliminado"}
+    files = []
+    conflicts = []
+    seen_keys = {}
+    would_insert = set()
+    would_update = set()
+    for i in range(len(files_content)):
+        entry = {"index": i, "sha256": hashes.get(i)}
+        if i not in parsed:
+            entry.update(action="error", error=errors_by_file.get(i))
+            files.append(entry)
+            continue
+        key = _jmri_identity_key(queries[i])
+        matches = existing.get(key, [])
+        entry["locomotive"] = {k: v for k, v in parsed[i].items() if k != 'cv_sheet'}
+        entry["cv_count"] = (parsed[i].get('cv_sheet') or {}).get('count', 0)
+        if matches:
+            entry.update(action="update", existing_id=matches[0]['id'])
+            would_update.add(key)
+            conflicts.append({
+                "type": "existing",
+                "index": i,
+                "existing": matches[0],
+                "matches": len(matches)
+            })
+        else:
+            entry["action"] = "insert"
+            would_insert.add(key)
+        if key in seen_keys:
+            conflicts.append({"type": "duplicate", "index": i, "duplicate_of": seen_keys[key]})
+        else:
+            seen_keys[key] = i
+        files.append(entry)
 
-@api_router.post("/wishlist/{item_id}/move-to-collection")
-async def move_wishlist_to_collection(item_id: str, purchase_date: Optional[str] = None, price: Optional[float] = None):
-    """Move a wishlist item to the collection (create locomotive or rolling stock)"""
-    item = await db.wishlist.find_one({"id": item_id}, {"_id": 0})
-    if not item:
-        raise HTTPException(status_code=404, detail="Item no encontrado")
-    
-    actual_price = price if price is not None else item.get('estimated_price')
-    actual_date = purchase_date or datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    return JMRIPreviewResult(
+        files=files,
+        would_insert_count=len(would_insert),
+        would_update_count=len(would_update),
+        errors=[errors_by_file[i] for i in sorted(errors_by_file)],
+        conflicts=conflicts
+    )
+
+@api_router.post("/import/jmri/commit", response_model=JMRIImportResult)
+async def commit_jmri_import(request: JMRICommitRequest):
+    """Import previewed JMRI files by hash from the parse cache"""
+    identity = _check_jmri_identity(request.identity)
+    started = time.perf_counter()
+    parsed = {}
+    errors_by_file = {}
+    for i, sha256 in enumerate(request.hashes):
+        loco_data = get_cached_jmri_parse(sha256)
+        if loco_data is None:
+            errors_by_file[i] = f"Archivo {i+1}: El análisis ya no está en caché, vuelve a previsualizar"
+        else:
+            parsed[i] = loco_data
+    return await _write_jmri_import(parsed, errors_by_file, identity, None, started)
+
+# Roster archives are read member by member, so only the largest files are in memory
+JMRI_ARCHIVE_MAX_MEMBER_MB = int(os.environ.get('JMRI_ARCHIVE_MAX_MEMBER_MB', '20'))
+JMRI_IMPORT_BATCH_SIZE = int(os.environ.get('JMRI_IMPORT_BATCH_SIZE', '500'))
+
+def _select_roster_members(archive: zipfile.ZipFile):
+    """
+    Pick the locomotive files from a roster ZIP.
+    Returns (members, errors): roster.xml decides which files to import when
+    present, otherwise every other .xml file is imported.
+    """
+    xml_members = {}
+    index_member = None
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        name = info.filename.rsplit('/', 1)[-1]
+        if not name.lower().endswith('.xml') or name.startswith('.'):
+            continue
+        if name.lower() == 'roster.xml':
+            index_member = index_member or info
+        else:
+            xml_members.setdefault(name, info)
+
+    if index_member is None:
+        return sorted(xml_members.values(), key=lambda info: info.filename), []
+
+    with archive.open(index_member) as index_file:
+        file_names = parse_roster_index(index_file)
+    members = []
+    errors = []
+    for file_name in dict.fromkeys(file_names):
+        info = xml_members.get(file_name.replace('\\', '/').rsplit('/', 1)[-1])
+        if info is None:
+            errors.append(f"Archivo {file_name}: No está en el ZIP")
+        else:
+            members.append(info)
+    return members, errors
+
+def _read_roster_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    """Read one ZIP member, refusing members over the size limit"""
+    max_bytes = JMRI_ARCHIVE_MAX_MEMBER_MB * 1024 * 1024
+    if info.file_size > max_bytes:
+        raise ValueError(f"Supera el límite de {JMRI_ARCHIVE_MAX_MEMBER_MB} MB")
+    with archive.open(info) as member:
+        content = member.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise ValueError(f"Supera el límite de {JMRI_ARCHIVE_MAX_MEMBER_MB} MB")
+    return content
+
+async def _open_jmri_archive(fileobj) -> tuple:
+    """Open a roster ZIP and pick its locomotive files; returns (archive, members, errors)"""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+        members, errors = await asyncio.to_thread(_select_roster_members, archive)
+    except (zipfile.BadZipFile, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"El archivo no es un ZIP de roster JMRI válido: {str(e)}")
+    if not members and not errors:
+        raise HTTPException(status_code=400, detail="El ZIP no contiene archivos de locomotora JMRI")
+    return archive, members, errors
+
+@api_router.post("/import/jmri/archive", response_model=JMRIImportResult)
+async def import_jmri_archive(file: UploadFile = File(...), identity: Optional[str] = None):
+    """Import locomotives from a ZIP of a JMRI roster folder"""
+    identity = _check_jmri_identity(identity)
+    started = time.perf_counter()
+    archive, members, errors = await _open_jmri_archive(file.file)
+    return await _import_jmri_archive(archive, members, errors, identity, started)
+
+async def _import_jmri_archive(archive: zipfile.ZipFile, members: list, errors: List[str], identity: str,
+                               started: float, job: Optional["_ImportJobRun"] = None) -> JMRIImportResult:
+    """Parse and upsert the selected roster members; `job` gets progress and can stop it"""
+    async def load(index: int):
+        return await asyncio.to_thread(_read_roster_member, archive, members[index])
+
+    imported = []
+    inserted = 0
+    updated = 0
+    batch = []
+
+    async def flush():
+        nonlocal inserted, updated
+        write = await upsert_jmri_locomotives([loco_data for _, loco_data in batch], identity)
+        inserted += write["inserted"]
+        updated += write["updated"]
+        for position, (name, loco_data) in enumerate(batch):
+            if position in write["errors"]:
+                errors.append(f"Archivo {name}: {write['errors'][position]}")
+            elif position in write["duplicates"]:
+                kept_name = batch[write["duplicates"][position]][0]
+                errors.append(f"Archivo {name}: Es la misma locomotora que el archivo {kept_name}, se omite")
+            else:
+                imported.append({
+                    'brand': loco_data['brand'],
+                    'model': loco_data['model'],
+                    'dcc_address': loco_data['dcc_address']
+                })
+        batch.clear()
+
+    processed = 0
+    with archive:
+        async for i, _, loco_data, error in parse_jmri_sources(len(members), load):
+            if job is not None:
+                if job.cancel_requested:
+                    batch.clear()
+                    break
+                processed += 1
+                await job.progress(errors, files=processed, total=len(members), imported=len(imported))
+            name = members[i].filename.rsplit('/', 1)[-1]
+            try:
+                if error is not None:
+                    raise error
+                if not loco_data:
+                    errors.append(f"Archivo {name}: No se encontró elemento locomotive")
+                    continue
+                Locomotive(**loco_data)  # Validate before writing
+                batch.append((name, loco_data))
+            except Exception as e:
+                errors.append(f"Archivo {name}: {str(e)}")
+                continue
+            if len(batch) >= JMRI_IMPORT_BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+        if job is not None:
+            await job.progress(errors, force=True, files=processed, total=len(members), imported=len(imported))
+
+    if imported:
+        await bump_collection_version("locomotives")
+        await record_backup_history(BackupHistoryEntry(
+            type="jmri_import",
+            locomotives_count=len(imported),
+            rolling_stock_count=0,
+            decoders_count=0,
+            sound_projects_count=0,
+            size_bytes=sum(info.file_size for info in members),
+            duration_ms=round((time.perf_counter() - started) * 1000, 1)
+        ))
+
+    return JMRIImportResult(
+        success=len(imported) > 0,
+        imported_count=len(imported),
+        skipped_count=len(errors),
+        errors=errors,
+        locomotives=imported,
+        inserted_count=inserted,
+        updated_count=updated
+    )
+
+# ============== JMRI ROSTER SYNC ==============
+
+# Optional folder with the JMRI roster files, polled for changes
+JMRI_ROSTER_DIR = os.environ.get('JMRI_ROSTER_DIR', '')
+JMRI_WATCH_INTERVAL = int(os.environ.get('JMRI_WATCH_INTERVAL', '30'))
+
+_jmri_sync_lock = asyncio.Lock()
+# file name -> (mtime_ns, size) of the last synced version, mirrors jmri_sync_state
+_jmri_sync_cache: Optional[Dict[str, tuple]] = None
+_jmri_sync_last_run: Optional[dict] = None
+
+def _scan_roster_dir(directory: Path) -> Dict[str, tuple]:
+    """Stat the locomotive files of a roster folder: name -> (mtime_ns, size)"""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name
+            if not entry.is_file() or not name.lower().endswith('.xml') or name.lower() == 'roster.xml':
+                continue
+            stat = entry.stat()
+            files[name] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def _load_jmri_sync_state() -> Dict[str, tuple]:
+    global _jmri_sync_cache
+    if _jmri_sync_cache is None:
+        _jmri_sync_cache = {}
+        async for state in db.jmri_sync_state.find({}, {"_id": 0, "file_name": 1, "mtime_ns": 1, "size": 1}):
+            _jmri_sync_cache[state['file_name']] = (state['mtime_ns'], state['size'])
+    return _jmri_sync_cache
+
+async def _save_jmri_sync_state(name: str, stat: tuple, sha256: str, error: Optional[str]):
+    await db.jmri_sync_state.update_one(
+        {"file_name": name},
+        {"$set": {
+            "file_name": name,
+            "mtime_ns": stat[0],
+            "size": stat[1],
+            "sha256": sha256,
+            "error": error,
+            "synced_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+    _jmri_sync_cache[name] = stat
+
+async def sync_jmri_roster_dir() -> dict:
+    """
+    Sync the roster folder: only files whose mtime or size changed are hashed,
+    and only files whose content hash changed are parsed and upserted.
+    """
+    global _jmri_sync_last_run
+    async with _jmri_sync_lock:
+        started = time.perf_counter()
+        directory = Path(JMRI_ROSTER_DIR)
+        cache = await _load_jmri_sync_state()
+        files = await asyncio.to_thread(_scan_roster_dir, directory)
+        summary = {
+            "scanned": len(files),
+            "changed": 0,
+            "imported": 0,
+            "inserted": 0,
+            "updated": 0,
+            "removed": 0,
+            "errors": [],
+        }
+
+        # Forget files that were removed; their locomotives are kept
+        removed = [name for name in cache if name not in files]
+        if removed:
+            await db.jmri_sync_state.delete_many({"file_name": {"$in": removed}})
+            for name in removed:
+                del cache[name]
+            summary["removed"] = len(removed)
+
+        changed = []
+        candidates = [name for name, stat in files.items() if cache.get(name) != stat]
+        if candidates:
+            stored = {}
+            async for state in db.jmri_sync_state.find(
+                    {"file_name": {"$in": candidates}}, {"_id": 0, "file_name": 1, "sha256": 1, "error": 1}):
+                stored[state['file_name']] = state
+
+            hashes = {}
+            for name in candidates:
+                try:
+                    hashes[name] = await asyncio.to_thread(_hash_file, directory / name)
+                except OSError as e:
+                    summary["errors"].append(f"Archivo {name}: {str(e)}")
+                    continue
+                previous = stored.get(name) or {}
+                if hashes[name] == previous.get('sha256'):
+                    # Touched but not modified: remember the new mtime, keeping any parse error
+                    await _save_jmri_sync_state(name, files[name], hashes[name], previous.get('error'))
+                else:
+                    changed.append(name)
+            summary["changed"] = len(changed)
+
+            async def load(index: int):
+                return await asyncio.to_thread((directory / changed[index]).read_bytes)
+
+            parsed = {}
+            file_errors = {}
+            async for i, _, loco_data, error in parse_jmri_sources(len(changed), load):
+                try:
+                    if error is not None:
+                        raise error
+                    if not loco_data:
+                        raise ValueError("No se encontró elemento locomotive")
+                    Locomotive(**loco_data)  # Validate before writing
+                    parsed[i] = loco_data
+                except Exception as e:
+                    file_errors[i] = str(e)
+
+            order = sorted(parsed)
+            for start in range(0, len(order), JMRI_IMPORT_BATCH_SIZE):
+                batch = order[start:start + JMRI_IMPORT_BATCH_SIZE]
+                write = await upsert_jmri_locomotives([parsed[i] for i in batch])
+                summary["inserted"] += write["inserted"]
+                summary["updated"] += write["updated"]
+                for position, message in write["errors"].items():
+                    file_errors[batch[position]] = message
+                for position, kept in write["duplicates"].items():
+                    file_errors[batch[position]] = f"Es la misma locomotora que el archivo {changed[batch[kept]]}, se omite"
+
+            for i, name in enumerate(changed):
+                error = file_errors.get(i)
+                if error is not None:
+                    summary["errors"].append(f"Archivo {name}: {error}")
+                else:
+                    summary["imported"] += 1
+                # Failed files are stored too, so they are retried only once they change
+                await _save_jmri_sync_state(name, files[name], hashes[name], error)
+
+        if summary["imported"]:
+            await bump_collection_version("locomotives")
+            await record_backup_history(BackupHistoryEntry(
+                type="jmri_import",
+                locomotives_count=summary["imported"],
+                rolling_stock_count=0,
+                decoders_count=0,
+                sound_projects_count=0,
+                size_bytes=sum(files[name][1] for name in changed),
+                duration_ms=round((time.perf_counter() - started) * 1000, 1)
+            ))
+
+        summary["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        summary["finished_at"] = datetime.now(timezone.utc).isoformat()
+        _jmri_sync_last_run = summary
+        return summary
+
+async def jmri_roster_watcher():
+    """Background loop polling the roster folder; an idle pass is one directory scan"""
+    while True:
+        try:
+            if not _jmri_sync_lock.locked():
+                summary = await sync_jmri_roster_dir()
+                if summary["changed"] or summary["removed"]:
+                    logger.info("Roster JMRI sincronizado: %s", summary)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error sincronizando el roster JMRI")
+        await asyncio.sleep(JMRI_WATCH_INTERVAL)
+
+@api_router.get("/import/jmri/sync")
+async def get_jmri_sync_status():
+    """Get the roster folder sync configuration and the last run"""
+    return {
+        "enabled": bool(JMRI_ROSTER_DIR),
+        "directory": JMRI_ROSTER_DIR or None,
+        "interval_seconds": JMRI_WATCH_INTERVAL,
+        "running": _jmri_sync_lock.locked(),
+        "tracked_files": await db.jmri_sync_state.count_documents({}),
+        "failed_files": await db.jmri_sync_state.find(
+            {"error": {"$ne": None}}, {"_id": 0, "file_name": 1, "error": 1, "synced_at": 1}
+        ).sort("file_name", 1).to_list(100),
+        "last_run": _jmri_sync_last_run
+    }
+
+@api_router.post("/import/jmri/sync")
+async def run_jmri_sync():
+    """Sync the roster folder right away"""
+    if not JMRI_ROSTER_DIR:
+        raise HTTPException(status_code=400, detail="No hay carpeta de roster JMRI configurada (JMRI_ROSTER_DIR)")
+    if _jmri_sync_lock.locked():
+        raise HTTPException(status_code=409, detail="Ya hay una sincronización en curso")
+    try:
+        return await sync_jmri_roster_dir()
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"No se pudo leer la carpeta de roster: {str(e)}")
+
+# ============== JMRI EXPORT ==============
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """
+    Write-only, unseekable sink for zipfile. Because it cannot seek, zipfile
+    writes sizes in data descriptors and the archive can be sent as it is built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+async def stream_zip(members):
+    """
+    Build a ZIP from an async iterator of (name, content) pairs, yielding the
+    compressed bytes after each member so only one member is held in memory.
+    """
+    sink = _ZipStreamBuffer()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        async for name, content in members:
+            info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            # Deflate off the event loop; members are written one at a time
+            await asyncio.to_thread(archive.writestr, info, content)
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory
+    yield sink.drain()
+
+JMRI_EXPORT_BATCH_SIZE = 50
+
+def _jmri_file_stem(text: str) -> str:
+    return re.sub(r'[^\w.-]+', '_', text).strip('_.') or 'locomotive'
+
+def _unique_name(base: str, used: set, template: str) -> str:
+    """First of base, base_2, base_3... (formatted with template) not in used, case-insensitive"""
+    name = template.format(base)
+    suffix = 2
+    while name.lower() in used:
+        name = template.format(f"{base}_{suffix}")
+        suffix += 1
+    used.add(name.lower())
+    return name
+
+def _build_jmri_files(entries: List[tuple]) -> List[bytes]:
+    return [build_jmri_xml(loco, roster_id, file_name) for loco, roster_id, file_name in entries]
+
+@api_router.get("/export/jmri")
+async def export_jmri():
+    """Export the locomotives as a ZIP of JMRI roster files plus roster.xml"""
+    async def members():
+        index_entries = []
+        used_ids = set()
+        used_names = set()
+        batch = []
+
+        async def flush():
+            # Building the XML (with the full CV sheet) is CPU work, keep it off the event loop
+            files = await asyncio.to_thread(_build_jmri_files, batch)
+            for (loco, roster_id, file_name), content in zip(batch, files):
+                index_entries.append(({
+                    'registration_number': loco.get('registration_number'),
+                    'model': loco.get('model'),
+                    'brand': loco.get('brand'),
+                    'reference': loco.get('reference'),
+                    'dcc_address': loco.get('dcc_address'),
+                    'notes': loco.get('notes'),
+                }, roster_id, file_name))
+                yield f"roster/{file_name}", content
+            batch.clear()
+
+        cursor = db.locomotives.find({}, {"_id": 0, "photo": 0}).batch_size(100)
+        async for loco in cursor:
+            roster_id = _unique_name(loco.get('jmri_id') or ' '.join(
+                part for part in (loco.get('model'), loco.get('registration_number')) if part
+            ) or loco['id'], used_ids, "{}")
+            file_name = _unique_name(_jmri_file_stem(roster_id), used_names, "{}.xml")
+            batch.append((loco, roster_id, file_name))
+            if len(batch) >= JMRI_EXPORT_BATCH_SIZE:
+                async for member in flush():
+                    yield member
+        if batch:
+            async for member in flush():
+                yield member
+        yield "roster.xml", await asyncio.to_thread(build_roster_index, index_entries)
+
+    return StreamingResponse(
+        stream_zip(members()),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=roster_jmri_{datetime.now().strftime('%Y%m%d')}.zip"}
+    )
+
+# ============== CV SHEETS ==============
+
+async def _get_cv_sheet(locomotive_id: str) -> dict:
+    """Decoded full CV sheet of a locomotive, {cv name: value}"""
+    loco = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0, "id": 1, "cv_sheet": 1})
+    if not loco:
+        raise HTTPException(status_code=404, detail="Locomotora no encontrada")
+    return unpack_cv_sheet(loco.get('cv_sheet'))
+
+def _cv_in_range(name: str, start: int, end: int, prefix: Optional[str]) -> bool:
+    cv_prefix, _, number = name.rpartition('.')
+    if (cv_prefix or None) != prefix:
+        return False
+    return start <= int(number) <= end
+
+@api_router.get("/locomotives/{locomotive_id}/cvs")
+async def get_locomotive_cvs(locomotive_id: str, start: int = 1, end: int = 1024, prefix: Optional[str] = None):
+    """
+    Get a range of the full CV sheet imported from JMRI.
+    Without prefix returns CVs start-end; with prefix (e.g. 16.2) the indexed CVs of that page.
+    """
+    cvs = await _get_cv_sheet(locomotive_id)
+    prefixes = sorted({name.rpartition('.')[0] for name in cvs if '.' in name})
+    return {
+        "locomotive_id": locomotive_id,
+        "total": len(cvs),
+        "indexed_prefixes": prefixes,
+        "cvs": [
+            {"cv": name, "value": value}
+            for name, value in cvs.items()
+            if _cv_in_range(name, start, end, prefix)
+        ]
+    }
+
+@api_router.get("/locomotives/{locomotive_id}/cvs/diff/{other_id}")
+async def diff_locomotive_cvs(locomotive_id: str, other_id: str):
+    """Compare the full CV sheets of two locomotives"""
+    left = await _get_cv_sheet(locomotive_id)
+    right = await _get_cv_sheet(other_id)
+    differences = [
+        {"cv": name, "value": left.get(name), "other_value": right.get(name)}
+        for name in list(left) + [name for name in right if name not in left]
+        if left.get(name) != right.get(name)
+    ]
+    return {
+        "locomotive_id": locomotive_id,
+        "other_id": other_id,
+        "compared": len(left.keys() | right.keys()),
+        "differences_count": len(differences),
+        "differences": differences
+    }
+
+# ============== CV ANALYSIS ==============
+
+import warnings
+import numpy as np
+
+CV_MATRIX_DEFAULT_CVS = [2, 3, 4, 5, 6, 29]
+CV_MATRIX_MAX_CVS = 64
+# Modified z-score (|x - median| / (1.4826 * MAD)) above which a value is an outlier
+CV_MATRIX_OUTLIER_SCORE = 3.5
+CV_MATRIX_CACHE_SIZE = 32
+
+# (decoder_brand, cvs, threshold) -> (locomotives version, result)
+_cv_matrix_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def _parse_cv_list(cvs: Optional[str]) -> List[int]:
+    if not cvs:
+        return list(CV_MATRIX_DEFAULT_CVS)
+    try:
+        numbers = list(dict.fromkeys(int(part) for part in cvs.split(',') if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Lista de CVs no válida: {cvs}")
+    if not numbers or len(numbers) > CV_MATRIX_MAX_CVS or not all(1 <= n <= 1024 for n in numbers):
+        raise HTTPException(status_code=400, detail=f"Lista de CVs no válida: {cvs}")
+    return numbers
+
+def _build_cv_matrix(locomotives: List[dict], cvs: List[int], threshold: float) -> dict:
+    """Locomotives x CVs matrix (NaN where a CV is not set), per-CV distributions and outliers"""
+    column_of = {cv: j for j, cv in enumerate(cvs)}
+    rows, cols, values = [], [], []
+    for i, loco in enumerate(locomotives):
+        for cv in loco.get('cv_modifications') or []:
+            j = column_of.get(cv.get('cv_number'))
+            if j is not None and isinstance(cv.get('value'), (int, float)):
+                rows.append(i)
+                cols.append(j)
+                values.append(cv['value'])
+
+    matrix = np.full((len(locomotives), len(cvs)), np.nan)
+    matrix[rows, cols] = values
+    present = ~np.isnan(matrix)
+    counts = present.sum(axis=0)
+
+    # nan* reductions warn on columns without values; those come out as NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        minimum = np.nanmin(matrix, axis=0)
+        maximum = np.nanmax(matrix, axis=0)
+        mean = np.nanmean(matrix, axis=0)
+        std = np.nanstd(matrix, axis=0)
+        median = np.nanmedian(matrix, axis=0)
+        deviation = np.abs(matrix - median)
+        mad = np.nanmedian(deviation, axis=0)
+        # With MAD 0 (most locomotives share a value) any other value is an outlier
+        score = np.where(mad > 0, deviation / (1.4826 * mad), np.where(deviation > 0, np.inf, 0.0))
+    outlier_rows, outlier_cols = np.nonzero(score > threshold)
+
+    def number(value):
+        if np.isnan(value):
+            return None
+        return int(value) if float(value).is_integer() else round(float(value), 3)
+
+    distributions = {}
+    for j, cv in enumerate(cvs):
+        column_values, column_counts = np.unique(matrix[present[:, j], j], return_counts=True)
+        distributions[str(cv)] = {
+            "count": int(counts[j]),
+            "min": number(minimum[j]),
+            "max": number(maximum[j]),
+            "mean": number(mean[j]),
+            "median": number(median[j]),
+            "std": number(std[j]),
+            "values": {str(number(v)): int(c) for v, c in zip(column_values, column_counts)}
+        }
+
+    return {
+        "cvs": cvs,
+        "locomotives": [
+            {
+                "id": loco['id'],
+                "brand": loco.get('brand'),
+                "model": loco.get('model'),
+                "reference": loco.get('reference'),
+                "values": [number(v) for v in row]
+            }
+            for loco, row in zip(locomotives, matrix)
+        ],
+        "distributions": distributions,
+        "outliers": [
+            {
+                "locomotive_id": locomotives[i]['id'],
+                "cv": cvs[j],
+                "value": number(matrix[i, j]),
+                "median": number(median[j]),
+                "score": None if np.isinf(score[i, j]) else round(float(score[i, j]), 2)
+            }
+            for i, j in zip(outlier_rows.tolist(), outlier_cols.tolist())
+        ]
+    }
+
+@api_router.get("/analysis/cv-matrix")
+async def get_cv_matrix(decoder_brand: Optional[str] = None, cvs: Optional[str] = None,
+                        threshold: float = CV_MATRIX_OUTLIER_SCORE):
+    """
+    Compare CVs across locomotives (by default CV2-CV6 and CV29), optionally only
+    those with a decoder brand. `cvs` is a comma-separated list of CV numbers.
+    Outliers are values whose modified z-score is above `threshold`.
+    """
+    cv_numbers = _parse_cv_list(cvs)
+    key = (decoder_brand, tuple(cv_numbers), threshold)
+    version = await get_collection_version("locomotives")
+    cached = _cv_matrix_cache.get(key)
+    if cached and cached[0] == version:
+        _cv_matrix_cache.move_to_end(key)
+        return cached[1]
+
+    query = {"decoder_brand": decoder_brand} if decoder_brand else {}
+    locomotives = await db.locomotives.find(
+        query, {"_id": 0, "id": 1, "brand": 1, "model": 1, "reference": 1, "cv_modifications": 1}
+    ).sort("id", 1).to_list(None)
+    result = await asyncio.to_thread(_build_cv_matrix, locomotives, cv_numbers, threshold)
+    result["decoder_brand"] = decoder_brand
+
+    _cv_matrix_cache[key] = (version, result)
+    _cv_matrix_cache.move_to_end(key)
+    while len(_cv_matrix_cache) > CV_MATRIX_CACHE_SIZE:
+        _cv_matrix_cache.popitem(last=False)
+    return result
+
+# ============== WISHLIST ENDPOINTS ==============
+
+@api_router.get("/wishlist", response_model=List[WishlistItem])
+async def get_wishlist():
+    items = await db.wishlist.find({}, {"_id": 0}).to_list(1000)
+    for item in items:
+        if isinstance(item.get('created_at'), str):
+            item['created_at'] = datetime.fromisoformat(item['created_at'])
+        if isinstance(item.get('updated_at'), str):
+            item['updated_at'] = datetime.fromisoformat(item['updated_at'])
+    return items
+
+@api_router.get("/wishlist/{item_id}", response_model=WishlistItem)
+async def get_wishlist_item(item_id: str):
+    item = await db.wishlist.find_one({"id": item_id}, {"_id": 0})
+    if not item:
+        raise HTTPException(status_code=404, detail="Item no encontrado")
+    if isinstance(item.get('created_at'), str):
+        item['created_at'] = datetime.fromisoformat(item['created_at'])
+    if isinstance(item.get('updated_at'), str):
+        item['updated_at'] = datetime.fromisoformat(item['updated_at'])
+    return item
+
+@api_router.post("/wishlist", response_model=WishlistItem)
+async def create_wishlist_item(item: WishlistItemCreate):
+    item_dict = item.model_dump()
+    item_obj = WishlistItem(**item_dict)
+    doc = item_obj.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    await db.wishlist.insert_one(doc)
+    await bump_collection_version("wishlist")
+    return item_obj
+
+@api_router.put("/wishlist/{item_id}", response_model=WishlistItem)
+async def update_wishlist_item(item_id: str, item: WishlistItemCreate):
+    existing = await db.wishlist.find_one({"id": item_id}, {"_id": 0})
+    if not existing:
+        raise HTTPException(status_code=404, detail="Item no encontrado")
+    
+    update_data = item.model_dump()
+    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['id'] = item_id
+    update_data['created_at'] = existing.get('created_at', datetime.now(timezone.utc).isoformat())
+    
+    await db.wishlist.update_one({"id": item_id}, {"$set": update_data})
+    await bump_collection_version("wishlist")
+    
+    updated = await db.wishlist.find_one({"id": item_id}, {"_id": 0})
+    if isinstance(updated.get('created_at'), str):
+        updated['created_at'] = datetime.fromisoformat(updated['created_at'])
+    if isinstance(updated.get('updated_at'), str):
+        updated['updated_at'] = datetime.fromisoformat(updated['updated_at'])
+    return updated
+
+@api_router.delete("/wishlist/{item_id}")
+async def delete_wishlist_item(item_id: str):
+    result = await db.wishlist.delete_one({"id": item_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Item no encontrado")
+    await bump_collection_version("wishlist")
+    return {"message": "Item eliminado"}
+
+@api_router.post("/wishlist/{item_id}/move-to-collection")
+async def move_wishlist_to_collection(item_id: str, purchase_date: Optional[str] = None, price: Optional[float] = None):
+    """Move a wishlist item to the collection (create locomotive or rolling stock)"""
+    item = await db.wishlist.find_one({"id": item_id}, {"_id": 0})
+    if not item:
+        raise HTTPException(status_code=404, detail="Item no encontrado")
+    
+    actual_price = price if price is not None else item.get('estimated_price')
+    actual_date = purchase_date or datetime.now(timezone.utc).strftime('%Y-%m-%d')
     
     if item.get('item_type') == 'locomotora':
         loco_data = {
@@ -948,6 +2309,7 @@ async def move_wishlist_to_collection(item_id: str, purchase_date: Optional[str]
         doc['created_at'] = doc['created_at'].isoformat()
         doc['updated_at'] = doc['updated_at'].isoformat()
         await db.locomotives.insert_one(doc)
+        await bump_collection_version("locomotives")
         created_id = loco_obj.id
         collection_type = 'locomotora'
     else:
@@ -966,11 +2328,13 @@ async def move_wishlist_to_collection(item_id: str, purchase_date: Optional[str]
         doc['created_at'] = doc['created_at'].isoformat()
         doc['updated_at'] = doc['updated_at'].isoformat()
         await db.rolling_stock.insert_one(doc)
+        await bump_collection_version("rolling_stock")
         created_id = stock_obj.id
         collection_type = 'material_rodante'
     
     # Delete from wishlist
     await db.wishlist.delete_one({"id": item_id})
+    await bump_collection_version("wishlist")
     
     return {
         "message": "Item movido a la colección",
@@ -979,137 +2343,238 @@ async def move_wishlist_to_collection(item_id: str, purchase_date: Optional[str]
     }
 
 # ============== PDF EXPORT ENDPOINTS ==============
-from fastapi.responses import StreamingResponse
-from io import BytesIO
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.units import mm, cm
+from pdf_reports import render_pdf
+
+# Building a PDF is CPU-bound, so reports render in a process pool: endpoints
+# fetch the data and hand it over. At most PDF_RENDER_WORKERS render at once
+# and PDF_RENDER_QUEUE_SIZE more may wait; further exports are refused so
+# they can't pile up and starve the rest of the API.
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', '2'))
+PDF_RENDER_QUEUE_SIZE = int(os.environ.get('PDF_RENDER_QUEUE_SIZE', '8'))
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+_pdf_render_slots = asyncio.Semaphore(PDF_RENDER_WORKERS)
+_pdf_renders_pending = 0  # rendering or waiting for a slot
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS)
+    return _pdf_executor
+
+def shutdown_pdf_executor(executor: Optional[ProcessPoolExecutor] = None):
+    """Shut down the pool; with `executor`, only if it is still the current one"""
+    global _pdf_executor
+    if executor is not None and executor is not _pdf_executor:
+        return
+    if _pdf_executor is not None:
+        _pdf_executor.shutdown(wait=False, cancel_futures=True)
+        _pdf_executor = None
+
+async def render_pdf_report(report: str, data: dict, path: Path) -> int:
+    """
+    Render a pdf_reports report in the pool, waiting for a free slot. The
+    worker writes the PDF to `path` and only its size comes back, so the
+    document is never copied into this process.
+    """
+    global _pdf_renders_pending
+    _check_pdf_render_queue()
+    _pdf_renders_pending += 1
+    try:
+        return await _render_in_pool(report, data, path)
+    finally:
+        _pdf_renders_pending -= 1
+
+def _check_pdf_render_queue():
+    if _pdf_renders_pending >= PDF_RENDER_WORKERS + PDF_RENDER_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=503,
+            detail="Demasiadas exportaciones PDF en curso, inténtalo de nuevo en unos segundos",
+            headers={"Retry-After": "5"}
+        )
+
+async def _render_in_pool(report: str, data: dict, path: Path) -> int:
+    """Render once a slot is free, without the queue limit of render_pdf_report"""
+    executor = None
+    try:
+        async with _pdf_render_slots:
+            executor = get_pdf_executor()
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, render_pdf, report, data, str(path))
+    except BrokenProcessPool:
+        # A worker died; drop that pool so the next export starts a fresh one
+        shutdown_pdf_executor(executor)
+        raise HTTPException(status_code=500, detail="Error al generar el PDF")
+
+# Rendered PDFs are cached on disk, keyed by report, normalized parameters and
+# the versions of the collections the report reads. Any write bumps a version,
+# so stale entries are never served and age out of the LRU instead.
+PDF_CACHE_DIR = Path(os.environ.get('PDF_CACHE_DIR', ROOT_DIR / 'pdf_cache'))
+PDF_CACHE_MAX_BYTES = int(float(os.environ.get('PDF_CACHE_MAX_MB', '200')) * 1024 * 1024)
+
+class _PDFCache:
+    """Size-bounded LRU of PDF files; the order survives restarts through file mtimes"""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self.total = 0
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.pdf"
+
+    def scan(self):
+        """Rebuild the index from the files left by a previous run"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for tmp in self.directory.glob('*.tmp'):
+            tmp.unlink(missing_ok=True)  # Interrupted writes
+        files = sorted((f.stat().st_mtime, f.stem, f.stat().st_size) for f in self.directory.glob('*.pdf'))
+        self.entries = OrderedDict((key, size) for _, key, size in files)
+        self.total = sum(self.entries.values())
+        self._evict()
+
+    def get(self, key: str) -> Optional[Path]:
+        if key not in self.entries:
+            return None
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.total -= self.entries.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return path
+
+    def temp_path(self, key: str) -> Path:
+        """Where a render writes the file before `add` moves it into place"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return self.directory / f"{key}.{uuid.uuid4().hex}.tmp"
+
+    def add(self, key: str, tmp: Path, size: int) -> Path:
+        path = self.path(key)
+        os.replace(tmp, path)
+        self.total += size - self.entries.pop(key, 0)
+        self.entries[key] = size
+        self._evict()
+        return path
+
+    def _evict(self):
+        # The newest entry is kept even if it alone is over the limit
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total -= size
+            self.path(key).unlink(missing_ok=True)
+
+pdf_cache = _PDFCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+_pdf_renders_in_flight: Dict[str, "asyncio.Task[Path]"] = {}
+
+# PDFs are sent from the file in chunks rather than read into memory whole
+PDF_STREAM_CHUNK_SIZE = 64 * 1024
+
+def _stream_pdf(path: Path, headers: dict) -> StreamingResponse:
+    # Opened now: the cache may evict (unlink) the file while it is being sent
+    pdf = open(path, 'rb')
+    size = os.fstat(pdf.fileno()).st_size
+
+    async def chunks():
+        try:
+            while chunk := await asyncio.to_thread(pdf.read, PDF_STREAM_CHUNK_SIZE):
+                yield chunk
+        finally:
+            pdf.close()
+
+    return StreamingResponse(chunks(), media_type="application/pdf",
+                             headers={**headers, "Content-Length": str(size)})
+
+def _sort_order(order: str) -> str:
+    return "asc" if order == "asc" else "desc"
+
+def _pdf_filter(value: Optional[str]) -> Optional[str]:
+    # 'all' and no value select the same thing, so they share a cache entry
+    return None if value in (None, '', 'all') else value
+
+def _pdf_cache_key(report: str, params: dict, versions: Dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(
+        {"report": report, "params": params, "versions": versions}, sort_keys=True
+    ).encode('utf-8')).hexdigest()
+
+async def cached_pdf_report(request: Request, report: str, params: dict, collections: List[str],
+                            load, filename: str, versions: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Serve a report from the PDF cache, or `await load()` its data, render it
+    and cache it. Identical concurrent requests share one render. Endpoints
+    that read the data before calling pass the `versions` they read first.
+    """
+    if versions is None:
+        versions = await get_collection_version_tags(collections)
+    key = _pdf_cache_key(report, params, versions)
+    headers = {
+        "ETag": f'"{key}"',
+        "Cache-Control": "no-cache",  # Revalidate: a write changes the ETag
+        "Content-Disposition": f"attachment; filename={filename}",
+    }
+    if f'"{key}"' in [tag.strip() for tag in request.headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    path, hit = await _cached_pdf_path(key, report, load)
+    return _stream_pdf(path, {**headers, "X-PDF-Cache": "hit" if hit else "miss"})
+
+async def _cached_pdf_path(key: str, report: str, load, render=render_pdf_report) -> Tuple[Path, bool]:
+    """The cached file for `key`, rendered with `render` on a miss; and whether it was a hit"""
+    path = pdf_cache.get(key)
+    if path is not None:
+        return path, True
+    task = _pdf_renders_in_flight.get(key)
+    if task is None:
+        # A task of its own, so the render still finishes and is cached if this client goes away
+        task = _pdf_renders_in_flight[key] = asyncio.create_task(_render_cached_pdf(key, report, load, render))
+        task.add_done_callback(lambda _: _pdf_renders_in_flight.pop(key, None))
+    return await asyncio.shield(task), False
+
+async def _render_cached_pdf(key: str, report: str, load, render) -> Path:
+    tmp = pdf_cache.temp_path(key)
+    try:
+        size = await render(report, await load(), tmp)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return pdf_cache.add(key, tmp, size)
+
+def _pdf_generated() -> str:
+    return datetime.now().strftime('%d/%m/%Y %H:%M')
 
 @api_router.get("/export/catalog/pdf")
 async def export_catalog_pdf(
+    request: Request,
     loco_sort_field: str = "brand",
     loco_sort_order: str = "asc",
     stock_sort_field: str = "brand",
     stock_sort_order: str = "asc"
 ):
     """Export complete catalog (locomotives and rolling stock) to PDF with custom sorting"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=1*cm, leftMargin=1*cm, topMargin=1*cm, bottomMargin=1*cm)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, spaceAfter=20, alignment=1)
-    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Heading2'], fontSize=14, spaceAfter=10)
-    
-    # Title
-    elements.append(Paragraph("Catálogo de Colección Ferroviaria", title_style))
-    elements.append(Paragraph(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
-    elements.append(Spacer(1, 20))
-    
-    # Locomotives section - with sorting
-    loco_sort_direction = 1 if loco_sort_order == "asc" else -1
-    locomotives = await db.locomotives.find({}, {"_id": 0}).sort(loco_sort_field, loco_sort_direction).to_list(1000)
-    if locomotives:
-        elements.append(Paragraph(f"Locomotoras ({len(locomotives)})", subtitle_style))
-        
-        # Table data
-        table_data = [['Marca', 'Modelo', 'Ref.', 'Tipo', 'DCC', 'Decoder', 'Precio']]
-        for loco in locomotives:
-            table_data.append([
-                (loco.get('brand') or '')[:15],
-                (loco.get('model') or '')[:20],
-                (loco.get('reference') or '')[:12],
-                (loco.get('locomotive_type') or '')[:10],
-                str(loco.get('dcc_address') or ''),
-                f"{loco.get('decoder_brand') or ''} {loco.get('decoder_model') or ''}"[:15],
-                f"{loco.get('price', 0) or 0:.2f}€"
-            ])
-        
-        table = Table(table_data, colWidths=[2.5*cm, 4*cm, 2.5*cm, 2*cm, 1.2*cm, 3*cm, 2*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
-        ]))
-        elements.append(table)
-        elements.append(Spacer(1, 20))
-    
-    # Rolling Stock section - with sorting
-    stock_sort_direction = 1 if stock_sort_order == "asc" else -1
-    rolling_stock = await db.rolling_stock.find({}, {"_id": 0}).sort(stock_sort_field, stock_sort_direction).to_list(1000)
-    if rolling_stock:
-        elements.append(Paragraph(f"Material Rodante ({len(rolling_stock)})", subtitle_style))
-        
-        table_data = [['Marca', 'Modelo', 'Referencia', 'Matrícula', 'Tipo', 'Era', 'Precio']]
-        for stock in rolling_stock:
-            table_data.append([
-                (stock.get('brand') or '')[:15],
-                (stock.get('model') or '')[:20],
-                (stock.get('reference') or '')[:12],
-                (stock.get('registration_number') or '')[:12],
-                (stock.get('stock_type') or '')[:12],
-                (stock.get('era') or '')[:8],
-                f"{stock.get('price', 0) or 0:.2f}€"
-            ])
-        
-        table = Table(table_data, colWidths=[2.5*cm, 4*cm, 2.5*cm, 2.5*cm, 2.5*cm, 1.5*cm, 2*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkgreen),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
-        ]))
-        elements.append(table)
-        elements.append(Spacer(1, 20))
-    
-    # Summary
-    total_locos = sum(loco.get('price', 0) or 0 for loco in locomotives)
-    total_stock = sum(s.get('price', 0) or 0 for s in rolling_stock)
-    
-    elements.append(Paragraph("Resumen", subtitle_style))
-    summary_data = [
-        ['Concepto', 'Cantidad', 'Valor'],
-        ['Locomotoras', str(len(locomotives)), f"{total_locos:.2f}€"],
-        ['Material Rodante', str(len(rolling_stock)), f"{total_stock:.2f}€"],
-        ['TOTAL', str(len(locomotives) + len(rolling_stock)), f"{total_locos + total_stock:.2f}€"],
-    ]
-    summary_table = Table(summary_data, colWidths=[6*cm, 3*cm, 3*cm])
-    summary_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightblue),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-    ]))
-    elements.append(summary_table)
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=catalogo_{datetime.now().strftime('%Y%m%d')}.pdf"}
-    )
+    params = {
+        "loco_sort_field": loco_sort_field,
+        "loco_sort_order": _sort_order(loco_sort_order),
+        "stock_sort_field": stock_sort_field,
+        "stock_sort_order": _sort_order(stock_sort_order),
+    }
+
+    async def load():
+        loco_sort_direction = 1 if loco_sort_order == "asc" else -1
+        locomotives = await db.locomotives.find({}, {"_id": 0, "cv_sheet": 0, "photo": 0}) \
+            .sort(loco_sort_field, loco_sort_direction).to_list(1000)
+        stock_sort_direction = 1 if stock_sort_order == "asc" else -1
+        rolling_stock = await db.rolling_stock.find({}, {"_id": 0, "photo": 0}) \
+            .sort(stock_sort_field, stock_sort_direction).to_list(1000)
+        return {"generated": _pdf_generated(), "locomotives": locomotives, "rolling_stock": rolling_stock}
+
+    return await cached_pdf_report(request, "catalog", params, ["locomotives", "rolling_stock"], load,
+                                   f"catalogo_{datetime.now().strftime('%Y%m%d')}.pdf")
 
 @api_router.get("/export/locomotives/pdf")
 async def export_locomotives_pdf(
+    request: Request,
     sort_field: str = "brand",
     sort_order: str = "asc",
     search: Optional[str] = None,
@@ -1118,98 +2583,61 @@ async def export_locomotives_pdf(
     dcc_type: Optional[str] = None  # "digital", "analogico", or None for all
 ):
     """Export only locomotives to PDF with custom sorting and filtering"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=1*cm, leftMargin=1*cm, topMargin=1*cm, bottomMargin=1*cm)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, spaceAfter=20, alignment=1)
-    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Heading2'], fontSize=14, spaceAfter=10)
-    
-    # Title
-    elements.append(Paragraph("Catálogo de Locomotoras", title_style))
-    elements.append(Paragraph(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
-    
-    # Build filter query
-    query = {}
-    filter_info = []
-    if search:
-        query["$or"] = [
-            {"brand": {"$regex": search, "$options": "i"}},
-            {"model": {"$regex": search, "$options": "i"}},
-            {"reference": {"$regex": search, "$options": "i"}},
-            {"railway_company": {"$regex": search, "$options": "i"}},
-            {"era": {"$regex": search, "$options": "i"}}
-        ]
-        filter_info.append(f"Búsqueda: {search}")
-    if brand and brand != 'all':
-        query["brand"] = brand
-        filter_info.append(f"Marca: {brand}")
-    if condition and condition != 'all':
-        query["condition"] = condition
-        filter_info.append(f"Estado: {condition}")
-    if dcc_type == "digital":
-        # Digital: dcc_address is a number (not "Analógico" or "analogico")
-        query["dcc_address"] = {"$not": {"$regex": "^[Aa]nal", "$options": "i"}}
-        filter_info.append("Tipo: Digital")
-    elif dcc_type == "analogico":
-        # Analog: dcc_address contains "Analógico" or "analogico"
-        query["dcc_address"] = {"$regex": "^[Aa]nal", "$options": "i"}
-        filter_info.append("Tipo: Analógico")
-    
-    if filter_info:
-        elements.append(Paragraph(f"Filtros: {', '.join(filter_info)}", styles['Normal']))
-    elements.append(Paragraph(f"Ordenado por: {sort_field} ({sort_order})", styles['Normal']))
-    elements.append(Spacer(1, 20))
-    
-    # Locomotives with sorting and filtering
-    sort_direction = 1 if sort_order == "asc" else -1
-    locomotives = await db.locomotives.find(query, {"_id": 0}).sort(sort_field, sort_direction).to_list(1000)
-    
-    if locomotives:
-        elements.append(Paragraph(f"Locomotoras ({len(locomotives)})", subtitle_style))
-        table_data = [['Marca', 'Modelo', 'Referencia', 'DCC', 'Tipo', 'Era', 'Precio']]
-        for loco in locomotives:
-            table_data.append([
-                (loco.get('brand') or '')[:15],
-                (loco.get('model') or '')[:20],
-                (loco.get('reference') or '')[:12],
-                str(loco.get('dcc_address') or '')[:8],
-                (loco.get('locomotive_type') or '')[:12],
-                (loco.get('era') or '')[:5],
-                f"{loco.get('price', 0) or 0:.2f}€"
-            ])
-        
-        table = Table(table_data, colWidths=[2.5*cm, 4*cm, 2.5*cm, 2*cm, 2.5*cm, 1.5*cm, 2*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
-        ]))
-        elements.append(table)
-        
-        # Summary
-        total_value = sum(loco.get('price', 0) or 0 for loco in locomotives)
-        elements.append(Spacer(1, 20))
-        elements.append(Paragraph(f"Total: {len(locomotives)} locomotoras - Valor: {total_value:.2f}€", styles['Normal']))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=locomotoras_{datetime.now().strftime('%Y%m%d')}.pdf"}
-    )
+    params = {
+        "sort_field": sort_field,
+        "sort_order": _sort_order(sort_order),
+        "search": search or None,
+        "brand": _pdf_filter(brand),
+        "condition": _pdf_filter(condition),
+        "dcc_type": dcc_type if dcc_type in ("digital", "analogico") else None,
+    }
+
+    async def load():
+        # Build filter query
+        query = {}
+        filter_info = []
+        if search:
+            query["$or"] = [
+                {"brand": {"$regex": search, "$options": "i"}},
+                {"model": {"$regex": search, "$options": "i"}},
+                {"reference": {"$regex": search, "$options": "i"}},
+                {"railway_company": {"$regex": search, "$options": "i"}},
+                {"era": {"$regex": search, "$options": "i"}}
+            ]
+            filter_info.append(f"Búsqueda: {search}")
+        if brand and brand != 'all':
+            query["brand"] = brand
+            filter_info.append(f"Marca: {brand}")
+        if condition and condition != 'all':
+            query["condition"] = condition
+            filter_info.append(f"Estado: {condition}")
+        if dcc_type == "digital":
+            # Digital: dcc_address is a number (not "Analógico" or "analogico")
+            query["dcc_address"] = {"$not": {"$regex": "^[Aa]nal", "$options": "i"}}
+            filter_info.append("Tipo: Digital")
+        elif dcc_type == "analogico":
+            # Analog: dcc_address contains "Analógico" or "analogico"
+            query["dcc_address"] = {"$regex": "^[Aa]nal", "$options": "i"}
+            filter_info.append("Tipo: Analógico")
+
+        # Locomotives with sorting and filtering
+        sort_direction = 1 if sort_order == "asc" else -1
+        locomotives = await db.locomotives.find(query, {"_id": 0, "cv_sheet": 0, "photo": 0}) \
+            .sort(sort_field, sort_direction).to_list(1000)
+        return {
+            "generated": _pdf_generated(),
+            "filter_info": filter_info,
+            "sort_field": sort_field,
+            "sort_order": sort_order,
+            "locomotives": locomotives,
+        }
+
+    return await cached_pdf_report(request, "locomotives", params, ["locomotives"], load,
+                                   f"locomotoras_{datetime.now().strftime('%Y%m%d')}.pdf")
 
 @api_router.get("/export/rolling-stock/pdf")
 async def export_rolling_stock_pdf(
+    request: Request,
     sort_field: str = "brand",
     sort_order: str = "asc",
     search: Optional[str] = None,
@@ -1217,334 +2645,255 @@ async def export_rolling_stock_pdf(
     condition: Optional[str] = None
 ):
     """Export only rolling stock to PDF with custom sorting and filtering"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=1*cm, leftMargin=1*cm, topMargin=1*cm, bottomMargin=1*cm)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, spaceAfter=20, alignment=1)
-    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Heading2'], fontSize=14, spaceAfter=10)
-    
-    # Title
-    elements.append(Paragraph("Catálogo de Vagones y Coches", title_style))
-    elements.append(Paragraph(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
-    
-    # Build filter query
-    query = {}
-    filter_info = []
-    if search:
-        query["$or"] = [
-            {"brand": {"$regex": search, "$options": "i"}},
-            {"model": {"$regex": search, "$options": "i"}},
-            {"reference": {"$regex": search, "$options": "i"}},
-            {"registration_number": {"$regex": search, "$options": "i"}},
-            {"railway_company": {"$regex": search, "$options": "i"}},
-            {"era": {"$regex": search, "$options": "i"}}
-        ]
-        filter_info.append(f"Búsqueda: {search}")
-    if stock_type and stock_type != 'all':
-        query["stock_type"] = stock_type
-        filter_info.append(f"Tipo: {stock_type}")
-    if condition and condition != 'all':
-        query["condition"] = condition
-        filter_info.append(f"Estado: {condition}")
-    
-    if filter_info:
-        elements.append(Paragraph(f"Filtros: {', '.join(filter_info)}", styles['Normal']))
-    elements.append(Paragraph(f"Ordenado por: {sort_field} ({sort_order})", styles['Normal']))
-    elements.append(Spacer(1, 20))
-    
-    # Rolling stock with sorting and filtering
-    sort_direction = 1 if sort_order == "asc" else -1
-    rolling_stock = await db.rolling_stock.find(query, {"_id": 0}).sort(sort_field, sort_direction).to_list(1000)
-    
-    if rolling_stock:
-        elements.append(Paragraph(f"Vagones y Coches ({len(rolling_stock)})", subtitle_style))
-        table_data = [['Marca', 'Modelo', 'Referencia', 'Matrícula', 'Tipo', 'Era', 'Precio']]
-        for stock in rolling_stock:
-            table_data.append([
-                (stock.get('brand') or '')[:15],
-                (stock.get('model') or '')[:18],
-                (stock.get('reference') or '')[:12],
-                (stock.get('registration_number') or '')[:12],
-                (stock.get('stock_type') or '')[:12],
-                (stock.get('era') or '')[:5],
-                f"{stock.get('price', 0) or 0:.2f}€"
-            ])
-        
-        table = Table(table_data, colWidths=[2.5*cm, 3.5*cm, 2.5*cm, 2.5*cm, 2.5*cm, 1.5*cm, 2*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkgreen),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
-        ]))
-        elements.append(table)
-        
-        # Summary
-        total_value = sum(stock.get('price', 0) or 0 for stock in rolling_stock)
-        elements.append(Spacer(1, 20))
-        elements.append(Paragraph(f"Total: {len(rolling_stock)} unidades - Valor: {total_value:.2f}€", styles['Normal']))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=vagones_{datetime.now().strftime('%Y%m%d')}.pdf"}
-    )
+    params = {
+        "sort_field": sort_field,
+        "sort_order": _sort_order(sort_order),
+        "search": search or None,
+        "stock_type": _pdf_filter(stock_type),
+        "condition": _pdf_filter(condition),
+    }
+
+    async def load():
+        # Build filter query
+        query = {}
+        filter_info = []
+        if search:
+            query["$or"] = [
+                {"brand": {"$regex": search, "$options": "i"}},
+                {"model": {"$regex": search, "$options": "i"}},
+                {"reference": {"$regex": search, "$options": "i"}},
+                {"registration_number": {"$regex": search, "$options": "i"}},
+                {"railway_company": {"$regex": search, "$options": "i"}},
+                {"era": {"$regex": search, "$options": "i"}}
+            ]
+            filter_info.append(f"Búsqueda: {search}")
+        if stock_type and stock_type != 'all':
+            query["stock_type"] = stock_type
+            filter_info.append(f"Tipo: {stock_type}")
+        if condition and condition != 'all':
+            query["condition"] = condition
+            filter_info.append(f"Estado: {condition}")
+
+        # Rolling stock with sorting and filtering
+        sort_direction = 1 if sort_order == "asc" else -1
+        rolling_stock = await db.rolling_stock.find(query, {"_id": 0, "photo": 0}) \
+            .sort(sort_field, sort_direction).to_list(1000)
+        return {
+            "generated": _pdf_generated(),
+            "filter_info": filter_info,
+            "sort_field": sort_field,
+            "sort_order": sort_order,
+            "rolling_stock": rolling_stock,
+        }
+
+    return await cached_pdf_report(request, "rolling_stock", params, ["rolling_stock"], load,
+                                   f"vagones_{datetime.now().strftime('%Y%m%d')}.pdf")
 
 @api_router.get("/export/compositions/pdf")
-async def export_compositions_pdf():
+async def export_compositions_pdf(request: Request):
     """Export all compositions to PDF"""
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=1*cm, leftMargin=1*cm, topMargin=1*cm, bottomMargin=1*cm)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, spaceAfter=20, alignment=1)
-    subtitle_style = ParagraphStyle('Subtitle', parent=styles['Heading2'], fontSize=14, spaceAfter=10)
-    comp_style = ParagraphStyle('CompTitle', parent=styles['Heading3'], fontSize=12, spaceBefore=15, spaceAfter=5, textColor=colors.darkblue)
-    
-    # Title
-    elements.append(Paragraph("Catálogo de Composiciones", title_style))
-    elements.append(Paragraph(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
-    elements.append(Spacer(1, 20))
-    
-    # Get all compositions
-    compositions = await db.compositions.find({}, {"_id": 0}).to_list(100)
-    
-    if compositions:
-        elements.append(Paragraph(f"Composiciones ({len(compositions)})", subtitle_style))
-        
+    async def load():
+        compositions = await db.compositions.find({}, {"_id": 0}).to_list(100)
+
+        # Resolve every locomotive and wagon in two queries instead of one per reference
+        loco_ids = {comp['locomotive_id'] for comp in compositions if comp.get('locomotive_id')}
+        wagon_ids = {wagon['wagon_id'] for comp in compositions for wagon in comp.get('wagons') or []}
+        locomotives = {
+            loco['id']: loco async for loco in db.locomotives.find(
+                {"id": {"$in": list(loco_ids)}}, {"_id": 0, "id": 1, "brand": 1, "model": 1})
+        }
+        wagons = {
+            stock['id']: stock async for stock in db.rolling_stock.find(
+                {"id": {"$in": list(wagon_ids)}}, {"_id": 0, "id": 1, "brand": 1, "model": 1, "reference": 1})
+        }
+
+        entries = []
         for comp in compositions:
-            # Composition header
-            elements.append(Paragraph(f"{comp.get('name', 'Sin nombre')}", comp_style))
-            
-            # Info
-            info_data = [
-                ['Tipo de Servicio', comp.get('service_type', '-')],
-                ['Época', comp.get('era', '-')],
-            ]
-            
-            # Get locomotive info
-            loco_id = comp.get('locomotive')
-            if loco_id:
-                loco = await db.locomotives.find_one({"id": loco_id}, {"_id": 0})
-                if loco:
-                    info_data.append(['Locomotora', f"{loco.get('brand', '')} {loco.get('model', '')}"])
-            
-            # Rolling stock count
-            rolling_stock_ids = comp.get('rolling_stock', [])
-            info_data.append(['Vagones/Coches', str(len(rolling_stock_ids))])
-            
-            info_table = Table(info_data, colWidths=[4*cm, 10*cm])
-            info_table.setStyle(TableStyle([
-                ('FONTSIZE', (0, 0), (-1, -1), 9),
-                ('TEXTCOLOR', (0, 0), (0, -1), colors.grey),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 3),
-            ]))
-            elements.append(info_table)
-            
-            # List rolling stock
-            if rolling_stock_ids:
-                stock_items = []
-                for stock_id in rolling_stock_ids:
-                    stock = await db.rolling_stock.find_one({"id": stock_id}, {"_id": 0})
-                    if stock:
-                        stock_items.append(f"• {stock.get('brand', '')} {stock.get('model', '')} ({stock.get('reference', '')})")
-                if stock_items:
-                    elements.append(Paragraph("Material rodante:", styles['Normal']))
-                    for item in stock_items:
-                        elements.append(Paragraph(item, styles['Normal']))
-            
-            elements.append(Spacer(1, 10))
-        
-        # Summary
-        elements.append(Spacer(1, 10))
-        elements.append(Paragraph(f"Total: {len(compositions)} composiciones", styles['Normal']))
-    else:
-        elements.append(Paragraph("No hay composiciones registradas", styles['Normal']))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=composiciones_{datetime.now().strftime('%Y%m%d')}.pdf"}
-    )
+            loco = locomotives.get(comp.get('locomotive_id'))
+            comp_wagons = sorted(comp.get('wagons') or [], key=lambda w: w.get('position', 0))
+            entries.append({
+                "name": comp.get('name', 'Sin nombre'),
+                "service_type": comp.get('service_type'),
+                "era": comp.get('era'),
+                "locomotive_label": f"{loco.get('brand', '')} {loco.get('model', '')}" if loco else None,
+                "wagon_count": len(comp_wagons),
+                "wagon_labels": [
+                    f"{stock.get('brand', '')} {stock.get('model', '')} ({stock.get('reference', '')})"
+                    for stock in (wagons.get(w['wagon_id']) for w in comp_wagons) if stock
+                ],
+            })
+        return {"generated": _pdf_generated(), "compositions": entries}
+
+    return await cached_pdf_report(request, "compositions", {}, ["compositions", "locomotives", "rolling_stock"],
+                                   load, f"composiciones_{datetime.now().strftime('%Y%m%d')}.pdf")
 
 @api_router.get("/export/locomotive/{locomotive_id}/pdf")
-async def export_locomotive_pdf(locomotive_id: str):
+async def export_locomotive_pdf(request: Request, locomotive_id: str):
     """Export individual locomotive data sheet to PDF"""
-    loco = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0})
+    loco = await db.locomotives.find_one({"id": locomotive_id}, {"_id": 0, "reference": 1})
     if not loco:
         raise HTTPException(status_code=404, detail="Locomotora no encontrada")
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, spaceAfter=10, alignment=1)
-    section_style = ParagraphStyle('Section', parent=styles['Heading2'], fontSize=12, spaceBefore=15, spaceAfter=8, textColor=colors.darkblue)
-    
-    # Title
-    elements.append(Paragraph(f"Ficha de Locomotora", title_style))
-    elements.append(Paragraph(f"{loco.get('brand', '')} - {loco.get('model', '')}", title_style))
-    elements.append(Spacer(1, 15))
-    
-    # Basic Info
-    elements.append(Paragraph("Información General", section_style))
-    info_data = [
-        ['Marca:', loco.get('brand', '-'), 'Modelo:', loco.get('model', '-')],
-        ['Referencia:', loco.get('reference', '-'), 'Tipo:', loco.get('locomotive_type', '-')],
-        ['Matrícula:', loco.get('registration_number', '-'), 'Era:', loco.get('era', '-')],
-        ['Compañía:', loco.get('railway_company', '-'), 'Estado:', loco.get('condition', '-')],
-        ['Fecha Compra:', loco.get('purchase_date', '-'), 'Precio:', f"{loco.get('price', 0) or 0:.2f}€"],
-    ]
-    info_table = Table(info_data, colWidths=[3*cm, 5*cm, 3*cm, 5*cm])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(info_table)
-    
-    # DCC Section
-    elements.append(Paragraph("Configuración Digital (DCC)", section_style))
-    dcc_data = [
-        ['Dirección DCC:', str(loco.get('dcc_address', 3))],
-        ['Decoder:', f"{loco.get('decoder_brand', '-')} {loco.get('decoder_model', '-')}"],
-        ['Proyecto Sonido:', loco.get('sound_project', '-')],
-    ]
-    dcc_table = Table(dcc_data, colWidths=[4*cm, 12*cm])
-    dcc_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-    ]))
-    elements.append(dcc_table)
-    
-    # Functions
-    functions = loco.get('functions', [])
-    if functions:
-        elements.append(Paragraph("Funciones Programadas", section_style))
-        func_data = [['Función', 'Descripción', 'Sonido']]
-        for func in functions:
-            func_data.append([
-                func.get('function_number', ''),
-                func.get('description', ''),
-                'Sí' if func.get('is_sound') else 'No'
-            ])
-        func_table = Table(func_data, colWidths=[2.5*cm, 10*cm, 2*cm])
-        func_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ALIGN', (2, 0), (2, -1), 'CENTER'),
-        ]))
-        elements.append(func_table)
-    
-    # CV Modifications
-    cvs = loco.get('cv_modifications', [])
-    if cvs:
-        elements.append(Paragraph("CVs Modificados", section_style))
-        cv_data = [['CV', 'Valor', 'Descripción']]
-        for cv in cvs:
-            cv_data.append([
-                str(cv.get('cv_number', '')),
-                str(cv.get('value', '')),
-                cv.get('description', '')
-            ])
-        cv_table = Table(cv_data, colWidths=[2*cm, 2*cm, 10*cm])
-        cv_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('ALIGN', (0, 0), (1, -1), 'CENTER'),
-        ]))
-        elements.append(cv_table)
-    
-    # Notes
-    if loco.get('notes'):
-        elements.append(Paragraph("Notas", section_style))
-        elements.append(Paragraph(loco.get('notes', ''), styles['Normal']))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
+
+    async def load():
+        # Read after the cache key's collection version, never before
+        return {"locomotive": await db.locomotives.find_one(
+            {"id": locomotive_id}, {"_id": 0, "cv_sheet": 0, "photo": 0}) or {}}
+
     filename = f"locomotora_{loco.get('reference', 'sin_ref')}_{datetime.now().strftime('%Y%m%d')}.pdf"
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return await cached_pdf_report(request, "locomotive_sheet", {"id": locomotive_id}, ["locomotives"],
+                                   load, filename)
 
 @api_router.get("/export/rolling-stock/{stock_id}/pdf")
-async def export_rolling_stock_pdf(stock_id: str):
+async def export_rolling_stock_item_pdf(request: Request, stock_id: str):
     """Export individual rolling stock data sheet to PDF"""
-    stock = await db.rolling_stock.find_one({"id": stock_id}, {"_id": 0})
+    stock = await db.rolling_stock.find_one({"id": stock_id}, {"_id": 0, "reference": 1})
     if not stock:
         raise HTTPException(status_code=404, detail="Material rodante no encontrado")
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm, topMargin=2*cm, bottomMargin=2*cm)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, spaceAfter=10, alignment=1)
-    section_style = ParagraphStyle('Section', parent=styles['Heading2'], fontSize=12, spaceBefore=15, spaceAfter=8, textColor=colors.darkgreen)
-    
-    # Title
-    elements.append(Paragraph(f"Ficha de Material Rodante", title_style))
-    elements.append(Paragraph(f"{stock.get('brand', '')} - {stock.get('model', '')}", title_style))
-    elements.append(Spacer(1, 15))
-    
-    # Basic Info
-    elements.append(Paragraph("Información General", section_style))
-    info_data = [
-        ['Marca:', stock.get('brand', '-'), 'Modelo:', stock.get('model', '-')],
-        ['Referencia:', stock.get('reference', '-'), 'Tipo:', stock.get('stock_type', '-')],
-        ['Era:', stock.get('era', '-'), 'Compañía:', stock.get('railway_company', '-')],
-        ['Estado:', stock.get('condition', '-'), 'Fecha Compra:', stock.get('purchase_date', '-')],
-        ['Precio:', f"{stock.get('price', 0) or 0:.2f}€", '', ''],
-    ]
-    info_table = Table(info_data, colWidths=[3*cm, 5*cm, 3*cm, 5*cm])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(info_table)
-    
-    # Notes
-    if stock.get('notes'):
-        elements.append(Paragraph("Notas", section_style))
-        elements.append(Paragraph(stock.get('notes', ''), styles['Normal']))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
+
+    async def load():
+        # Read after the cache key's collection version, never before
+        return {"rolling_stock": await db.rolling_stock.find_one({"id": stock_id}, {"_id": 0, "photo": 0}) or {}}
+
     filename = f"material_{stock.get('reference', 'sin_ref')}_{datetime.now().strftime('%Y%m%d')}.pdf"
-    return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return await cached_pdf_report(request, "rolling_stock_sheet", {"id": stock_id}, ["rolling_stock"],
+                                   load, filename)
+
+# Bulk data sheets: one merged PDF, or a ZIP with one PDF per item whose
+# members are sent as their renders finish. ZIP members are the cache entries
+# of the per-item endpoints, so sheets already downloaded are not rendered again.
+SHEETS_EXPORT_MAX_ITEMS = int(os.environ.get('SHEETS_EXPORT_MAX_ITEMS', '500'))
+
+_SHEET_KINDS = {
+    "locomotives": {
+        "collection": "locomotives",
+        "projection": {"_id": 0, "cv_sheet": 0, "photo": 0},
+        "report": "locomotive_sheet",
+        "field": "locomotive",
+        "file_prefix": "locomotora",
+        "not_found": "Locomotoras no encontradas",
+    },
+    "rolling-stock": {
+        "collection": "rolling_stock",
+        "projection": {"_id": 0, "photo": 0},
+        "report": "rolling_stock_sheet",
+        "field": "rolling_stock",
+        "file_prefix": "material",
+        "not_found": "Material rodante no encontrado",
+    },
+}
+
+class SheetsExportRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    locomotive_ids: List[str] = []
+    rolling_stock_ids: List[str] = []
+    # Instead of ids: the filters of GET /export/{kind}/csv, applied to each of `kinds`
+    filter: Optional[Dict[str, Optional[str]]] = None
+    kinds: List[str] = list(_SHEET_KINDS)
+    format: str = "pdf"  # "pdf" (merged) or "zip"
+
+async def _load_sheet_items(body: SheetsExportRequest) -> Dict[str, List[dict]]:
+    """The documents per kind: one $in query per collection, in the order of the ids"""
+    ids = {"locomotives": body.locomotive_ids, "rolling-stock": body.rolling_stock_ids}
+    items = {}
+    for kind, spec in _SHEET_KINDS.items():
+        collection = db[spec['collection']]
+        if body.filter is not None:
+            if kind not in body.kinds:
+                items[kind] = []
+                continue
+            items[kind] = await collection.find(_export_query(kind, body.filter), spec['projection']) \
+                .sort([("brand", 1), ("model", 1), ("reference", 1)]).to_list(SHEETS_EXPORT_MAX_ITEMS + 1)
+            continue
+
+        wanted = list(dict.fromkeys(ids[kind]))
+        found = {}
+        if wanted:
+            async for doc in collection.find({"id": {"$in": wanted}}, spec['projection']):
+                found[doc['id']] = doc
+        missing = [item_id for item_id in wanted if item_id not in found]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"{spec['not_found']}: {', '.join(missing)}")
+        items[kind] = [found[item_id] for item_id in wanted]
+    return items
+
+async def _sheet_members(items: Dict[str, List[dict]], versions: Dict[str, str]):
+    """(file name, PDF) per item in the order they finish, PDF_RENDER_WORKERS rendering at a time"""
+    pending = iter([(spec, doc) for kind, spec in _SHEET_KINDS.items() for doc in items[kind]])
+    used_names = set()
+
+    async def sheet(spec: dict, doc: dict):
+        # Same key as the per-item endpoint for this document
+        collection = spec['collection']
+        key = _pdf_cache_key(spec['report'], {"id": doc['id']}, {collection: versions[collection]})
+
+        async def load():
+            return {spec['field']: doc}
+
+        path, _ = await _cached_pdf_path(key, spec['report'], load, render=_render_in_pool)
+        with open(path, 'rb') as pdf:
+            content = await asyncio.to_thread(pdf.read)
+        return spec, doc, content
+
+    running = set()
+    try:
+        while True:
+            for spec, doc in itertools.islice(pending, PDF_RENDER_WORKERS - len(running)):
+                running.add(asyncio.create_task(sheet(spec, doc)))
+            if not running:
+                break
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                spec, doc, content = task.result()
+                stem = _jmri_file_stem(f"{spec['file_prefix']}_{doc.get('reference') or 'sin_ref'}")
+                yield _unique_name(stem, used_names, "{}.pdf"), content
+    finally:
+        for task in running:
+            task.cancel()
+
+@api_router.post("/export/sheets")
+async def export_sheets(request: Request, body: SheetsExportRequest):
+    """
+    Data sheets for many locomotives and rolling stock items at once, chosen by
+    id or by filter: one merged PDF, or with format "zip" one PDF per item.
+    """
+    if body.format not in ("pdf", "zip"):
+        raise HTTPException(status_code=400, detail=f"Formato no soportado: {body.format}")
+    has_ids = bool(body.locomotive_ids or body.rolling_stock_ids)
+    if has_ids == (body.filter is not None):
+        raise HTTPException(status_code=400, detail="Indica los ids o un filtro, no ambos")
+    unknown = [kind for kind in body.kinds if kind not in _SHEET_KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Tipos no válidos: {', '.join(unknown)}")
+    if body.format == "zip":
+        # Refuse up front: once the ZIP is streaming, an error can't be reported
+        _check_pdf_render_queue()
+
+    collections = [spec['collection'] for spec in _SHEET_KINDS.values()]
+    # Read after the cache keys' collection versions, never before
+    versions = await get_collection_version_tags(collections)
+    items = await _load_sheet_items(body)
+    count = sum(len(docs) for docs in items.values())
+    if count == 0:
+        raise HTTPException(status_code=404, detail="Ningún elemento coincide con el filtro")
+    if count > SHEETS_EXPORT_MAX_ITEMS:
+        raise HTTPException(status_code=400,
+                            detail=f"Demasiadas fichas: el máximo por exportación es {SHEETS_EXPORT_MAX_ITEMS}")
+
+    date = datetime.now().strftime('%Y%m%d')
+    if body.format == "zip":
+        return StreamingResponse(
+            stream_zip(_sheet_members(items, versions)),
+            media_type="application/zip",
+            headers={"Content-Disposition": f"attachment; filename=fichas_{date}.zip"}
+        )
+
+    async def load():
+        return {"locomotives": items["locomotives"], "rolling_stock": items["rolling-stock"]}
+
+    params = {kind: [doc['id'] for doc in docs] for kind, docs in items.items()}
+    return await cached_pdf_report(request, "sheets", params, collections, load, f"fichas_{date}.pdf",
+                                   versions=versions)
 
 # ============== COMPOSITION ENDPOINTS ==============
 
@@ -1596,7 +2945,7 @@ async def get_composition(composition_id: str):
     # Fetch locomotive details if exists
     locomotive = None
     if comp.get('locomotive_id'):
-        locomotive = await db.locomotives.find_one({"id": comp['locomotive_id']}, {"_id": 0})
+        locomotive = await db.locomotives.find_one({"id": comp['locomotive_id']}, {"_id": 0, "cv_sheet": 0})
     
     # Fetch wagon details in order
     wagons_details = []
@@ -1620,6 +2969,7 @@ async def create_composition(composition: CompositionCreate):
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     await db.compositions.insert_one(doc)
+    await bump_collection_version("compositions")
     return comp_obj
 
 @api_router.put("/compositions/{composition_id}", response_model=Composition)
@@ -1634,6 +2984,7 @@ async def update_composition(composition_id: str, composition: CompositionCreate
     update_data['created_at'] = existing.get('created_at', datetime.now(timezone.utc).isoformat())
     
     await db.compositions.update_one({"id": composition_id}, {"$set": update_data})
+    await bump_collection_version("compositions")
     
     updated = await db.compositions.find_one({"id": composition_id}, {"_id": 0})
     if isinstance(updated.get('created_at'), str):
@@ -1647,6 +2998,7 @@ async def delete_composition(composition_id: str):
     result = await db.compositions.delete_one({"id": composition_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Composición no encontrada")
+    await bump_collection_version("compositions")
     return {"message": "Composición eliminada"}
 
 @api_router.post("/compositions/{composition_id}/duplicate")
@@ -1670,6 +3022,7 @@ async def duplicate_composition(composition_id: str):
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
     await db.compositions.insert_one(doc)
+    await bump_collection_version("compositions")
     
     return {
         "message": "Composición duplicada",
@@ -1681,163 +3034,458 @@ async def duplicate_composition(composition_id: str):
 # ============== CSV IMPORT ENDPOINTS ==============
 import csv
 from io import StringIO
-from fastapi import Body
+from fastapi import Body, Query
+from pydantic import TypeAdapter, ValidationError
+
+# Rows are validated and inserted in chunks of this size
+CSV_IMPORT_CHUNK_SIZE = int(os.environ.get('CSV_IMPORT_CHUNK_SIZE', '1000'))
+
+def _csv_value(row: dict, field: str, default=None):
+    return (row.get(field) or '').strip() or default
+
+def _csv_price(row: dict) -> Optional[float]:
+    price = _csv_value(row, 'price')
+    if price and ',' in price and '.' not in price:
+        price = price.replace(',', '.')  # Spanish Excel: 199,90
+    return float(price) if price else None
+
+def _locomotive_csv_data(row: dict) -> dict:
+    return {
+        'brand': _csv_value(row, 'brand', ''),
+        'model': _csv_value(row, 'model', ''),
+        'reference': _csv_value(row, 'reference', ''),
+        'locomotive_type': _csv_value(row, 'locomotive_type', 'diesel'),
+        'dcc_address': _csv_value(row, 'dcc_address', '3'),  # Keep as string
+        'decoder_brand': _csv_value(row, 'decoder_brand'),
+        'decoder_model': _csv_value(row, 'decoder_model'),
+        'condition': _csv_value(row, 'condition', 'nuevo'),
+        'era': _csv_value(row, 'era'),
+        'railway_company': _csv_value(row, 'railway_company'),
+        'purchase_date': _csv_value(row, 'purchase_date'),
+        'price': _csv_price(row),
+        'registration_number': _csv_value(row, 'registration_number'),
+        'notes': _csv_value(row, 'notes'),
+        'functions': [],
+        'cv_modifications': []
+    }
+
+def _rolling_stock_csv_data(row: dict) -> dict:
+    return {
+        'brand': _csv_value(row, 'brand', ''),
+        'model': _csv_value(row, 'model', ''),
+        'reference': _csv_value(row, 'reference', ''),
+        'stock_type': _csv_value(row, 'stock_type', 'vagon_mercancias'),
+        'condition': _csv_value(row, 'condition', 'nuevo'),
+        'era': _csv_value(row, 'era'),
+        'railway_company': _csv_value(row, 'railway_company'),
+        'purchase_date': _csv_value(row, 'purchase_date'),
+        'price': _csv_price(row),
+        'registration_number': _csv_value(row, 'registration_number'),
+        'notes': _csv_value(row, 'notes'),
+    }
+
+CSV_IMPORT_KINDS = {
+    "locomotives": {
+        "collection": "locomotives",
+        "adapter": TypeAdapter(List[Locomotive]),
+        "required": ['brand', 'model', 'reference', 'dcc_address'],
+        "build": _locomotive_csv_data,
+        # Template header, also the layout of GET /export/locomotives/csv
+        "columns": ['brand', 'model', 'reference', 'locomotive_type', 'dcc_address', 'decoder_brand',
+                    'decoder_model', 'condition', 'era', 'railway_company', 'purchase_date', 'price',
+                    'registration_number', 'notes'],
+    },
+    "rolling-stock": {
+        "collection": "rolling_stock",
+        "adapter": TypeAdapter(List[RollingStock]),
+        "required": ['brand', 'model', 'reference'],
+        "build": _rolling_stock_csv_data,
+        "columns": ['brand', 'model', 'reference', 'stock_type', 'condition', 'era', 'railway_company',
+                    'purchase_date', 'price', 'registration_number', 'notes'],
+    },
+}
+
+# mode=upsert matches existing documents on one of these keys
+CSV_UPSERT_KEYS = {
+    "brand_reference": ['brand', 'reference'],
+    "registration_number": ['registration_number'],
+}
+# Filled in by the app, never by a CSV row, so upserts leave them alone
+CSV_INSERT_ONLY_FIELDS = {'functions', 'cv_modifications'}
+
+def _check_csv_import_mode(mode: str, key: str) -> Optional[str]:
+    """Validate mode/key query parameters; returns the upsert key to use"""
+    if mode not in ("insert", "upsert"):
+        raise HTTPException(status_code=400, detail=f"Modo de importación no válido: {mode}")
+    if mode == "insert":
+        return None
+    if key not in CSV_UPSERT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Clave de importación no válida: {key}")
+    return key
+
+def _validation_messages(error: ValidationError) -> Dict[int, str]:
+    """Group the errors of a list validation by list index"""
+    messages: Dict[int, List[str]] = {}
+    for item in error.errors():
+        index, *field = item['loc']
+        messages.setdefault(index, []).append(f"{'.'.join(str(f) for f in field)}: {item['msg']}")
+    return {index: '; '.join(parts) for index, parts in messages.items()}
+
+class _CSVImporter:
+    """
+    Validate CSV rows with a TypeAdapter over the whole chunk and write each
+    chunk with one unordered insert_many. Rows that fail are reported by row
+    number and the rest of the chunk is still written.
+
+    With an upsert key, rows matching an existing document on that key update
+    it with their non-empty cells (one bulk_write per chunk), and rows whose
+    cells hash the same as the stored values are not written at all.
+    """
+
+    def __init__(self, kind: str, upsert_key: Optional[str] = None):
+        self.spec = CSV_IMPORT_KINDS[kind]
+        self.key_fields = CSV_UPSERT_KEYS[upsert_key] if upsert_key else None
+        self.pending = []  # (row number, data, fields with a value in the row)
+        self.imported = []
+        self.counts = {"created": 0, "updated": 0, "unchanged": 0}
+        self.skipped = 0
+        self.errors = []  # (row number, message)
+
+    def skip(self, row_number: int, message: str):
+        self.skipped += 1
+        self.errors.append((row_number, message))
+
+    async def add(self, row_number: int, row: dict):
+        required = self.spec['required'] + [f for f in self.key_fields or [] if f not in self.spec['required']]
+        missing = [f for f in required if not _csv_value(row, f)]
+        if missing:
+            self.skip(row_number, f"Campos requeridos vacíos: {', '.join(missing)}")
+            return
+        try:
+            data = self.spec['build'](row)
+        except ValueError as ve:
+            self.skip(row_number, f"Error de valor - {str(ve)}")
+            return
+        present = [f for f in data if f not in CSV_INSERT_ONLY_FIELDS and _csv_value(row, f)]
+        self.pending.append((row_number, data, present))
+        if len(self.pending) >= CSV_IMPORT_CHUNK_SIZE:
+            await self.flush()
+
+    def _validate(self, chunk: List[tuple]) -> tuple:
+        """Validate a chunk; returns (valid (row number, doc, present) tuples, {row number: error})"""
+        adapter = self.spec['adapter']
+        try:
+            objs = adapter.validate_python([data for _, data, _ in chunk])
+            failed = {}
+        except ValidationError as e:
+            messages = _validation_messages(e)
+            failed = {chunk[index][0]: message for index, message in messages.items()}
+            chunk = [item for index, item in enumerate(chunk) if index not in messages]
+            objs = adapter.validate_python([data for _, data, _ in chunk])
+
+        valid = []
+        for (row_number, _, present), obj in zip(chunk, objs):
+            doc = obj.model_dump()
+            doc['created_at'] = doc['created_at'].isoformat()
+            doc['updated_at'] = doc['updated_at'].isoformat()
+            valid.append((row_number, doc, present))
+        return valid, failed
+
+    def _imported(self, doc: dict, action: str):
+        self.counts[action] += 1
+        self.imported.append({'brand': doc['brand'], 'model': doc['model'], 'reference': doc['reference']})
+
+    async def _write(self, rows: List[tuple], ops: list, actions: List[str]):
+        """bulk_write ops (one per row) and record each row as imported or failed"""
+        write_errors = {}
+        if ops:
+            try:
+                await db[self.spec['collection']].bulk_write(ops, ordered=False)
+            except BulkWriteError as bwe:
+                write_errors = {error['index']: error.get('errmsg', 'Error de escritura')
+                                for error in bwe.details.get('writeErrors', [])}
+        for index, ((row_number, doc, _), action) in enumerate(zip(rows, actions)):
+            if index in write_errors:
+                self.skip(row_number, write_errors[index])
+            else:
+                self._imported(doc, action)
+
+    async def _upsert(self, valid: List[tuple]):
+        key_of = lambda doc: tuple(doc[f] for f in self.key_fields)
+        # A key repeated in the chunk: the last row wins, like a second import would
+        last_row = {}
+        for row_number, doc, _ in valid:
+            previous = last_row.get(key_of(doc))
+            if previous is not None:
+                self.skip(previous, f"Clave repetida más abajo en el archivo (fila {row_number})")
+            last_row[key_of(doc)] = row_number
+        valid = [item for item in valid if last_row[key_of(item[1])] == item[0]]
+
+        projection = {"_id": 0, "id": 1}
+        projection.update({f: 1 for _, _, present in valid for f in present})
+        projection.update({f: 1 for f in self.key_fields})
+        existing = {}
+        query = {"$or": [{f: doc[f] for f in self.key_fields} for _, doc, _ in valid]}
+        async for stored in db[self.spec['collection']].find(query, projection):
+            existing.setdefault(tuple(stored.get(f) for f in self.key_fields), stored)
+
+        now = datetime.now(timezone.utc).isoformat()
+        rows, ops, actions = [], [], []
+        for row_number, doc, present in valid:
+            stored = existing.get(key_of(doc))
+            if stored is None:
+                rows.append((row_number, doc, present))
+                ops.append(InsertOne(doc))
+                actions.append("created")
+                continue
+            changes = {f: doc[f] for f in present}
+            if document_hash(changes) == document_hash({f: stored.get(f) for f in present}):
+                self._imported(doc, "unchanged")
+                continue
+            rows.append((row_number, doc, present))
+            ops.append(UpdateOne({"id": stored['id']}, {"$set": {**changes, "updated_at": now}}))
+            actions.append("updated")
+        await self._write(rows, ops, actions)
+
+    async def flush(self):
+        chunk, self.pending = self.pending, []
+        if not chunk:
+            return
+        valid, failed = await asyncio.to_thread(self._validate, chunk)
+        for row_number, message in failed.items():
+            self.skip(row_number, message)
+        if not valid:
+            return
+        if self.key_fields:
+            await self._upsert(valid)
+            return
+
+        write_errors = {}
+        try:
+            await db[self.spec['collection']].insert_many([doc for _, doc, _ in valid], ordered=False)
+        except BulkWriteError as bwe:
+            write_errors = {error['index']: error.get('errmsg', 'Error de escritura') for error in bwe.details.get('writeErrors', [])}
+
+        for index, (row_number, doc, _) in enumerate(valid):
+            if index in write_errors:
+                self.skip(row_number, write_errors[index])
+            else:
+                self._imported(doc, "created")
+
+    async def finish(self) -> CSVImportResult:
+        await self.flush()
+        if self.counts["created"] or self.counts["updated"]:
+            await bump_collection_version(self.spec['collection'])
+        return CSVImportResult(
+            success=len(self.imported) > 0,
+            imported_count=len(self.imported),
+            skipped_count=self.skipped,
+            errors=[f"Fila {row_number}: {message}" for row_number, message in sorted(self.errors)],
+            imported_items=self.imported,
+            created_count=self.counts["created"],
+            updated_count=self.counts["updated"],
+            unchanged_count=self.counts["unchanged"]
+        )
+
+async def _import_csv_rows(kind: str, rows, upsert_key: Optional[str] = None,
+                           job: Optional["_ImportJobRun"] = None) -> CSVImportResult:
+    """Import an async iterable of (row number, row dict); `job` gets progress and can stop it"""
+    importer = _CSVImporter(kind, upsert_key)
+    rows_read = 0
+
+    async def report(force: bool = False):
+        await job.progress(importer.errors, lambda error: f"Fila {error[0]}: {error[1]}", force,
+                           rows=rows_read, imported=len(importer.imported), skipped=importer.skipped)
+
+    try:
+        async for row_number, row in rows:
+            if job is not None:
+                if job.cancel_requested:
+                    # Chunks already written stay; the one being built is dropped
+                    importer.pending.clear()
+                    break
+                await report()
+            await importer.add(row_number, row)
+            rows_read += 1
+        if job is not None:
+            await importer.flush()
+            await report(force=True)
+    except Exception as e:
+        # Keep the rows read before the error, like the row-by-row importer did
+        result = await importer.finish()
+        result.success = False
+        result.errors.append(f"Error al procesar CSV: {str(e)}")
+        return result
+    return await importer.finish()
+
+async def _csv_text_rows(csv_content: str):
+    reader = csv.DictReader(StringIO(csv_content))
+    for i, row in enumerate(reader, start=2):  # Start at 2 (header is row 1)
+        yield i, row
+
+async def _import_csv_text(kind: str, csv_content: str, mode: str, key: str) -> CSVImportResult:
+    upsert_key = _check_csv_import_mode(mode, key)
+    return await _import_csv_rows(kind, _csv_text_rows(csv_content), upsert_key)
 
 @api_router.post("/import/csv/locomotives", response_model=CSVImportResult)
-async def import_locomotives_csv(csv_content: str = Body(..., media_type="text/plain")):
+async def import_locomotives_csv(csv_content: str = Body(..., media_type="text/plain"),
+                                 mode: str = "insert", key: str = "brand_reference"):
     """
     Import locomotives from CSV content.
     Expected columns: brand,model,reference,locomotive_type,dcc_address,decoder_brand,decoder_model,
                      condition,era,railway_company,purchase_date,price,registration_number,notes
+    mode=upsert updates locomotives matching on key (brand_reference or
+    registration_number) instead of adding duplicates.
     """
-    imported = []
-    skipped = 0
-    errors = []
-    
-    try:
-        reader = csv.DictReader(StringIO(csv_content))
-        required_fields = ['brand', 'model', 'reference', 'dcc_address']
-        
-        for i, row in enumerate(reader, start=2):  # Start at 2 (header is row 1)
-            try:
-                # Validate required fields
-                missing = [f for f in required_fields if not row.get(f, '').strip()]
-                if missing:
-                    skipped += 1
-                    errors.append(f"Fila {i}: Campos requeridos vacíos: {', '.join(missing)}")
-                    continue
-                
-                # Build locomotive data
-                loco_data = {
-                    'brand': row.get('brand', '').strip(),
-                    'model': row.get('model', '').strip(),
-                    'reference': row.get('reference', '').strip(),
-                    'locomotive_type': row.get('locomotive_type', 'diesel').strip() or 'diesel',
-                    'dcc_address': str(row.get('dcc_address', '3').strip() or '3'),  # Keep as string
-                    'decoder_brand': row.get('decoder_brand', '').strip() or None,
-                    'decoder_model': row.get('decoder_model', '').strip() or None,
-                    'condition': row.get('condition', 'nuevo').strip() or 'nuevo',
-                    'era': row.get('era', '').strip() or None,
-                    'railway_company': row.get('railway_company', '').strip() or None,
-                    'purchase_date': row.get('purchase_date', '').strip() or None,
-                    'price': float(row['price'].strip()) if row.get('price', '').strip() else None,
-                    'registration_number': row.get('registration_number', '').strip() or None,
-                    'notes': row.get('notes', '').strip() or None,
-                    'functions': [],
-                    'cv_modifications': []
-                }
-                
-                loco_obj = Locomotive(**loco_data)
-                doc = loco_obj.model_dump()
-                doc['created_at'] = doc['created_at'].isoformat()
-                doc['updated_at'] = doc['updated_at'].isoformat()
-                await db.locomotives.insert_one(doc)
-                
-                imported.append({
-                    'brand': loco_data['brand'],
-                    'model': loco_data['model'],
-                    'reference': loco_data['reference']
-                })
-                
-            except ValueError as ve:
-                skipped += 1
-                errors.append(f"Fila {i}: Error de valor - {str(ve)}")
-            except Exception as e:
-                skipped += 1
-                errors.append(f"Fila {i}: {str(e)}")
-    
-    except Exception as e:
-        return CSVImportResult(
-            success=False,
-            imported_count=0,
-            skipped_count=0,
-            errors=[f"Error al procesar CSV: {str(e)}"],
-            imported_items=[]
-        )
-    
-    return CSVImportResult(
-        success=len(imported) > 0,
-        imported_count=len(imported),
-        skipped_count=skipped,
-        errors=errors,
-        imported_items=imported
-    )
+    return await _import_csv_text("locomotives", csv_content, mode, key)
 
 @api_router.post("/import/csv/rolling-stock", response_model=CSVImportResult)
-async def import_rolling_stock_csv(csv_content: str = Body(..., media_type="text/plain")):
+async def import_rolling_stock_csv(csv_content: str = Body(..., media_type="text/plain"),
+                                   mode: str = "insert", key: str = "brand_reference"):
     """
     Import rolling stock from CSV content.
-    Expected columns: brand,model,reference,stock_type,condition,era,railway_company,purchase_date,price,notes
+    Expected columns: brand,model,reference,stock_type,condition,era,railway_company,purchase_date,price,
+                     registration_number,notes
+    mode=upsert updates items matching on key (brand_reference or
+    registration_number) instead of adding duplicates.
     """
-    imported = []
-    skipped = 0
-    errors = []
-    
+    return await _import_csv_text("rolling-stock", csv_content, mode, key)
+
+CSV_UPLOAD_READ_SIZE = 64 * 1024
+# A record (one or more lines inside quotes) longer than this is rejected
+CSV_UPLOAD_MAX_RECORD = 1024 * 1024
+CSV_DELIMITERS = [',', ';', '\t']
+
+def _sniff_csv_encoding(head: bytes) -> Tuple[str, int]:
+    """Encoding of an uploaded CSV and the length of its BOM"""
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'),
+                          (codecs.BOM_UTF16_BE, 'utf-16-be')):
+        if head.startswith(bom):
+            return encoding, len(bom)
     try:
-        reader = csv.DictReader(StringIO(csv_content))
-        required_fields = ['brand', 'model', 'reference']
-        
-        for i, row in enumerate(reader, start=2):
-            try:
-                missing = [f for f in required_fields if not row.get(f, '').strip()]
-                if missing:
-                    skipped += 1
-                    errors.append(f"Fila {i}: Campos requeridos vacíos: {', '.join(missing)}")
+        # final=False so a character cut at the end of the sample is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8', 0
+    except UnicodeDecodeError:
+        # Excel saves "CSV" in the ANSI code page, Windows-1252 in Spain
+        return 'cp1252', 0
+
+def _sniff_csv_delimiter(header: str) -> str:
+    return max(CSV_DELIMITERS, key=header.count)
+
+def _ends_in_quoted_field(line: str, delimiter: str, in_quotes: bool) -> bool:
+    """Whether a CSV record is still inside a quoted field after `line`"""
+    if '"' not in line:
+        return in_quotes
+    field_start, closed = True, False
+    for ch in line:
+        if in_quotes:
+            if ch == '"':
+                in_quotes, closed = False, True
+            continue
+        # A quote opens a field only at its start; right after a closing
+        # quote it is an escaped "" and the field goes on
+        if ch == '"' and (field_start or closed):
+            in_quotes = True
+        field_start, closed = ch == delimiter, False
+    return in_quotes
+
+class _LineFeed:
+    """Iterator of lines for csv.reader that can be refilled after running dry"""
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+async def _csv_upload_rows(file: UploadFile, encoding: Optional[str] = None, delimiter: Optional[str] = None):
+    """
+    Decode an uploaded CSV chunk by chunk and yield (row number, row dict) as
+    soon as each record is complete, so the file is never held in memory.
+    """
+    head = await file.read(CSV_UPLOAD_READ_SIZE)
+    bom = 0
+    if encoding is None:
+        encoding, bom = _sniff_csv_encoding(head)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    chunk = head[bom:]
+
+    feed = _LineFeed()
+    reader = None
+    header = None
+    row_number = 1
+    partial = ''   # text after the last newline
+    record = []    # lines of a record with an open quoted field
+    record_size = 0
+    in_quotes = False
+
+    while True:
+        final = not chunk
+        partial += decoder.decode(chunk, final=final)
+        lines = partial.split('\n')
+        partial = '' if final else lines.pop()
+        if len(partial) > CSV_UPLOAD_MAX_RECORD:
+            raise ValueError("Línea CSV demasiado larga")
+
+        for line in lines if not final or lines[-1] else lines[:-1]:
+            line += '\n'
+            if reader is None:
+                reader = csv.reader(feed, delimiter=delimiter or _sniff_csv_delimiter(line))
+            record.append(line)
+            record_size += len(line)
+            in_quotes = _ends_in_quoted_field(line, reader.dialect.delimiter, in_quotes)
+            if in_quotes and not final:
+                if record_size > CSV_UPLOAD_MAX_RECORD:
+                    raise ValueError("Registro CSV demasiado largo")
+                continue
+            feed.lines.extend(record)
+            record, record_size, in_quotes = [], 0, False
+
+            while feed.lines:
+                values = next(reader)
+                if not values:
                     continue
-                
-                stock_data = {
-                    'brand': row.get('brand', '').strip(),
-                    'model': row.get('model', '').strip(),
-                    'reference': row.get('reference', '').strip(),
-                    'stock_type': row.get('stock_type', 'vagon_mercancias').strip() or 'vagon_mercancias',
-                    'condition': row.get('condition', 'nuevo').strip() or 'nuevo',
-                    'era': row.get('era', '').strip() or None,
-                    'railway_company': row.get('railway_company', '').strip() or None,
-                    'purchase_date': row.get('purchase_date', '').strip() or None,
-                    'price': float(row['price'].strip()) if row.get('price', '').strip() else None,
-                    'notes': row.get('notes', '').strip() or None,
-                }
-                
-                stock_obj = RollingStock(**stock_data)
-                doc = stock_obj.model_dump()
-                doc['created_at'] = doc['created_at'].isoformat()
-                doc['updated_at'] = doc['updated_at'].isoformat()
-                await db.rolling_stock.insert_one(doc)
-                
-                imported.append({
-                    'brand': stock_data['brand'],
-                    'model': stock_data['model'],
-                    'reference': stock_data['reference']
-                })
-                
-            except ValueError as ve:
-                skipped += 1
-                errors.append(f"Fila {i}: Error de valor - {str(ve)}")
-            except Exception as e:
-                skipped += 1
-                errors.append(f"Fila {i}: {str(e)}")
-    
-    except Exception as e:
-        return CSVImportResult(
-            success=False,
-            imported_count=0,
-            skipped_count=0,
-            errors=[f"Error al procesar CSV: {str(e)}"],
-            imported_items=[]
-        )
-    
-    return CSVImportResult(
-        success=len(imported) > 0,
-        imported_count=len(imported),
-        skipped_count=skipped,
-        errors=errors,
-        imported_items=imported
-    )
+                if header is None:
+                    header = [name.strip() for name in values]
+                    continue
+                row_number += 1
+                yield row_number, dict(zip(header, values))
+
+        if final:
+            break
+        chunk = await file.read(CSV_UPLOAD_READ_SIZE)
+
+@api_router.post("/import/csv/{kind}/upload", response_model=CSVImportResult)
+async def upload_csv(kind: str, file: UploadFile = File(...), encoding: Optional[str] = None,
+                     delimiter: Optional[str] = None, mode: str = "insert", key: str = "brand_reference"):
+    """
+    Import a CSV file upload (kind: locomotives or rolling-stock) without
+    reading it whole. Encoding (UTF-8/UTF-16 BOM, UTF-8 or Windows-1252) and
+    delimiter (',', ';' or tab) are detected unless given. mode and key work
+    as in the text importers.
+    """
+    if kind not in CSV_IMPORT_KINDS:
+        raise HTTPException(status_code=404, detail=f"Tipo de importación desconocido: {kind}")
+    upsert_key = _check_csv_import_mode(mode, key)
+    if encoding is not None:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            raise HTTPException(status_code=400, detail=f"Codificación no válida: {encoding}")
+    if delimiter is not None and len(delimiter) != 1:
+        raise HTTPException(status_code=400, detail="El separador debe ser un único carácter")
+    return await _import_csv_rows(kind, _csv_upload_rows(file, encoding, delimiter), upsert_key)
 
 @api_router.get("/import/csv/template/locomotives")
 async def get_locomotives_csv_template():
     """Get CSV template for locomotive import"""
-    template = "brand,model,reference,locomotive_type,dcc_address,decoder_brand,decoder_model,condition,era,railway_company,purchase_date,price,registration_number,notes\n"
+    template = ",".join(CSV_IMPORT_KINDS["locomotives"]["columns"]) + "\n"
     template += "Arnold,Ferrobus 591,HN2351,automotor,71,ESU,LokSound 5 micro,nuevo,V,RENFE,2024-01-15,199.90,591-531-9,Importado desde tienda\n"
     template += "Roco,Serie 252,73692,electrica,52,Lenz,Standard+,nuevo,VI,Renfe Operadora,2024-02-20,289.00,252-017-3,\n"
     
@@ -1850,9 +3498,9 @@ async def get_locomotives_csv_template():
 @api_router.get("/import/csv/template/rolling-stock")
 async def get_rolling_stock_csv_template():
     """Get CSV template for rolling stock import"""
-    template = "brand,model,reference,stock_type,condition,era,railway_company,purchase_date,price,notes\n"
-    template += "Roco,Talgo III,64211,coche_viajeros,nuevo,V,RENFE,2024-01-10,45.99,Primera clase\n"
-    template += "Arnold,Vagón Tolva,HN6483,vagon_mercancias,nuevo,IV,RENFE,2024-03-05,32.50,\n"
+    template = ",".join(CSV_IMPORT_KINDS["rolling-stock"]["columns"]) + "\n"
+    template += "Roco,Talgo III,64211,coche_viajeros,nuevo,V,RENFE,2024-01-10,45.99,,Primera clase\n"
+    template += "Arnold,Vagón Tolva,HN6483,vagon_mercancias,nuevo,IV,RENFE,2024-03-05,32.50,,\n"
     
     return StreamingResponse(
         iter([template]),
@@ -1860,6 +3508,519 @@ async def get_rolling_stock_csv_template():
         headers={"Content-Disposition": "attachment; filename=plantilla_vagones.csv"}
     )
 
+# ============== CSV EXPORT ==============
+
+CSV_EXPORT_BATCH_SIZE = 500  # rows read from the cursor per chunk written to the response
+
+# Query parameters shared by the inventory exports, mapped to document fields
+_CSV_EXPORT_ITEM_FILTERS = {"brand": "brand", "era": "era", "railway_company": "railway_company",
+                            "condition": "condition"}
+
+def _composition_wagon_ids(comp: dict) -> List[str]:
+    return [w['wagon_id'] for w in sorted(comp.get('wagons') or [], key=lambda w: w.get('position', 0))]
+
+# Locomotives and rolling stock use the importers' columns, so an export can be
+# imported back (mode=upsert matches the rows instead of duplicating them)
+CSV_EXPORT_KINDS = {
+    "locomotives": {
+        "collection": "locomotives",
+        "columns": CSV_IMPORT_KINDS["locomotives"]["columns"],
+        "filters": {**_CSV_EXPORT_ITEM_FILTERS, "type": "locomotive_type"},
+    },
+    "rolling-stock": {
+        "collection": "rolling_stock",
+        "columns": CSV_IMPORT_KINDS["rolling-stock"]["columns"],
+        "filters": {**_CSV_EXPORT_ITEM_FILTERS, "type": "stock_type"},
+    },
+    "decoders": {
+        "collection": "decoders",
+        "columns": ['brand', 'model', 'type', 'scale', 'interface', 'sound_capable', 'max_functions', 'notes'],
+        "filters": {"brand": "brand", "type": "type"},
+    },
+    "sound-projects": {
+        "collection": "sound_projects",
+        "columns": ['name', 'decoder_brand', 'decoder_model', 'locomotive_type', 'version', 'sounds', 'notes'],
+        "filters": {"brand": "decoder_brand", "type": "locomotive_type"},
+    },
+    "wishlist": {
+        "collection": "wishlist",
+        "columns": ['item_type', 'brand', 'model', 'reference', 'estimated_price', 'priority', 'store', 'url',
+                    'notes', 'image_url'],
+        "filters": {"brand": "brand", "type": "item_type"},
+    },
+    "compositions": {
+        "collection": "compositions",
+        "columns": ['name', 'service_type', 'era', 'locomotive_id', 'wagons', 'notes'],
+        "filters": {"era": "era", "type": "service_type"},
+        "values": {"wagons": _composition_wagon_ids},
+    },
+}
+
+def _csv_export_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return "|".join(str(v) for v in value)
+    return value  # csv writes None as an empty cell
+
+def _export_query(kind: str, filters: dict) -> dict:
+    spec = CSV_EXPORT_KINDS[kind]
+    query = {}
+    for param, value in filters.items():
+        if value is None:
+            continue
+        if param not in spec['filters']:
+            raise HTTPException(status_code=400, detail=f"Filtro no disponible para {kind}: {param}")
+        query[spec['filters'][param]] = value
+    return query
+
+@api_router.get("/export/{kind}/csv")
+async def export_csv(kind: str, brand: Optional[str] = None, era: Optional[str] = None,
+                     railway_company: Optional[str] = None, condition: Optional[str] = None,
+                     item_type: Optional[str] = Query(None, alias="type")):
+    """
+    Export a collection as CSV, streamed from the cursor in batches so memory
+    stays flat whatever the size. Only the exported columns are read, never photos.
+    """
+    spec = CSV_EXPORT_KINDS.get(kind)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Tipo de exportación desconocido: {kind}")
+    query = _export_query(kind, {"brand": brand, "era": era, "railway_company": railway_company,
+                                     "condition": condition, "type": item_type})
+    columns = spec['columns']
+    values = spec.get('values', {})
+    cursor = db[spec['collection']].find(query, {"_id": 0, **{column: 1 for column in columns}}) \
+        .batch_size(CSV_EXPORT_BATCH_SIZE)
+
+    async def content():
+        buffer = StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(columns)
+        count = 0
+        async for doc in cursor:
+            writer.writerow([
+                _csv_export_value(values[column](doc) if column in values else doc.get(column))
+                for column in columns
+            ])
+            count += 1
+            if count % CSV_EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+
+    return StreamingResponse(
+        content(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={kind}_{datetime.now().strftime('%Y%m%d')}.csv"}
+    )
+
+# ============== COLUMNAR EXPORT ==============
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ARROW_EXPORT_BATCH_SIZE = 5000  # documents per record batch (and Parquet row group)
+
+_ARROW_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+_ARROW_TIMESTAMP = pa.timestamp("ms", tz="UTC")
+
+# Fixed schemas, so every export of a collection has the same column types
+# whatever the documents hold. Categorical text is dictionary encoded.
+ARROW_EXPORT_SCHEMAS = {
+    "locomotives": pa.schema([
+        ("id", pa.string()),
+        ("brand", _ARROW_CATEGORY),
+        ("model", pa.string()),
+        ("reference", pa.string()),
+        ("locomotive_type", _ARROW_CATEGORY),
+        ("dcc_address", pa.string()),
+        ("decoder_brand", _ARROW_CATEGORY),
+        ("decoder_model", pa.string()),
+        ("condition", _ARROW_CATEGORY),
+        ("era", _ARROW_CATEGORY),
+        ("railway_company", _ARROW_CATEGORY),
+        ("registration_number", pa.string()),
+        ("purchase_date", _ARROW_TIMESTAMP),
+        ("price", pa.float64()),
+        ("created_at", _ARROW_TIMESTAMP),
+        ("updated_at", _ARROW_TIMESTAMP),
+    ]),
+    "rolling-stock": pa.schema([
+        ("id", pa.string()),
+        ("brand", _ARROW_CATEGORY),
+        ("model", pa.string()),
+        ("reference", pa.string()),
+        ("stock_type", _ARROW_CATEGORY),
+        ("condition", _ARROW_CATEGORY),
+        ("era", _ARROW_CATEGORY),
+        ("railway_company", _ARROW_CATEGORY),
+        ("registration_number", pa.string()),
+        ("purchase_date", _ARROW_TIMESTAMP),
+        ("price", pa.float64()),
+        ("created_at", _ARROW_TIMESTAMP),
+        ("updated_at", _ARROW_TIMESTAMP),
+    ]),
+    "wishlist": pa.schema([
+        ("id", pa.string()),
+        ("item_type", _ARROW_CATEGORY),
+        ("brand", _ARROW_CATEGORY),
+        ("model", pa.string()),
+        ("reference", pa.string()),
+        ("estimated_price", pa.float64()),
+        ("priority", pa.int64()),
+        ("store", _ARROW_CATEGORY),
+        ("created_at", _ARROW_TIMESTAMP),
+        ("updated_at", _ARROW_TIMESTAMP),
+    ]),
+}
+
+class _ArrowStreamBuffer(_ZipStreamBuffer):
+    """Unseekable sink that also reports its position, which the Parquet writer asks for"""
+
+    def __init__(self):
+        super().__init__()
+        self._position = 0
+
+    def write(self, data):
+        self._position += len(data)
+        return super().write(data)
+
+    def tell(self):
+        return self._position
+
+def _arrow_timestamp(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None  # Free-text dates such as "Navidad 2019"
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _arrow_number(value, cast):
+    try:
+        return cast(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def _arrow_column(values: list, field_type: pa.DataType) -> pa.Array:
+    if pa.types.is_dictionary(field_type):
+        return pa.array([None if v is None else str(v) for v in values], pa.string()).dictionary_encode()
+    if pa.types.is_timestamp(field_type):
+        return pa.array([_arrow_timestamp(v) for v in values], field_type)
+    if pa.types.is_floating(field_type):
+        return pa.array([_arrow_number(v, float) for v in values], field_type)
+    if pa.types.is_integer(field_type):
+        return pa.array([_arrow_number(v, int) for v in values], field_type)
+    return pa.array([None if v is None else str(v) for v in values], field_type)
+
+def _write_arrow_batch(writer, schema: pa.Schema, docs: List[dict]):
+    writer.write_batch(pa.RecordBatch.from_arrays(
+        [_arrow_column([doc.get(field.name) for doc in docs], field.type) for field in schema],
+        schema=schema
+    ))
+
+async def _columnar_export(kind: str, filters: dict, fmt: str) -> StreamingResponse:
+    """Stream a collection as Parquet or an Arrow IPC stream, one record batch per cursor batch"""
+    schema = ARROW_EXPORT_SCHEMAS.get(kind)
+    if schema is None:
+        raise HTTPException(status_code=404, detail=f"Tipo de exportación columnar desconocido: {kind}")
+    query = _export_query(kind, filters)
+    cursor = db[CSV_EXPORT_KINDS[kind]['collection']] \
+        .find(query, {"_id": 0, **{name: 1 for name in schema.names}}) \
+        .batch_size(ARROW_EXPORT_BATCH_SIZE)
+
+    async def content():
+        sink = _ArrowStreamBuffer()
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= ARROW_EXPORT_BATCH_SIZE:
+                # Converting and compressing is CPU work, keep it off the event loop
+                await asyncio.to_thread(_write_arrow_batch, writer, schema, batch)
+                batch = []
+                yield sink.drain()
+        if batch:
+            await asyncio.to_thread(_write_arrow_batch, writer, schema, batch)
+        writer.close()
+        yield sink.drain()
+
+    extension, media_type = {
+        "parquet": ("parquet", "application/vnd.apache.parquet"),
+        "arrow": ("arrows", "application/vnd.apache.arrow.stream"),
+    }[fmt]
+    return StreamingResponse(
+        content(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={kind}_{datetime.now().strftime('%Y%m%d')}.{extension}"}
+    )
+
+@api_router.get("/export/{kind}/parquet")
+async def export_parquet(kind: str, brand: Optional[str] = None, era: Optional[str] = None,
+                         railway_company: Optional[str] = None, condition: Optional[str] = None,
+                         item_type: Optional[str] = Query(None, alias="type")):
+    """Export a collection as Parquet (zstd), with the filters of GET /export/{kind}/csv"""
+    return await _columnar_export(kind, {"brand": brand, "era": era, "railway_company": railway_company,
+                                         "condition": condition, "type": item_type}, "parquet")
+
+@api_router.get("/export/{kind}/arrow")
+async def export_arrow(kind: str, brand: Optional[str] = None, era: Optional[str] = None,
+                       railway_company: Optional[str] = None, condition: Optional[str] = None,
+                       item_type: Optional[str] = Query(None, alias="type")):
+    """Export a collection as an Arrow IPC stream (read with pyarrow.ipc.open_stream)"""
+    return await _columnar_export(kind, {"brand": brand, "era": era, "railway_company": railway_company,
+                                         "condition": condition, "type": item_type}, "arrow")
+
+# ============== IMPORT JOBS ==============
+
+# Large imports run as jobs: the upload is saved to IMPORT_JOBS_DIR, the job is
+# recorded in import_jobs and an in-process worker runs it. Progress, row
+# errors and the final result are streamed over Server-Sent Events.
+IMPORT_JOBS_DIR = Path(os.environ.get('IMPORT_JOBS_DIR', ROOT_DIR / 'import_jobs'))
+IMPORT_JOB_WORKERS = int(os.environ.get('IMPORT_JOB_WORKERS', '2'))
+IMPORT_JOB_RETENTION = timedelta(days=float(os.environ.get('IMPORT_JOB_RETENTION_DAYS', '7')))
+IMPORT_JOB_PROGRESS_INTERVAL = 0.5  # seconds between progress events
+IMPORT_JOB_MAX_ERROR_EVENTS = 1000  # later row errors are only in the final result
+IMPORT_JOB_UPLOAD_CHUNK = 1024 * 1024
+SSE_KEEPALIVE_SECONDS = 15
+IMPORT_JOB_FINISHED = ("completed", "failed", "cancelled")
+
+class ImportJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    kind: str  # csv or jmri_archive
+    params: dict = {}
+    filename: Optional[str] = None
+    status: str = "queued"  # queued, running, completed, failed, cancelled
+    progress: dict = {}
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+class _ImportJobRun:
+    """Events and cancellation flag of a job that has not finished, kept in memory"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.events = []  # (event name, data), replayed to every subscriber
+        self.changed = asyncio.Condition()
+        self.cancel_requested = False
+        self.done = False
+        self.errors_sent = 0
+        self.last_progress = 0.0
+
+    async def publish(self, event: str, data: dict):
+        self.events.append((event, data))
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def progress(self, errors: list, format_error=str, force: bool = False, **counts):
+        """Publish new row errors and the counts, at most every IMPORT_JOB_PROGRESS_INTERVAL unless forced"""
+        now = time.monotonic()
+        if not force and now - self.last_progress < IMPORT_JOB_PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        for error in errors[self.errors_sent:IMPORT_JOB_MAX_ERROR_EVENTS]:
+            await self.publish("row_error", {"message": format_error(error)})
+        self.errors_sent = max(self.errors_sent, min(len(errors), IMPORT_JOB_MAX_ERROR_EVENTS))
+        await self.publish("progress", counts)
+        await db.import_jobs.update_one({"id": self.job_id}, {"$set": {"progress": counts}})
+
+_import_job_runs: Dict[str, _ImportJobRun] = {}
+_import_job_queue: "asyncio.Queue[str]" = asyncio.Queue()
+
+def _import_job_path(job: dict) -> Path:
+    return IMPORT_JOBS_DIR / f"{job['id']}.upload"
+
+def _save_job_upload(source, path: Path):
+    IMPORT_JOBS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as target:
+        shutil.copyfileobj(source, target, IMPORT_JOB_UPLOAD_CHUNK)
+
+async def _submit_import_job(kind: str, params: dict, file: UploadFile) -> dict:
+    job = ImportJob(kind=kind, params=params, filename=file.filename)
+    await asyncio.to_thread(_save_job_upload, file.file, _import_job_path(job.model_dump()))
+    doc = job.model_dump()
+    doc['expires_at'] = datetime.now(timezone.utc) + IMPORT_JOB_RETENTION
+    await db.import_jobs.insert_one(doc)
+    _import_job_runs[job.id] = _ImportJobRun(job.id)
+    await _import_job_queue.put(job.id)
+    return {"job_id": job.id, "status": job.status}
+
+async def _finish_import_job(run: _ImportJobRun, job: dict, status: str,
+                             result: Optional[dict] = None, error: Optional[str] = None):
+    await db.import_jobs.update_one({"id": job['id']}, {"$set": {
+        "status": status,
+        "result": result,
+        "error": error,
+        "finished_at": datetime.now(timezone.utc).isoformat()
+    }})
+    if result is not None:
+        await run.publish("result", result)
+    await run.publish("status", {"status": status, "error": error})
+    run.done = True
+    await run.publish("end", {"status": status})
+    _import_job_runs.pop(job['id'], None)
+    _import_job_path(job).unlink(missing_ok=True)
+
+async def _run_import_job(job: dict, run: _ImportJobRun) -> BaseModel:
+    params = job['params']
+    with open(_import_job_path(job), 'rb') as f:
+        if job['kind'] == "csv":
+            rows = _csv_upload_rows(UploadFile(file=f), params.get('encoding'), params.get('delimiter'))
+            return await _import_csv_rows(params['csv_kind'], rows, params.get('upsert_key'), run)
+        started = time.perf_counter()
+        archive, members, errors = await _open_jmri_archive(f)
+        return await _import_jmri_archive(archive, members, errors, params['identity'], started, run)
+
+async def import_job_worker():
+    """Take queued jobs one at a time; IMPORT_JOB_WORKERS of these run side by side"""
+    while True:
+        job_id = await _import_job_queue.get()
+        run = _import_job_runs.get(job_id)
+        if run is None:
+            continue
+        # Only a job still queued is started, so a cancelled one is never run
+        job = await db.import_jobs.find_one_and_update(
+            {"id": job_id, "status": "queued"},
+            {"$set": {"status": "running", "started_at": datetime.now(timezone.utc).isoformat()}},
+            projection={"_id": 0}
+        )
+        if job is None:
+            continue
+        await run.publish("status", {"status": "running"})
+        try:
+            result = await _run_import_job(job, run)
+        except asyncio.CancelledError:
+            await _finish_import_job(run, job, "failed", error="Servidor detenido durante la importación")
+            raise
+        except HTTPException as e:
+            await _finish_import_job(run, job, "failed", error=e.detail)
+        except Exception as e:
+            logger.exception("Error en el trabajo de importación %s", job_id)
+            await _finish_import_job(run, job, "failed", error=str(e))
+        else:
+            status = "cancelled" if run.cancel_requested else "completed"
+            await _finish_import_job(run, job, status, result=result.model_dump())
+
+async def recover_import_jobs():
+    """Requeue jobs still queued from a previous run; running ones were cut off"""
+    await db.import_jobs.update_many({"status": "running"}, {"$set": {
+        "status": "failed",
+        "error": "Servidor reiniciado durante la importación",
+        "finished_at": datetime.now(timezone.utc).isoformat()
+    }})
+    async for job in db.import_jobs.find({"status": "queued"}, {"_id": 0, "id": 1}).sort("created_at", 1):
+        _import_job_runs[job['id']] = _ImportJobRun(job['id'])
+        await _import_job_queue.put(job['id'])
+
+@api_router.post("/jobs/import/csv/{kind}", status_code=202)
+async def submit_csv_import_job(kind: str, file: UploadFile = File(...), encoding: Optional[str] = None,
+                                delimiter: Optional[str] = None, mode: str = "insert",
+                                key: str = "brand_reference"):
+    """Queue a CSV file import; parameters as in POST /import/csv/{kind}/upload"""
+    if kind not in CSV_IMPORT_KINDS:
+        raise HTTPException(status_code=404, detail=f"Tipo de importación desconocido: {kind}")
+    upsert_key = _check_csv_import_mode(mode, key)
+    if encoding is not None:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            raise HTTPException(status_code=400, detail=f"Codificación no válida: {encoding}")
+    if delimiter is not None and len(delimiter) != 1:
+        raise HTTPException(status_code=400, detail="El separador debe ser un único carácter")
+    params = {"csv_kind": kind, "upsert_key": upsert_key, "encoding": encoding, "delimiter": delimiter}
+    return await _submit_import_job("csv", params, file)
+
+@api_router.post("/jobs/import/jmri/archive", status_code=202)
+async def submit_jmri_archive_job(file: UploadFile = File(...), identity: Optional[str] = None):
+    """Queue the import of a ZIP of a JMRI roster folder"""
+    identity = _check_jmri_identity(identity)
+    if not await asyncio.to_thread(zipfile.is_zipfile, file.file):
+        raise HTTPException(status_code=400, detail="El archivo no es un ZIP de roster JMRI válido")
+    file.file.seek(0)
+    return await _submit_import_job("jmri_archive", {"identity": identity}, file)
+
+@api_router.get("/jobs")
+async def list_import_jobs(limit: int = 20):
+    """Most recent import jobs, without their results"""
+    limit = max(1, min(limit, 100))
+    return await db.import_jobs.find({}, {"_id": 0, "result": 0, "expires_at": 0}) \
+        .sort("created_at", -1).to_list(limit)
+
+async def _get_import_job(job_id: str) -> dict:
+    job = await db.import_jobs.find_one({"id": job_id}, {"_id": 0, "expires_at": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de importación no encontrado")
+    return job
+
+@api_router.get("/jobs/{job_id}")
+async def get_import_job(job_id: str):
+    return await _get_import_job(job_id)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@api_router.get("/jobs/{job_id}/events")
+async def import_job_events(job_id: str):
+    """
+    Server-Sent Events for a job: status, progress, row_error, result and a
+    final end event. Events already sent are replayed to late subscribers.
+    """
+    job = await _get_import_job(job_id)
+    run = _import_job_runs.get(job_id)
+
+    async def finished_events():
+        if job.get('result') is not None:
+            yield _sse("result", job['result'])
+        yield _sse("status", {"status": job['status'], "error": job.get('error')})
+        yield _sse("end", {"status": job['status']})
+
+    async def live_events():
+        sent = 0
+        while True:
+            while sent < len(run.events):
+                event, data = run.events[sent]
+                sent += 1
+                yield _sse(event, data)
+            if run.done:
+                return
+            try:
+                async with run.changed:
+                    await asyncio.wait_for(
+                        run.changed.wait_for(lambda: len(run.events) > sent or run.done),
+                        SSE_KEEPALIVE_SECONDS
+                    )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        live_events() if run is not None else finished_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/jobs/{job_id}/cancel")
+async def cancel_import_job(job_id: str):
+    """Stop a job; rows already written by a running job are kept"""
+    job = await _get_import_job(job_id)
+    run = _import_job_runs.get(job_id)
+    if run is None or job['status'] in IMPORT_JOB_FINISHED:
+        raise HTTPException(status_code=409, detail="El trabajo ya ha terminado")
+    run.cancel_requested = True
+    # A queued job is cancelled right away unless a worker just picked it up
+    not_started = await db.import_jobs.update_one({"id": job_id, "status": "queued"}, {"$set": {"status": "cancelled"}})
+    if not_started.modified_count:
+        await _finish_import_job(run, job, "cancelled")
+    return {"job_id": job_id, "cancel_requested": True}
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1878,6 +4039,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Secondary indexes created at startup: (collection, keys, options)
+COLLECTION_INDEXES = [
+    ("locomotives", [("id", 1)], {}),
+    ("locomotives", [("brand", 1), ("reference", 1), ("dcc_address", 1)], {}),
+    ("locomotives", [("jmri_id", 1)], {"sparse": True}),
+    ("locomotives", [("registration_number", 1)], {}),
+    ("rolling_stock", [("id", 1)], {}),
+    # CSV upsert keys
+    ("rolling_stock", [("brand", 1), ("reference", 1)], {}),
+    ("rolling_stock", [("registration_number", 1)], {}),
+    ("decoders", [("id", 1)], {}),
+    ("sound_projects", [("id", 1)], {}),
+    ("wishlist", [("id", 1)], {}),
+    ("compositions", [("id", 1)], {}),
+    ("jmri_sync_state", [("file_name", 1)], {"unique": True}),
+    ("backup_history", [("created_at", -1), ("id", -1)], {}),
+    ("backup_history", [("type", 1), ("created_at", -1)], {}),
+    ("backup_history", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("import_jobs", [("id", 1)], {"unique": True}),
+    ("import_jobs", [("status", 1), ("created_at", 1)], {}),
+    ("import_jobs", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+]
+
+@app.on_event("startup")
+async def create_indexes():
+    for collection, keys, options in COLLECTION_INDEXES:
+        await db[collection].create_index(keys, **options)
+    # Give history entries recorded before the TTL index an expiry date.
+    # Done in Python so it works on MongoDB versions without $dateAdd.
+    backfill = []
+    async for entry in db.backup_history.find({"expires_at": {"$exists": False}}, {"_id": 1, "created_at": 1}):
+        created_at = _parse_timestamp(entry.get('created_at')) or datetime.now(timezone.utc)
+        backfill.append(UpdateOne({"_id": entry['_id']}, {"$set": {"expires_at": created_at + BACKUP_HISTORY_RETENTION}}))
+    if backfill:
+        await db.backup_history.bulk_write(backfill, ordered=False)
+
+@app.on_event("startup")
+async def load_pdf_cache():
+    await asyncio.to_thread(pdf_cache.scan)
+
+_background_tasks = []
+
+@app.on_event("startup")
+async def start_background_tasks():
+    _background_tasks.append(asyncio.create_task(backup_scheduler()))
+    await recover_import_jobs()
+    for _ in range(IMPORT_JOB_WORKERS):
+        _background_tasks.append(asyncio.create_task(import_job_worker()))
+    if JMRI_ROSTER_DIR:
+        _background_tasks.append(asyncio.create_task(jmri_roster_watcher()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    shutdown_jmri_executor()
+    shutdown_pdf_executor()
     client.close()
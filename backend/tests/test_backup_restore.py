@@ -0,0 +1,374 @@
+"""
+Test suite for Backup/Restore features.
+Tests the following features:
+- Merge-mode restore with conflict policies
+- Backup checksum manifest verification and diff against live data
+- Automatic backups written to disk
+- Paginated backup history with size/duration metrics
+"""
+import pytest
+import requests
+import os
+import uuid
+import json
+import gzip
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def make_decoder(decoder_id, notes, updated_at=None):
+    decoder = {
+        "id": decoder_id,
+        "brand": "TEST_Merge",
+        "model": "Merge Decoder",
+        "type": "sound",
+        "scale": "N",
+        "interface": "Next18",
+        "sound_capable": True,
+        "max_functions": 28,
+        "notes": notes,
+        "created_at": "2026-01-01T00:00:00+00:00"
+    }
+    if updated_at:
+        decoder["updated_at"] = updated_at
+    return decoder
+
+
+def partial_backup(decoders):
+    return {
+        "version": "1.0",
+        "created_at": "2026-01-01T00:00:00+00:00",
+        "decoders": decoders
+    }
+
+
+class TestMergeRestore:
+    """Test POST /api/restore?mode=merge"""
+
+    @pytest.fixture(autouse=True)
+    def setup_cleanup(self):
+        self.decoder_id = f"TEST_{uuid.uuid4().hex[:8]}"
+        yield
+        requests.delete(f"{BASE_URL}/api/decoders/{self.decoder_id}")
+
+    def test_merge_inserts_new_document(self):
+        """Test merging a partial backup inserts documents that do not exist"""
+        response = requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "overwrite"},
+            json=partial_backup([make_decoder(self.decoder_id, "original")])
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["mode"] == "merge"
+        assert data["merged"]["decoders"] == {"inserted": 1, "updated": 0, "skipped": 0}
+        # Collections not present in the backup are left alone
+        assert "locomotives" not in data["merged"]
+
+        get_response = requests.get(f"{BASE_URL}/api/decoders/{self.decoder_id}")
+        assert get_response.status_code == 200
+        assert get_response.json()["notes"] == "original"
+        print("✅ Merge restore inserted new decoder")
+
+    def test_merge_keep_existing_skips(self):
+        """Test keep_existing policy does not touch existing documents"""
+        requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "overwrite"},
+            json=partial_backup([make_decoder(self.decoder_id, "original")])
+        )
+        response = requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "keep_existing"},
+            json=partial_backup([make_decoder(self.decoder_id, "changed")])
+        )
+        assert response.status_code == 200
+        assert response.json()["merged"]["decoders"]["skipped"] == 1
+
+        get_response = requests.get(f"{BASE_URL}/api/decoders/{self.decoder_id}")
+        assert get_response.json()["notes"] == "original"
+        print("✅ keep_existing policy skipped existing decoder")
+
+    def test_merge_newer_policy(self):
+        """Test newer policy only replaces documents with a more recent updated_at"""
+        requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "overwrite"},
+            json=partial_backup([make_decoder(self.decoder_id, "v2", "2026-02-01T00:00:00+00:00")])
+        )
+        older = requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "newer"},
+            json=partial_backup([make_decoder(self.decoder_id, "v1", "2026-01-01T00:00:00+00:00")])
+        )
+        assert older.json()["merged"]["decoders"]["skipped"] == 1
+
+        newer = requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "newer"},
+            json=partial_backup([make_decoder(self.decoder_id, "v3", "2026-03-01T00:00:00+00:00")])
+        )
+        assert newer.json()["merged"]["decoders"]["updated"] == 1
+
+        get_response = requests.get(f"{BASE_URL}/api/decoders/{self.decoder_id}")
+        assert get_response.json()["notes"] == "v3"
+        print("✅ newer policy keeps the most recent version")
+
+    def test_merge_newer_policy_falls_back_to_created_at(self):
+        """Test newer policy compares created_at for decoders that were never edited"""
+        created = requests.post(f"{BASE_URL}/api/decoders", json={
+            "brand": "TEST_Merge", "model": "Created", "type": "sound", "interface": "Next18"
+        })
+        assert created.status_code == 200
+        self.decoder_id = created.json()["id"]
+        snapshot = next(d for d in requests.get(f"{BASE_URL}/api/backup").json()["decoders"]
+                        if d["id"] == self.decoder_id)
+        assert "updated_at" not in snapshot
+
+        # Put an older, never edited version of the same decoder in place
+        requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "overwrite"},
+            json=partial_backup([{**make_decoder(self.decoder_id, "old"), "created_at": "2025-01-01T00:00:00+00:00"}])
+        )
+        response = requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "newer"},
+            json=partial_backup([snapshot])
+        )
+        assert response.json()["merged"]["decoders"]["updated"] == 1
+        assert requests.get(f"{BASE_URL}/api/decoders/{self.decoder_id}").json()["model"] == "Created"
+
+    def test_decoder_update_stamps_updated_at(self):
+        """Test editing a decoder records updated_at for later merges"""
+        requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "overwrite"},
+            json=partial_backup([make_decoder(self.decoder_id, "original")])
+        )
+        edit = {k: v for k, v in make_decoder(self.decoder_id, "edited").items() if k not in ("id", "created_at")}
+        assert requests.put(f"{BASE_URL}/api/decoders/{self.decoder_id}", json=edit).status_code == 200
+
+        stored = next(d for d in requests.get(f"{BASE_URL}/api/backup").json()["decoders"]
+                      if d["id"] == self.decoder_id)
+        assert "updated_at" in stored
+
+        stale = requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "newer"},
+            json=partial_backup([make_decoder(self.decoder_id, "stale")])
+        )
+        assert stale.json()["merged"]["decoders"]["skipped"] == 1
+
+    def test_invalid_policy_rejected(self):
+        """Test an unknown policy returns 400"""
+        response = requests.post(
+            f"{BASE_URL}/api/restore",
+            params={"mode": "merge", "policy": "random"},
+            json=partial_backup([])
+        )
+        assert response.status_code == 400
+
+    def test_replace_requires_all_collections(self):
+        """Test replace mode refuses a partial backup instead of wiping collections"""
+        response = requests.post(f"{BASE_URL}/api/restore", json=partial_backup([]))
+        assert response.status_code == 400
+
+
+class TestReplaceRestoreRollback:
+    """Test POST /api/restore in replace mode followed by POST /api/restore/rollback"""
+
+    def test_restore_then_rollback(self):
+        """Test a replace restore can be undone with the rollback copy"""
+        decoder_id = f"TEST_{uuid.uuid4().hex[:8]}"
+        original = requests.get(f"{BASE_URL}/api/backup").json()
+        counts = {name: len(original[name]) for name in ("locomotives", "rolling_stock", "decoders", "sound_projects")}
+
+        backup = {**original, "decoders": original["decoders"] + [make_decoder(decoder_id, "restored")]}
+        backup.pop("manifest", None)
+        response = requests.post(f"{BASE_URL}/api/restore", json=backup)
+        assert response.status_code == 200
+        assert response.json()["restored"]["decoders"] == counts["decoders"] + 1
+        assert requests.get(f"{BASE_URL}/api/decoders/{decoder_id}").json()["notes"] == "restored"
+
+        rollback = requests.post(f"{BASE_URL}/api/restore/rollback")
+        assert rollback.status_code == 200
+        assert rollback.json()["restored"] == counts
+        assert requests.get(f"{BASE_URL}/api/decoders/{decoder_id}").status_code == 404
+
+        # The rollback copy is used up
+        assert requests.post(f"{BASE_URL}/api/restore/rollback").status_code == 404
+        print("✅ Replace restore rolled back")
+
+
+class TestBackupVerifyAndDiff:
+    """Test POST /api/backup/verify and POST /api/backup/diff"""
+
+    def upload(self, endpoint, backup):
+        return requests.post(
+            f"{BASE_URL}/api/backup/{endpoint}",
+            files={"file": ("backup.json", json.dumps(backup), "application/json")}
+        )
+
+    def test_backup_includes_manifest(self):
+        """Test GET /api/backup includes a checksum manifest"""
+        response = requests.get(f"{BASE_URL}/api/backup")
+        assert response.status_code == 200
+        manifest = response.json()["manifest"]
+        assert manifest["algorithm"] == "sha256"
+        assert set(manifest["collections"]) == {"locomotives", "rolling_stock", "decoders", "sound_projects"}
+
+    def test_verify_valid_backup(self):
+        """Test a freshly downloaded backup verifies"""
+        backup = requests.get(f"{BASE_URL}/api/backup").json()
+        response = self.upload("verify", backup)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["valid"] == True
+        assert data["errors"] == []
+        print("✅ Backup manifest verified")
+
+    def test_verify_tampered_backup(self):
+        """Test a modified backup fails verification"""
+        backup = requests.get(f"{BASE_URL}/api/backup").json()
+        backup["decoders"].append(make_decoder("TEST_tampered", "tampered"))
+        data = self.upload("verify", backup).json()
+        assert data["valid"] == False
+        assert len(data["errors"]) > 0
+
+    def test_diff_reports_added_document(self):
+        """Test diff lists documents the backup would add"""
+        backup = requests.get(f"{BASE_URL}/api/backup").json()
+        backup["decoders"].append(make_decoder("TEST_diff_added", "diff"))
+        response = self.upload("diff", backup)
+        assert response.status_code == 200
+        decoders = response.json()["collections"]["decoders"]
+        assert "TEST_diff_added" in decoders["added"]
+        print("✅ Diff reports added decoder")
+
+    def test_invalid_file_rejected(self):
+        """Test uploading something that is not JSON returns 400"""
+        response = requests.post(
+            f"{BASE_URL}/api/backup/verify",
+            files={"file": ("backup.json", "not json", "application/json")}
+        )
+        assert response.status_code == 400
+
+    def test_truncated_gzip_rejected(self):
+        """Test uploading a cut-off .json.gz returns 400"""
+        backup = requests.get(f"{BASE_URL}/api/backup").content
+        compressed = gzip.compress(backup)
+        response = requests.post(
+            f"{BASE_URL}/api/backup/verify",
+            files={"file": ("backup.json.gz", compressed[:len(compressed) // 2], "application/gzip")}
+        )
+        assert response.status_code == 400
+
+    def test_verify_rejects_empty_manifest(self):
+        """Test a manifest without collections does not verify"""
+        backup = requests.get(f"{BASE_URL}/api/backup").json()
+        backup["manifest"]["collections"] = {}
+        data = self.upload("verify", backup).json()
+        assert data["valid"] == False
+
+    def test_verify_flags_collection_missing_from_manifest(self):
+        """Test a collection left out of the manifest fails verification"""
+        backup = requests.get(f"{BASE_URL}/api/backup").json()
+        backup["decoders"].append(make_decoder("TEST_unlisted", "unlisted"))
+        del backup["manifest"]["collections"]["decoders"]
+        data = self.upload("verify", backup).json()
+        assert data["valid"] == False
+        assert any(error.startswith("decoders:") for error in data["errors"])
+
+
+class TestAutomaticBackups:
+    """Test on-disk automatic backups"""
+
+    def test_run_backup_and_download(self):
+        """Test POST /api/backup/run writes a file that can be listed and downloaded"""
+        response = requests.post(f"{BASE_URL}/api/backup/run")
+        assert response.status_code == 200
+        filename = response.json()["filename"]
+        assert filename.endswith(".json.gz")
+
+        files = requests.get(f"{BASE_URL}/api/backup/files").json()
+        assert filename in [f["filename"] for f in files]
+
+        download = requests.get(f"{BASE_URL}/api/backup/files/{filename}")
+        assert download.status_code == 200
+        backup = json.loads(gzip.decompress(download.content))
+        assert "manifest" in backup
+        print(f"✅ Automatic backup {filename} downloaded")
+
+    def test_download_unknown_file(self):
+        """Test downloading a file outside the backup naming scheme returns 404"""
+        response = requests.get(f"{BASE_URL}/api/backup/files/server.py")
+        assert response.status_code == 404
+
+    def test_settings_include_auto_backup_fields(self):
+        """Test automatic backup settings round-trip"""
+        original = requests.get(f"{BASE_URL}/api/backup/settings").json()
+        payload = {**original, "auto_backup_enabled": False, "keep_daily": 5}
+        response = requests.post(f"{BASE_URL}/api/backup/settings", json=payload)
+        assert response.status_code == 200
+        assert response.json()["keep_daily"] == 5
+        requests.post(f"{BASE_URL}/api/backup/settings", json=original)
+
+    def test_settings_reject_zero_retention(self):
+        """Test retention counts below 1 are rejected"""
+        original = requests.get(f"{BASE_URL}/api/backup/settings").json()
+        response = requests.post(f"{BASE_URL}/api/backup/settings", json={**original, "keep_daily": 0})
+        assert response.status_code == 422
+
+    def test_runs_in_same_second_keep_both_files(self):
+        """Test two back-to-back runs write two different files"""
+        first = requests.post(f"{BASE_URL}/api/backup/run").json()["filename"]
+        second = requests.post(f"{BASE_URL}/api/backup/run").json()["filename"]
+        assert first != second
+
+        files = [f["filename"] for f in requests.get(f"{BASE_URL}/api/backup/files").json()]
+        assert files[0] == second
+        assert requests.get(f"{BASE_URL}/api/backup/files/{second}").status_code == 200
+
+
+class TestBackupHistory:
+    """Test GET /api/backup/history pagination and metrics"""
+
+    def test_manual_backup_records_metrics(self):
+        """Test a manual backup records its size and duration"""
+        requests.get(f"{BASE_URL}/api/backup")
+        history = requests.get(f"{BASE_URL}/api/backup/history", params={"limit": 1}).json()
+        assert len(history) == 1
+        assert history[0]["type"] == "manual"
+        assert history[0]["size_bytes"] > 0
+        assert history[0]["duration_ms"] >= 0
+        assert "expires_at" not in history[0]
+
+    def test_keyset_pagination(self):
+        """Test paging through history with the X-Next-Cursor header"""
+        for _ in range(3):
+            requests.get(f"{BASE_URL}/api/backup")
+
+        first = requests.get(f"{BASE_URL}/api/backup/history", params={"limit": 2})
+        assert first.status_code == 200
+        assert len(first.json()) == 2
+        cursor = first.headers.get("X-Next-Cursor")
+        assert cursor
+
+        second = requests.get(f"{BASE_URL}/api/backup/history", params={"limit": 2, "before": cursor})
+        assert second.status_code == 200
+        first_ids = {entry["id"] for entry in first.json()}
+        second_ids = {entry["id"] for entry in second.json()}
+        assert len(second_ids) > 0
+        assert first_ids.isdisjoint(second_ids)
+        assert max(e["created_at"] for e in second.json()) <= min(e["created_at"] for e in first.json())
+        print("✅ History pages do not overlap")
+
+    def test_invalid_cursor(self):
+        """Test an invalid cursor returns 400"""
+        response = requests.get(f"{BASE_URL}/api/backup/history", params={"before": "%%%"})
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
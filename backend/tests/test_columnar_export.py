@@ -0,0 +1,91 @@
+"""
+Test suite for the columnar exports.
+Tests GET /api/export/{kind}/parquet and /arrow: the fixed schema, values
+converted per column type, batching and filters.
+"""
+import pytest
+import requests
+import os
+import io
+import uuid
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+ROLLING_STOCK_HEADER = "brand,model,reference,stock_type,condition,era,railway_company,purchase_date,price,notes\n"
+
+
+@pytest.fixture(scope="module")
+def brand():
+    """Rolling stock imported once for the module: more rows than one record batch"""
+    brand = f"TEST_{uuid.uuid4().hex[:8]}"
+    rows = [f"{brand},Vagón {i},R{i},furgon,usado,IV,RENFE,2024-03-0{1 + i % 9},{i}.5,"
+            for i in range(5100)]
+    rows[0] = f"{brand},Sin precio,R0,coche_viajeros,nuevo,V,RENFE,Navidad 2019,,"
+    response = requests.post(
+        f"{BASE_URL}/api/import/csv/rolling-stock",
+        data=ROLLING_STOCK_HEADER + "\n".join(rows),
+        headers={"Content-Type": "text/plain"}
+    )
+    assert response.json()["imported_count"] == 5100
+    yield brand
+    backup = requests.get(f"{BASE_URL}/api/backup").json()
+    for item in backup["rolling_stock"]:
+        if item["brand"] == brand:
+            requests.delete(f"{BASE_URL}/api/rolling-stock/{item['id']}")
+
+
+class TestColumnarExport:
+    """Test GET /api/export/{kind}/parquet and /api/export/{kind}/arrow"""
+
+    @pytest.fixture(autouse=True)
+    def use_brand(self, brand):
+        self.brand = brand
+
+    def get_table(self, fmt, **params):
+        response = requests.get(f"{BASE_URL}/api/export/rolling-stock/{fmt}",
+                                params={"brand": self.brand, **params})
+        assert response.status_code == 200
+        if fmt == "parquet":
+            return pq.read_table(io.BytesIO(response.content))
+        return pa.ipc.open_stream(response.content).read_all()
+
+    def test_parquet_schema_and_values(self):
+        """Test the Parquet export has the fixed schema and converted values"""
+        table = self.get_table("parquet")
+        assert table.num_rows == 5100
+        assert table.schema.field("price").type == pa.float64()
+        assert table.schema.field("purchase_date").type == pa.timestamp("ms", tz="UTC")
+        assert pa.types.is_dictionary(table.schema.field("brand").type)
+        assert pa.types.is_dictionary(table.schema.field("railway_company").type)
+        assert "photo" not in table.schema.names
+
+        rows = {row["reference"]: row for row in table.to_pylist()}
+        assert rows["R7"]["price"] == 7.5
+        assert rows["R7"]["purchase_date"] == datetime(2024, 3, 8, tzinfo=timezone.utc)
+        assert rows["R7"]["era"] == "IV"
+        # Unparseable dates and missing prices become nulls
+        assert rows["R0"]["purchase_date"] is None
+        assert rows["R0"]["price"] is None
+        print("✅ Parquet export has 5100 typed rows")
+
+    def test_arrow_stream(self):
+        """Test the Arrow IPC stream holds the same data, filters applied"""
+        table = self.get_table("arrow")
+        assert table.num_rows == 5100
+        assert table.schema == self.get_table("parquet").schema
+
+        filtered = self.get_table("arrow", type="coche_viajeros")
+        assert filtered.column("reference").to_pylist() == ["R0"]
+
+    def test_unknown_kind(self):
+        """Test collections without a columnar schema return 404"""
+        response = requests.get(f"{BASE_URL}/api/export/compositions/parquet")
+        assert response.status_code == 404
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,288 @@
+"""
+Test suite for bulk CSV import and export.
+Tests the following features:
+- Chunked validation and insert_many across several chunks
+- Per-row error reporting in CSVImportResult
+- Upsert mode keyed on brand + reference or registration number
+- Streaming file uploads with encoding and delimiter detection
+- Streamed CSV export with filters that imports back without duplicates
+"""
+import pytest
+import requests
+import os
+import csv
+import io
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+ROLLING_STOCK_HEADER = "brand,model,reference,stock_type,condition,era,railway_company,purchase_date,price,notes\n"
+
+
+def rolling_stock_by_brand(brand):
+    # The backup has every document; the list endpoint is capped
+    backup = requests.get(f"{BASE_URL}/api/backup").json()
+    return [item for item in backup["rolling_stock"] if item["brand"] == brand]
+
+
+def delete_rolling_stock_by_brand(brand):
+    for item in rolling_stock_by_brand(brand):
+        requests.delete(f"{BASE_URL}/api/rolling-stock/{item['id']}")
+
+
+class TestChunkedCSVImport:
+    """Test POST /api/import/csv/{kind} with more rows than one chunk"""
+
+    @pytest.fixture(autouse=True)
+    def brand(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        yield
+        delete_rolling_stock_by_brand(self.brand)
+
+    def test_import_spanning_chunks_reports_row_errors(self):
+        """Test 1200 rows are imported in chunks and bad rows are reported by number"""
+        rows = []
+        for i in range(1200):
+            price = "abc" if i == 3 else "12.50"
+            reference = "" if i == 1100 else f"R{i}"
+            rows.append(f"{self.brand},Vagón {i},{reference},vagon_mercancias,nuevo,IV,RENFE,2024-01-01,{price},")
+        response = requests.post(
+            f"{BASE_URL}/api/import/csv/rolling-stock",
+            data=ROLLING_STOCK_HEADER + "\n".join(rows),
+            headers={"Content-Type": "text/plain"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] == True
+        assert data["imported_count"] == 1198
+        assert data["skipped_count"] == 2
+        # Header is row 1, so data row i is row i + 2
+        assert data["errors"][0].startswith("Fila 5: Error de valor")
+        assert data["errors"][1].startswith("Fila 1102: Campos requeridos vacíos: reference")
+
+        stored = rolling_stock_by_brand(self.brand)
+        assert len(stored) == 1198
+        assert all(item["created_at"] for item in stored)
+        print("✅ Chunked CSV import inserted 1198 rows and reported 2 errors")
+
+
+class TestCSVUpsert:
+    """Test POST /api/import/csv/{kind}?mode=upsert"""
+
+    @pytest.fixture(autouse=True)
+    def brand(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        yield
+        delete_rolling_stock_by_brand(self.brand)
+
+    def import_csv(self, rows, **params):
+        response = requests.post(
+            f"{BASE_URL}/api/import/csv/rolling-stock",
+            params={"mode": "upsert", **params},
+            data=ROLLING_STOCK_HEADER.replace("price,notes", "price,registration_number,notes") + "\n".join(rows),
+            headers={"Content-Type": "text/plain"}
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    def supplier_rows(self, price="30.00", condition=""):
+        return [
+            f"{self.brand},Tolva,R1,vagon_mercancias,{condition},IV,RENFE,,{price},,",
+            f"{self.brand},Cisterna,R2,vagon_mercancias,,IV,RENFE,,25.00,,",
+            f"{self.brand},Furgón,R3,furgon,,IV,RENFE,,20.00,,",
+        ]
+
+    def test_reimport_does_not_duplicate(self):
+        """Test importing the same file twice creates each item once"""
+        first = self.import_csv(self.supplier_rows())
+        assert (first["created_count"], first["updated_count"], first["unchanged_count"]) == (3, 0, 0)
+
+        second = self.import_csv(self.supplier_rows())
+        assert (second["created_count"], second["updated_count"], second["unchanged_count"]) == (0, 0, 3)
+        assert second["imported_count"] == 3
+        assert len(rolling_stock_by_brand(self.brand)) == 3
+        print("✅ Upsert re-import left 3 items unchanged")
+
+    def test_changed_rows_update_and_keep_user_edits(self):
+        """Test changed cells are applied and empty cells keep stored values"""
+        self.import_csv(self.supplier_rows())
+        item = next(i for i in rolling_stock_by_brand(self.brand) if i["reference"] == "R2")
+        edit = {k: v for k, v in item.items() if k not in ("id", "created_at", "updated_at")}
+        edit["condition"] = "usado"
+        assert requests.put(f"{BASE_URL}/api/rolling-stock/{item['id']}", json=edit).status_code == 200
+
+        data = self.import_csv(self.supplier_rows(price="35.00"))
+        assert (data["created_count"], data["updated_count"], data["unchanged_count"]) == (0, 1, 2)
+
+        stored = {i["reference"]: i for i in rolling_stock_by_brand(self.brand)}
+        assert stored["R1"]["price"] == 35.0
+        assert stored["R2"]["condition"] == "usado"
+
+    def test_repeated_key_in_file(self):
+        """Test a key repeated in the file keeps the last row and reports the first"""
+        rows = self.supplier_rows() + [f"{self.brand},Tolva bis,R1,vagon_mercancias,,IV,RENFE,,31.00,,"]
+        data = self.import_csv(rows)
+        assert data["created_count"] == 3
+        assert data["errors"] == ["Fila 2: Clave repetida más abajo en el archivo (fila 5)"]
+        stored = {i["reference"]: i for i in rolling_stock_by_brand(self.brand)}
+        assert stored["R1"]["model"] == "Tolva bis"
+
+    def test_registration_number_key(self):
+        """Test matching on registration_number and requiring it"""
+        row = f"{self.brand},Talgo,R9,coche_viajeros,,V,RENFE,,40.00,{self.brand}-001,"
+        assert self.import_csv([row], key="registration_number")["created_count"] == 1
+
+        renamed = row.replace(",R9,", ",R10,")
+        data = self.import_csv([renamed, f"{self.brand},Sin matrícula,R11,coche_viajeros,,V,RENFE,,,,"],
+                               key="registration_number")
+        assert data["updated_count"] == 1
+        assert data["errors"] == ["Fila 3: Campos requeridos vacíos: registration_number"]
+        assert [i["reference"] for i in rolling_stock_by_brand(self.brand)] == ["R10"]
+
+    def test_invalid_mode_and_key(self):
+        """Test unknown modes and keys return 400"""
+        for params in ({"mode": "replace"}, {"mode": "upsert", "key": "model"}):
+            response = requests.post(
+                f"{BASE_URL}/api/import/csv/rolling-stock", params=params,
+                data=ROLLING_STOCK_HEADER, headers={"Content-Type": "text/plain"}
+            )
+            assert response.status_code == 400
+
+
+class TestCSVUpload:
+    """Test POST /api/import/csv/{kind}/upload"""
+
+    @pytest.fixture(autouse=True)
+    def brand(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        yield
+        delete_rolling_stock_by_brand(self.brand)
+
+    def upload(self, content, kind="rolling-stock", **params):
+        return requests.post(
+            f"{BASE_URL}/api/import/csv/{kind}/upload",
+            params=params,
+            files={"file": ("inventario.csv", content, "text/csv")}
+        )
+
+    def test_excel_semicolon_file(self):
+        """Test a UTF-8 BOM, ';'-separated file spanning several read chunks"""
+        notes = "Lote de tienda " * 15
+        rows = [f'{self.brand};Vagón {i};R{i};vagon_mercancias;nuevo;IV;RENFE;2024-01-01;12,50;{notes}'
+                for i in range(1000)]
+        # Quoted field with a line break and an escaped quote, and a bare inch mark
+        rows[500] = f'{self.brand};"Tolva ""TT""\nsegunda línea";R500;vagon_mercancias;nuevo;IV;RENFE;;;Ruedas 1/2"'
+        content = "\n".join([ROLLING_STOCK_HEADER.replace(",", ";").strip()] + rows).encode("utf-8-sig")
+        assert len(content) > 3 * 64 * 1024
+
+        data = self.upload(content).json()
+        assert data["errors"] == []
+        assert data["imported_count"] == 1000
+
+        stored = {item["reference"]: item for item in rolling_stock_by_brand(self.brand)}
+        assert stored["R0"]["price"] == 12.5
+        assert stored["R1"]["model"] == "Vagón 1"
+        assert stored["R500"]["model"] == 'Tolva "TT"\nsegunda línea'
+        assert stored["R500"]["notes"] == 'Ruedas 1/2"'
+        print("✅ Excel CSV upload imported 1000 rows")
+
+    def test_windows_1252_file(self):
+        """Test a file saved in the Windows code page keeps its accents"""
+        content = (ROLLING_STOCK_HEADER + f"{self.brand},Furgón,R1,furgon,nuevo,IV,RENFE,,,Señal\n").encode("cp1252")
+        data = self.upload(content).json()
+        assert data["imported_count"] == 1
+        stored = rolling_stock_by_brand(self.brand)[0]
+        assert stored["model"] == "Furgón"
+        assert stored["notes"] == "Señal"
+
+    def test_row_errors_keep_row_numbers(self):
+        """Test row numbers count records, not physical lines"""
+        content = (ROLLING_STOCK_HEADER
+                   + f'{self.brand},"Dos\nlíneas",R1,,,,,,,\n'
+                   + f"{self.brand},Sin referencia,,,,,,,,\n").encode("utf-8")
+        data = self.upload(content).json()
+        assert data["imported_count"] == 1
+        assert data["errors"] == ["Fila 3: Campos requeridos vacíos: reference"]
+
+    def test_unknown_kind(self):
+        """Test uploading to an unknown import kind returns 404"""
+        assert self.upload(b"brand\n", kind="wagons").status_code == 404
+
+
+class TestCSVExport:
+    """Test GET /api/export/{kind}/csv"""
+
+    @pytest.fixture(autouse=True)
+    def brand(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        yield
+        delete_rolling_stock_by_brand(self.brand)
+
+    def export(self, kind="rolling-stock", **params):
+        response = requests.get(f"{BASE_URL}/api/export/{kind}/csv", params=params)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        return list(csv.DictReader(io.StringIO(response.content.decode("utf-8"))))
+
+    def test_export_round_trips(self):
+        """Test an exported file spanning several batches imports back unchanged"""
+        rows = [f'{self.brand},"Vagón, {i}",R{i},furgon,usado,IV,RENFE,2024-01-01,12.5,,Nota {i}' for i in range(1200)]
+        response = requests.post(
+            f"{BASE_URL}/api/import/csv/rolling-stock",
+            data=ROLLING_STOCK_HEADER + "\n".join(rows),
+            headers={"Content-Type": "text/plain"}
+        )
+        assert response.json()["imported_count"] == 1200
+
+        exported = self.export(brand=self.brand)
+        assert len(exported) == 1200
+        assert list(exported[0].keys()) == ["brand", "model", "reference", "stock_type", "condition", "era",
+                                            "railway_company", "purchase_date", "price", "registration_number",
+                                            "notes"]
+        row = next(r for r in exported if r["reference"] == "R7")
+        assert row["model"] == "Vagón, 7"
+        assert row["price"] == "12.5"
+        assert "photo" not in row
+
+        template = requests.get(f"{BASE_URL}/api/import/csv/template/rolling-stock").text
+        assert template.splitlines()[0] == ",".join(exported[0].keys())
+
+        content = requests.get(f"{BASE_URL}/api/export/rolling-stock/csv", params={"brand": self.brand}).content
+        data = requests.post(
+            f"{BASE_URL}/api/import/csv/rolling-stock/upload",
+            params={"mode": "upsert"},
+            files={"file": ("export.csv", content, "text/csv")}
+        ).json()
+        assert (data["created_count"], data["updated_count"], data["unchanged_count"]) == (0, 0, 1200)
+        print("✅ CSV export of 1200 rows imported back unchanged")
+
+    def test_filters(self):
+        """Test list filters narrow the export and unsupported ones are rejected"""
+        rows = [f"{self.brand},Tolva,R1,vagon_mercancias,,IV,RENFE,,,,",
+                f"{self.brand},Talgo,R2,coche_viajeros,,V,RENFE,,,,"]
+        requests.post(f"{BASE_URL}/api/import/csv/rolling-stock",
+                      data=ROLLING_STOCK_HEADER + "\n".join(rows), headers={"Content-Type": "text/plain"})
+
+        assert [r["reference"] for r in self.export(brand=self.brand, type="coche_viajeros")] == ["R2"]
+        assert [r["reference"] for r in self.export(brand=self.brand, era="IV")] == ["R1"]
+
+        response = requests.get(f"{BASE_URL}/api/export/compositions/csv", params={"brand": self.brand})
+        assert response.status_code == 400
+        assert requests.get(f"{BASE_URL}/api/export/wagons/csv").status_code == 404
+
+    def test_other_collections(self):
+        """Test list columns such as sound project sounds are joined with |"""
+        project = requests.post(f"{BASE_URL}/api/sound-projects", json={
+            "name": f"{self.brand} sonido", "decoder_brand": self.brand, "decoder_model": "LokSound 5",
+            "locomotive_type": "diesel", "sounds": ["motor", "bocina"]
+        }).json()
+        try:
+            exported = self.export("sound-projects", brand=self.brand)
+            assert len(exported) == 1
+            assert exported[0]["sounds"] == "motor|bocina"
+        finally:
+            requests.delete(f"{BASE_URL}/api/sound-projects/{project['id']}")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
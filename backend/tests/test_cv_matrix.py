@@ -0,0 +1,104 @@
+"""
+Test suite for the fleet CV comparison matrix.
+Tests GET /api/analysis/cv-matrix: matrix layout, per-CV distributions,
+outliers and invalidation when locomotives change.
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def make_locomotive(decoder_brand, reference, cvs):
+    return {
+        "brand": "TEST_Matrix",
+        "model": "Matrix Loco",
+        "reference": reference,
+        "decoder_brand": decoder_brand,
+        "cv_modifications": [
+            {"cv_number": number, "value": value, "description": f"CV{number}"}
+            for number, value in cvs.items()
+        ]
+    }
+
+
+class TestCVMatrix:
+    """Test GET /api/analysis/cv-matrix"""
+
+    @pytest.fixture(autouse=True)
+    def fleet(self):
+        self.decoder_brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        self.ids = []
+        # Four locomotives tuned alike and one with a much higher CV3
+        for i, cv3 in enumerate([10, 10, 10, 10, 60]):
+            response = requests.post(
+                f"{BASE_URL}/api/locomotives",
+                json=make_locomotive(self.decoder_brand, f"TEST_M{i}", {3: cv3, 4: 8, 29: 6})
+            )
+            assert response.status_code == 200
+            self.ids.append(response.json()["id"])
+        yield
+        for loco_id in self.ids:
+            requests.delete(f"{BASE_URL}/api/locomotives/{loco_id}")
+
+    def get_matrix(self, **params):
+        response = requests.get(
+            f"{BASE_URL}/api/analysis/cv-matrix",
+            params={"decoder_brand": self.decoder_brand, **params}
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    def test_matrix_layout(self):
+        """Test one row per locomotive and one column per requested CV"""
+        data = self.get_matrix(cvs="3,4,5")
+        assert data["cvs"] == [3, 4, 5]
+        assert len(data["locomotives"]) == 5
+        for row in data["locomotives"]:
+            assert row["values"][1] == 8
+            # CV5 was never set
+            assert row["values"][2] is None
+        print("✅ CV matrix has one row per locomotive")
+
+    def test_distributions(self):
+        """Test per-CV counts, statistics and value histograms"""
+        data = self.get_matrix(cvs="3,5")
+        cv3 = data["distributions"]["3"]
+        assert cv3["count"] == 5
+        assert cv3["min"] == 10
+        assert cv3["max"] == 60
+        assert cv3["median"] == 10
+        assert cv3["values"] == {"10": 4, "60": 1}
+        assert data["distributions"]["5"]["count"] == 0
+        assert data["distributions"]["5"]["median"] is None
+
+    def test_outliers(self):
+        """Test the locomotive with a different CV3 is reported as outlier"""
+        data = self.get_matrix()
+        assert data["cvs"] == [2, 3, 4, 5, 6, 29]
+        assert [(o["locomotive_id"], o["cv"], o["value"]) for o in data["outliers"]] == [(self.ids[4], 3, 60)]
+
+    def test_cache_invalidated_on_update(self):
+        """Test the matrix reflects a locomotive edited after it was cached"""
+        self.get_matrix(cvs="3")
+        loco = requests.get(f"{BASE_URL}/api/locomotives/{self.ids[4]}").json()
+        loco["cv_modifications"] = [{"cv_number": 3, "value": 10, "description": "CV3"}]
+        update = {k: v for k, v in loco.items() if k not in ("id", "created_at", "updated_at")}
+        assert requests.put(f"{BASE_URL}/api/locomotives/{self.ids[4]}", json=update).status_code == 200
+
+        data = self.get_matrix(cvs="3")
+        assert data["outliers"] == []
+        assert data["distributions"]["3"]["values"] == {"10": 5}
+
+    def test_invalid_cv_list(self):
+        """Test a malformed CV list returns 400"""
+        response = requests.get(f"{BASE_URL}/api/analysis/cv-matrix", params={"cvs": "3,abc"})
+        assert response.status_code == 400
+        response = requests.get(f"{BASE_URL}/api/analysis/cv-matrix", params={"cvs": "0"})
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
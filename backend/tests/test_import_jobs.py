@@ -0,0 +1,155 @@
+"""
+Test suite for background import jobs.
+Tests the following features:
+- Submitting CSV and JMRI archive imports as jobs
+- Progress, row errors and results streamed over Server-Sent Events
+- Cancellation
+"""
+import pytest
+import requests
+import os
+import io
+import json
+import uuid
+import zipfile
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+ROLLING_STOCK_HEADER = "brand,model,reference,stock_type,condition,era,railway_company,purchase_date,price,notes\n"
+
+JMRI_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<locomotive-config>
+    <locomotive id="{road_number}" mfg="{brand}" roadName="BR 218" roadNumber="{road_number}" dccAddress="{address}">
+        <decoder family="ESU LokPilot V4.0" model="LokPilot micro V4.0"/>
+    </locomotive>
+</locomotive-config>'''
+
+
+def read_events(job_id):
+    """Read the job's event stream until the end event"""
+    events = []
+    with requests.get(f"{BASE_URL}/api/jobs/{job_id}/events", stream=True, timeout=60) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])))
+                if event == "end":
+                    break
+    return events
+
+
+def submit_csv(content, kind="rolling-stock", **params):
+    response = requests.post(
+        f"{BASE_URL}/api/jobs/import/csv/{kind}",
+        params=params,
+        files={"file": ("inventario.csv", content, "text/csv")}
+    )
+    assert response.status_code == 202
+    return response.json()["job_id"]
+
+
+class TestCSVImportJob:
+    """Test POST /api/jobs/import/csv/{kind} and GET /api/jobs/{id}/events"""
+
+    @pytest.fixture(autouse=True)
+    def brand(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        yield
+        backup = requests.get(f"{BASE_URL}/api/backup").json()
+        for item in backup["rolling_stock"]:
+            if item["brand"] == self.brand:
+                requests.delete(f"{BASE_URL}/api/rolling-stock/{item['id']}")
+
+    def test_job_streams_result(self):
+        """Test a CSV job streams its row errors and result and is stored"""
+        rows = [f"{self.brand},Vagón {i},R{i},vagon_mercancias,,,,,," for i in range(20)]
+        rows[4] = f"{self.brand},Sin referencia,,vagon_mercancias,,,,,,"
+        job_id = submit_csv((ROLLING_STOCK_HEADER + "\n".join(rows)).encode("utf-8"))
+
+        events = read_events(job_id)
+        names = [name for name, _ in events]
+        assert names[-1] == "end"
+        assert events[-1][1]["status"] == "completed"
+        assert "Fila 6: Campos requeridos vacíos: reference" in [data["message"] for name, data in events if name == "row_error"]
+        result = next(data for name, data in events if name == "result")
+        assert result["imported_count"] == 19
+        assert result["skipped_count"] == 1
+
+        job = requests.get(f"{BASE_URL}/api/jobs/{job_id}").json()
+        assert job["status"] == "completed"
+        assert job["result"]["imported_count"] == 19
+        assert job_id in [j["id"] for j in requests.get(f"{BASE_URL}/api/jobs").json()]
+
+        # A finished job replays its outcome from the stored document
+        replay = read_events(job_id)
+        assert [name for name, _ in replay] == ["result", "status", "end"]
+        print("✅ CSV import job streamed its result")
+
+    def test_cancel_running_job(self):
+        """Test cancelling a large job stops it before the end of the file"""
+        rows = "\n".join(f"{self.brand},Vagón {i},R{i},vagon_mercancias,,,,,," for i in range(100000))
+        # Upsert on registration_number with no numbers: every row is rejected without writes
+        job_id = submit_csv((ROLLING_STOCK_HEADER + rows).encode("utf-8"), mode="upsert", key="registration_number")
+
+        cancel = requests.post(f"{BASE_URL}/api/jobs/{job_id}/cancel")
+        assert cancel.status_code == 200
+        events = read_events(job_id)
+        assert events[-1][1]["status"] == "cancelled"
+
+        job = requests.get(f"{BASE_URL}/api/jobs/{job_id}").json()
+        assert job["status"] == "cancelled"
+        if job["result"] is not None:
+            assert job["result"]["skipped_count"] < 100000
+
+        assert requests.post(f"{BASE_URL}/api/jobs/{job_id}/cancel").status_code == 409
+
+    def test_invalid_submissions(self):
+        """Test unknown kinds, modes and jobs are rejected"""
+        files = {"file": ("inventario.csv", b"brand\n", "text/csv")}
+        assert requests.post(f"{BASE_URL}/api/jobs/import/csv/wagons", files=files).status_code == 404
+        assert requests.post(f"{BASE_URL}/api/jobs/import/csv/rolling-stock",
+                             params={"mode": "replace"}, files=files).status_code == 400
+        assert requests.get(f"{BASE_URL}/api/jobs/{uuid.uuid4()}").status_code == 404
+        assert requests.get(f"{BASE_URL}/api/jobs/{uuid.uuid4()}/events").status_code == 404
+
+
+class TestJMRIArchiveJob:
+    """Test POST /api/jobs/import/jmri/archive"""
+
+    def test_archive_job(self):
+        """Test a roster ZIP imported as a job reports its progress and result"""
+        brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for i in range(3):
+                archive.writestr(f"roster/{brand}_{i}.xml", JMRI_XML.format(brand=brand, road_number=f"{brand}-{i}", address=218 + i))
+        response = requests.post(
+            f"{BASE_URL}/api/jobs/import/jmri/archive",
+            files={"file": ("roster.zip", buffer.getvalue(), "application/zip")}
+        )
+        assert response.status_code == 202
+
+        events = read_events(response.json()["job_id"])
+        assert events[-1][1]["status"] == "completed"
+        result = next(data for name, data in events if name == "result")
+        assert result["inserted_count"] == 3
+
+        for loco in requests.get(f"{BASE_URL}/api/locomotives").json():
+            if loco["brand"] == brand:
+                requests.delete(f"{BASE_URL}/api/locomotives/{loco['id']}")
+
+    def test_not_a_zip(self):
+        """Test a file that is not a ZIP is rejected before queueing"""
+        response = requests.post(
+            f"{BASE_URL}/api/jobs/import/jmri/archive",
+            files={"file": ("roster.zip", b"not a zip", "application/zip")}
+        )
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
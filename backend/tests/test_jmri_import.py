@@ -6,6 +6,8 @@ Tests the /api/import/jmri endpoint and related features
 import pytest
 import requests
 import os
+import io
+import zipfile
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 
@@ -280,6 +282,266 @@ class TestBackupPage:
         assert len(data["locomotives"]) >= 1
 
 
+class TestJMRIUpsert:
+    """Tests for re-importing a roster without creating duplicates"""
+
+    ROSTER_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+        <locomotive-config>
+            <locomotive id="TEST_Roster_333" mfg="TEST_Upsert" model="UP333" roadName="{road_name}" roadNumber="TEST_UP333" dccAddress="333">
+                <decoder family="ESU LokSound 5" model="LokSound 5 micro"/>
+            </locomotive>
+        </locomotive-config>'''
+
+    def count_upsert_locos(self):
+        locomotives = requests.get(f"{BASE_URL}/api/locomotives").json()
+        return [l for l in locomotives if l.get("brand") == "TEST_Upsert"]
+
+    def test_reimport_updates_instead_of_duplicating(self):
+        """Test importing the same roster twice updates the existing locomotive"""
+        first = requests.post(
+            f"{BASE_URL}/api/import/jmri",
+            json=[self.ROSTER_XML.format(road_name="Upsert v1")]
+        )
+        assert first.status_code == 200
+        assert first.json()["imported_count"] == 1
+
+        second = requests.post(
+            f"{BASE_URL}/api/import/jmri",
+            json=[self.ROSTER_XML.format(road_name="Upsert v2")]
+        )
+        assert second.status_code == 200
+        data = second.json()
+        assert data["inserted_count"] == 0
+        assert data["updated_count"] == 1
+
+        locos = self.count_upsert_locos()
+        assert len(locos) == 1
+        assert locos[0]["model"] == "Upsert v2"
+        assert locos[0]["jmri_id"] == "TEST_Roster_333"
+        print("✅ Re-import updated the existing locomotive")
+
+    def test_duplicates_in_one_batch_collapse(self):
+        """Test the same locomotive twice in one request is written once"""
+        xml = self.ROSTER_XML.format(road_name="Upsert batch")
+        response = requests.post(
+            f"{BASE_URL}/api/import/jmri",
+            params={"identity": "roster_id"},
+            json=[xml, xml]
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["imported_count"] == 1
+        assert data["skipped_count"] == 1
+        assert "Archivo 1" in data["errors"][0]
+        assert data["inserted_count"] + data["updated_count"] == 1
+        assert len(self.count_upsert_locos()) == 1
+
+    def test_reimport_keeps_user_edits(self):
+        """Test re-syncing does not overwrite fields the roster leaves empty or only guesses"""
+        requests.post(f"{BASE_URL}/api/import/jmri", json=[self.ROSTER_XML.format(road_name="Upsert edits")])
+        loco = self.count_upsert_locos()[0]
+        edited = {**loco, "notes": "Revisada en taller", "locomotive_type": "electrica", "condition": "usado"}
+        for field in ("id", "created_at", "updated_at"):
+            edited.pop(field)
+        requests.put(f"{BASE_URL}/api/locomotives/{loco['id']}", json=edited)
+
+        requests.post(f"{BASE_URL}/api/import/jmri", json=[self.ROSTER_XML.format(road_name="Upsert edits v2")])
+        loco = self.count_upsert_locos()[0]
+        assert loco["model"] == "Upsert edits v2"
+        assert loco["notes"] == "Revisada en taller"
+        assert loco["locomotive_type"] == "electrica"
+        assert loco["condition"] == "usado"
+
+    def test_invalid_identity_rejected(self):
+        """Test an unknown identity returns 400"""
+        response = requests.post(
+            f"{BASE_URL}/api/import/jmri",
+            params={"identity": "color"},
+            json=[VALID_JMRI_XML]
+        )
+        assert response.status_code == 400
+
+
+class TestJMRIArchiveImport:
+    """Tests for /api/import/jmri/archive"""
+
+    def make_zip(self, members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, content in members.items():
+                archive.writestr(name, content)
+        return buffer.getvalue()
+
+    def upload(self, content):
+        return requests.post(
+            f"{BASE_URL}/api/import/jmri/archive",
+            files={"file": ("roster.zip", content, "application/zip")}
+        )
+
+    def test_import_roster_folder(self):
+        """Test a ZIP with roster.xml only imports the files it lists"""
+        roster_index = '''<?xml version="1.0" encoding="UTF-8"?>
+        <roster-config>
+            <roster>
+                <locomotive id="BR 218" fileName="BR_218.xml"/>
+                <locomotive id="252" fileName="252.xml"/>
+            </roster>
+        </roster-config>'''
+        content = self.make_zip({
+            "roster/roster.xml": roster_index,
+            "roster/BR_218.xml": VALID_JMRI_XML,
+            "roster/252.xml": VALID_JMRI_XML_ELECTRIC,
+            "roster/not_listed.xml": INVALID_XML,
+        })
+        response = self.upload(content)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["imported_count"] == 2
+        assert data["skipped_count"] == 0
+        brands = {loco["brand"] for loco in data["locomotives"]}
+        assert brands == {"TEST_ESU", "TEST_Roco"}
+        print("✅ Roster ZIP imported")
+
+    def test_import_zip_without_index(self):
+        """Test a ZIP without roster.xml imports every XML file"""
+        content = self.make_zip({
+            "BR_218.xml": VALID_JMRI_XML,
+            "broken.xml": MALFORMED_XML,
+        })
+        response = self.upload(content)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["imported_count"] == 1
+        assert data["skipped_count"] == 1
+        assert "broken.xml" in data["errors"][0]
+
+    def test_missing_listed_file_reported(self):
+        """Test files listed in roster.xml but missing from the ZIP are reported"""
+        roster_index = '''<roster-config><roster>
+            <locomotive id="missing" fileName="missing.xml"/>
+            <locomotive id="BR 218" fileName="BR_218.xml"/>
+        </roster></roster-config>'''
+        content = self.make_zip({"roster.xml": roster_index, "BR_218.xml": VALID_JMRI_XML})
+        data = self.upload(content).json()
+        assert data["imported_count"] == 1
+        assert any("missing.xml" in error for error in data["errors"])
+
+    def test_not_a_zip_rejected(self):
+        """Test uploading something that is not a ZIP returns 400"""
+        response = self.upload(b"not a zip")
+        assert response.status_code == 400
+
+
+class TestJMRIRosterSync:
+    """
+    Tests for the watched roster folder.
+    The sync tests need the server's JMRI_ROSTER_DIR to be reachable from the
+    test process (set JMRI_ROSTER_DIR here too) and a long JMRI_WATCH_INTERVAL
+    so the watcher does not sync between steps.
+    """
+
+    ROSTER_DIR = os.environ.get('JMRI_ROSTER_DIR', '')
+    SYNC_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+        <locomotive-config>
+            <locomotive id="TEST_Sync_{n}" mfg="TEST_Sync" model="SY{n}" roadName="{road_name}" dccAddress="6{n}"/>
+        </locomotive-config>'''
+
+    @pytest.fixture
+    def roster_dir(self):
+        status = requests.get(f"{BASE_URL}/api/import/jmri/sync").json()
+        if not status["enabled"] or not self.ROSTER_DIR or not os.path.isdir(self.ROSTER_DIR):
+            pytest.skip("JMRI_ROSTER_DIR not configured for the server and the tests")
+        self.files = []
+        yield self.ROSTER_DIR
+        for path in self.files:
+            if os.path.exists(path):
+                os.remove(path)
+        self.sync()
+
+    def write(self, name, content):
+        path = os.path.join(self.ROSTER_DIR, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        self.files.append(path)
+        return path
+
+    def sync(self):
+        response = requests.post(f"{BASE_URL}/api/import/jmri/sync")
+        assert response.status_code == 200
+        return response.json()
+
+    def synced_model(self, n):
+        locomotives = requests.get(f"{BASE_URL}/api/locomotives").json()
+        return next(l["model"] for l in locomotives if l.get("reference") == f"SY{n}")
+
+    def test_sync_status(self):
+        """Test GET /api/import/jmri/sync reports the watcher configuration"""
+        response = requests.get(f"{BASE_URL}/api/import/jmri/sync")
+        assert response.status_code == 200
+        data = response.json()
+        assert "enabled" in data
+        assert "interval_seconds" in data
+        assert "tracked_files" in data
+        assert "failed_files" in data
+
+    def test_sync_disabled(self):
+        """Test POST /api/import/jmri/sync returns 400 without a roster folder"""
+        status = requests.get(f"{BASE_URL}/api/import/jmri/sync").json()
+        if status["enabled"]:
+            pytest.skip("JMRI_ROSTER_DIR is configured")
+        assert requests.post(f"{BASE_URL}/api/import/jmri/sync").status_code == 400
+
+    def test_new_changed_and_touched_files(self, roster_dir):
+        """Test only new or modified files are parsed; touched files are not"""
+        path = self.write("TEST_sync_1.xml", self.SYNC_XML.format(n=1, road_name="Sync v1"))
+        first = self.sync()
+        assert first["changed"] >= 1
+        assert self.synced_model(1) == "Sync v1"
+
+        idle = self.sync()
+        assert idle["changed"] == 0
+        assert idle["scanned"] == first["scanned"]
+
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+        touched = self.sync()
+        assert touched["changed"] == 0
+
+        self.write("TEST_sync_1.xml", self.SYNC_XML.format(n=1, road_name="Sync v2"))
+        changed = self.sync()
+        assert changed["changed"] == 1
+        assert changed["updated"] == 1
+        assert self.synced_model(1) == "Sync v2"
+        print("✅ Roster sync only re-parsed the modified file")
+
+    def test_failed_file_error_kept_until_fixed(self, roster_dir):
+        """Test a broken file stays failed when only touched and imports once fixed"""
+        path = self.write("TEST_sync_2.xml", MALFORMED_XML)
+        result = self.sync()
+        assert any("TEST_sync_2.xml" in error for error in result["errors"])
+
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+        self.sync()
+        failed = requests.get(f"{BASE_URL}/api/import/jmri/sync").json()["failed_files"]
+        assert "TEST_sync_2.xml" in [f["file_name"] for f in failed]
+
+        self.write("TEST_sync_2.xml", self.SYNC_XML.format(n=2, road_name="Sync fixed"))
+        fixed = self.sync()
+        assert fixed["imported"] == 1
+        failed = requests.get(f"{BASE_URL}/api/import/jmri/sync").json()["failed_files"]
+        assert "TEST_sync_2.xml" not in [f["file_name"] for f in failed]
+
+    def test_removed_file_forgotten(self, roster_dir):
+        """Test removing a file drops its sync state but keeps the locomotive"""
+        path = self.write("TEST_sync_3.xml", self.SYNC_XML.format(n=3, road_name="Sync removed"))
+        self.sync()
+        os.remove(path)
+        result = self.sync()
+        assert result["removed"] == 1
+        assert self.synced_model(3) == "Sync removed"
+
+
 class TestCleanup:
     """Cleanup test data after tests"""
     
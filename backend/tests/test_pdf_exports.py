@@ -0,0 +1,270 @@
+"""
+Test suite for PDF exports rendered in the worker pool.
+Tests the following features:
+- List and per-item PDFs rendered off the event loop
+- Compositions PDF listing the composition's locomotive and wagons
+- Concurrent exports either render or are refused with 503 + Retry-After
+- Cached PDFs served with ETags and invalidated by writes
+- Large PDFs streamed from disk in chunks
+- Bulk data sheets as one merged PDF or a ZIP of per-item PDFs
+"""
+import pytest
+import requests
+import os
+import re
+import uuid
+import base64
+import io
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+def pdf_text(content):
+    """Decoded page content streams (ReportLab writes them ASCII85 + Flate encoded)"""
+    text = b""
+    for stream in re.findall(rb"stream\r?\n(.*?)endstream", content, re.S):
+        stream = stream.strip()
+        if stream.endswith(b"~>"):
+            text += zlib.decompress(base64.a85decode(stream[:-2]))
+    return text.decode("latin-1")
+
+
+class TestPDFRenderPool:
+    """Test the PDF endpoints render through the pool"""
+
+    @pytest.fixture(autouse=True)
+    def collection(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        loco = requests.post(f"{BASE_URL}/api/locomotives", json={
+            "brand": self.brand, "model": "Serie 252", "reference": "PDF1", "dcc_address": "52"
+        }).json()
+        wagons = [requests.post(f"{BASE_URL}/api/rolling-stock", json={
+            "brand": self.brand, "model": f"Coche {i}", "reference": f"PDFW{i}"
+        }).json() for i in range(2)]
+        composition = requests.post(f"{BASE_URL}/api/compositions", json={
+            "name": f"{self.brand} Talgo",
+            "locomotive_id": loco["id"],
+            "wagons": [{"wagon_id": wagons[1]["id"], "position": 1}, {"wagon_id": wagons[0]["id"], "position": 2}]
+        }).json()
+        self.loco, self.wagons = loco, wagons
+        yield
+        requests.delete(f"{BASE_URL}/api/compositions/{composition['id']}")
+        requests.delete(f"{BASE_URL}/api/locomotives/{loco['id']}")
+        for wagon in wagons:
+            requests.delete(f"{BASE_URL}/api/rolling-stock/{wagon['id']}")
+
+    def get_pdf(self, path, **params):
+        response = requests.get(f"{BASE_URL}/api{path}", params=params)
+        assert response.status_code == 200
+        assert "application/pdf" in response.headers["content-type"]
+        assert response.content.startswith(b"%PDF")
+        return pdf_text(response.content)
+
+    def test_list_reports(self):
+        """Test the filtered list reports include the matching items"""
+        assert "Serie 252" in self.get_pdf("/export/locomotives/pdf", brand=self.brand)
+        assert "PDFW1" in self.get_pdf("/export/rolling-stock/pdf", search=self.brand)
+        assert "PDF1" in self.get_pdf("/export/catalog/pdf")
+
+    def test_item_sheets(self):
+        """Test the per-item data sheets"""
+        assert "Serie 252" in self.get_pdf(f"/export/locomotive/{self.loco['id']}/pdf")
+        assert "Coche 0" in self.get_pdf(f"/export/rolling-stock/{self.wagons[0]['id']}/pdf")
+        response = requests.get(f"{BASE_URL}/api/export/rolling-stock/{uuid.uuid4()}/pdf")
+        assert response.status_code == 404
+
+    def test_compositions_list_locomotive_and_wagons(self):
+        """Test compositions show their locomotive and wagons in position order"""
+        pdf = self.get_pdf("/export/compositions/pdf")
+        assert f"{self.brand} Serie 252" in pdf
+        # Parentheses are escaped in PDF strings
+        first = pdf.index(f"{self.brand} Coche 1 \\(PDFW1\\)")
+        second = pdf.index(f"{self.brand} Coche 0 \\(PDFW0\\)")
+        assert first < second
+        print("✅ Compositions PDF lists locomotive and wagons")
+
+    def test_concurrent_exports(self):
+        """Test a burst of exports renders or is refused, never fails"""
+        def export(_):
+            return requests.get(f"{BASE_URL}/api/export/catalog/pdf")
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            responses = list(pool.map(export, range(16)))
+        for response in responses:
+            assert response.status_code in (200, 503)
+            if response.status_code == 503:
+                assert response.headers["retry-after"] == "5"
+        assert any(response.status_code == 200 for response in responses)
+
+        # The API keeps answering while exports render
+        assert requests.get(f"{BASE_URL}/api/locomotives/{self.loco['id']}").status_code == 200
+
+
+class TestPDFCache:
+    """Test cached PDF exports and their ETags"""
+
+    @pytest.fixture(autouse=True)
+    def locomotive(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        self.loco = requests.post(f"{BASE_URL}/api/locomotives", json={
+            "brand": self.brand, "model": "Serie 269", "reference": "CACHE1", "dcc_address": "69"
+        }).json()
+        yield
+        requests.delete(f"{BASE_URL}/api/locomotives/{self.loco['id']}")
+
+    def export(self, headers=None, **params):
+        return requests.get(f"{BASE_URL}/api/export/locomotives/pdf",
+                            params={"brand": self.brand, **params}, headers=headers or {})
+
+    def test_repeat_download_is_cached(self):
+        """Test the second identical export is served from the cache"""
+        first = self.export()
+        assert first.status_code == 200
+        assert first.headers["x-pdf-cache"] == "miss"
+        second = self.export()
+        assert second.headers["x-pdf-cache"] == "hit"
+        assert second.headers["etag"] == first.headers["etag"]
+        assert second.content == first.content
+        assert "attachment" in second.headers["content-disposition"]
+
+    def test_if_none_match(self):
+        """Test a matching If-None-Match returns 304 without a body"""
+        etag = self.export().headers["etag"]
+        response = self.export(headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert self.export(headers={"If-None-Match": '"other"'}).status_code == 200
+
+    def test_normalized_parameters(self):
+        """Test equivalent parameters share an entry and different ones don't"""
+        etag = self.export().headers["etag"]
+        assert self.export(condition="all", sort_order="asc").headers["etag"] == etag
+        assert self.export(sort_order="desc").headers["etag"] != etag
+        assert self.export(sort_order="DESC").headers["etag"] == self.export(sort_order="desc").headers["etag"]
+
+    def test_write_invalidates(self):
+        """Test editing a locomotive changes the ETag and the content"""
+        first = self.export()
+        update = {k: v for k, v in self.loco.items() if k not in ("id", "created_at", "updated_at")}
+        update["model"] = "Serie 269 renovada"
+        assert requests.put(f"{BASE_URL}/api/locomotives/{self.loco['id']}", json=update).status_code == 200
+
+        second = self.export(headers={"If-None-Match": first.headers["etag"]})
+        assert second.status_code == 200
+        assert second.headers["etag"] != first.headers["etag"]
+        assert "Serie 269 renovada" in pdf_text(second.content)
+        print("✅ Locomotive edit invalidated the cached PDF")
+
+
+class TestPDFStreaming:
+    """Test large PDFs are streamed whole from the file the worker wrote"""
+
+    @pytest.fixture(autouse=True)
+    def locomotives(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        rows = [f"{self.brand},Serie {i},STREAM{i},{i + 1}" for i in range(600)]
+        response = requests.post(
+            f"{BASE_URL}/api/import/csv/locomotives",
+            data="brand,model,reference,dcc_address\n" + "\n".join(rows),
+            headers={"Content-Type": "text/plain"}
+        )
+        assert response.json()["imported_count"] == 600
+        yield
+        backup = requests.get(f"{BASE_URL}/api/backup").json()
+        for loco in backup["locomotives"]:
+            if loco["brand"] == self.brand:
+                requests.delete(f"{BASE_URL}/api/locomotives/{loco['id']}")
+
+    def test_large_export_streams(self):
+        """Test a multi-page export arrives complete, with its length, on miss and hit"""
+        url = f"{BASE_URL}/api/export/locomotives/pdf"
+        with requests.get(url, params={"brand": self.brand}, stream=True) as response:
+            assert response.status_code == 200
+            assert response.headers["x-pdf-cache"] == "miss"
+            content = b"".join(response.iter_content(16 * 1024))
+        assert int(response.headers["content-length"]) == len(content)
+        assert content.startswith(b"%PDF") and content.rstrip().endswith(b"%%EOF")
+        assert "STREAM599" in pdf_text(content)
+
+        cached = requests.get(url, params={"brand": self.brand})
+        assert cached.headers["x-pdf-cache"] == "hit"
+        assert int(cached.headers["content-length"]) == len(cached.content)
+        assert cached.content == content
+        print(f"✅ Streamed a {len(content)} byte PDF")
+
+
+class TestBulkSheets:
+    """Test POST /api/export/sheets"""
+
+    @pytest.fixture(autouse=True)
+    def items(self):
+        self.brand = f"TEST_{uuid.uuid4().hex[:8]}"
+        self.locos = [requests.post(f"{BASE_URL}/api/locomotives", json={
+            "brand": self.brand, "model": f"Serie {269 + i}", "reference": f"SHEET{i}", "dcc_address": str(10 + i)
+        }).json() for i in range(3)]
+        self.wagons = [requests.post(f"{BASE_URL}/api/rolling-stock", json={
+            "brand": self.brand, "model": "Coche cama", "reference": f"SHEETW{i}", "stock_type": "coche_viajeros"
+        }).json() for i in range(2)]
+        yield
+        for loco in self.locos:
+            requests.delete(f"{BASE_URL}/api/locomotives/{loco['id']}")
+        for wagon in self.wagons:
+            requests.delete(f"{BASE_URL}/api/rolling-stock/{wagon['id']}")
+
+    def export(self, **body):
+        return requests.post(f"{BASE_URL}/api/export/sheets", json=body)
+
+    def test_merged_pdf(self):
+        """Test the merged PDF has every requested sheet, in the requested order"""
+        response = self.export(locomotive_ids=[self.locos[2]["id"], self.locos[0]["id"]],
+                               rolling_stock_ids=[self.wagons[1]["id"]])
+        assert response.status_code == 200
+        assert "application/pdf" in response.headers["content-type"]
+        assert response.content.count(b"/Type /Page\n") == 3
+        text = pdf_text(response.content)
+        assert text.index("Serie 271") < text.index("Serie 269") < text.index("SHEETW1")
+        assert "Serie 270" not in text and "SHEETW0" not in text
+
+        again = self.export(locomotive_ids=[self.locos[2]["id"], self.locos[0]["id"]],
+                            rolling_stock_ids=[self.wagons[1]["id"]])
+        assert again.headers["x-pdf-cache"] == "hit"
+        print("✅ Merged PDF with 3 sheets")
+
+    def test_zip_by_filter(self):
+        """Test the ZIP has one PDF per item matching the filter"""
+        response = self.export(filter={"brand": self.brand}, format="zip")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/zip"
+        archive = zipfile.ZipFile(io.BytesIO(response.content))
+        names = sorted(archive.namelist())
+        assert names == ["locomotora_SHEET0.pdf", "locomotora_SHEET1.pdf", "locomotora_SHEET2.pdf",
+                         "material_SHEETW0.pdf", "material_SHEETW1.pdf"]
+        assert "Serie 270" in pdf_text(archive.read("locomotora_SHEET1.pdf"))
+
+        # Members are the per-item sheets
+        single = requests.get(f"{BASE_URL}/api/export/locomotive/{self.locos[1]['id']}/pdf")
+        assert single.headers["x-pdf-cache"] == "hit"
+        assert single.content == archive.read("locomotora_SHEET1.pdf")
+
+        only_stock = self.export(filter={"brand": self.brand, "type": "coche_viajeros"},
+                                 kinds=["rolling-stock"], format="zip")
+        assert len(zipfile.ZipFile(io.BytesIO(only_stock.content)).namelist()) == 2
+
+    def test_invalid_requests(self):
+        """Test missing ids, bad formats and ambiguous selections are rejected"""
+        missing = str(uuid.uuid4())
+        response = self.export(locomotive_ids=[self.locos[0]["id"], missing])
+        assert response.status_code == 404
+        assert missing in response.json()["detail"]
+        assert self.export(locomotive_ids=[self.locos[0]["id"]], format="docx").status_code == 400
+        assert self.export().status_code == 400
+        assert self.export(locomotive_ids=[self.locos[0]["id"]], filter={"brand": self.brand}).status_code == 400
+        assert self.export(filter={"color": "rojo"}).status_code == 400
+        assert self.export(filter={"brand": f"TEST_{uuid.uuid4().hex[:8]}"}).status_code == 404
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])